@@ -0,0 +1,450 @@
+"""
+Local stand-in for the qBittorrent WebUI API, backed by a generated torrent population.
+Implements the endpoints qbit-cleaner uses, with configurable latency and per-endpoint call counters.
+
+    python -m benchmarks.fake_qbittorrent --torrents 20000 --port 8080 --latency-ms 5
+
+The counters are served as json on GET /__stats and reset with POST /__reset_stats.
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Optional
+from urllib.parse import parse_qs, urlsplit
+
+# Only for type hints, importing src needs a config
+if TYPE_CHECKING:
+    from benchmarks.generators import SyntheticTree
+
+
+APP_VERSION = "v5.0.0"
+WEB_API_VERSION = "2.11.2"
+
+
+@dataclass
+class FakeTorrent:
+    info: dict[str, Any]
+    trackers: list[dict[str, Any]]
+    file_names: list[str]
+    changed_rid: int = 0
+
+
+@dataclass
+class FakeQbittorrentState:
+    torrents: dict[str, FakeTorrent] = field(default_factory=dict)
+    rid: int = 1
+    # (rid, hash) of every removed torrent, so sync/maindata can send them as torrents_removed
+    removed: list[tuple[int, str]] = field(default_factory=list)
+    call_counts: Counter = field(default_factory=Counter)
+    deleted_with_files: set[str] = field(default_factory=set)
+    sessions: set[str] = field(default_factory=set)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+    def touch(self, torrent_hash: str, **changes: Any) -> None:
+        """
+        Changes fields of a torrent, like qbittorrent does while it runs (seeding time, ratio, state...)
+        """
+        with self.lock:
+            self.rid += 1
+            torrent = self.torrents[torrent_hash]
+            torrent.info.update(changes)
+            torrent.changed_rid = self.rid
+
+
+    def add_torrents(self, torrents: dict[str, FakeTorrent]) -> None:
+        with self.lock:
+            self.rid += 1
+            for torrent_hash, torrent in torrents.items():
+                torrent.changed_rid = self.rid
+                self.torrents[torrent_hash] = torrent
+
+
+    def rename_file(self, torrent_hash: str, file_name: str, new_file_name: str) -> None:
+        """
+        Renames a file of a torrent like torrents/renameFile, content_path and save_path stay the same
+        """
+        with self.lock:
+            torrent = self.torrents[torrent_hash]
+            torrent.file_names = [new_file_name if name == file_name else name for name in torrent.file_names]
+
+
+    def touch_random(self, count: int, seed: int = 0) -> list[str]:
+        """
+        Advances the seeding time of `count` random torrents
+
+        Returns:
+            list: The changed hashes
+        """
+        rng = random.Random(seed)
+        with self.lock:
+            hashes = rng.sample(sorted(self.torrents), min(count, len(self.torrents)))
+        for torrent_hash in hashes:
+            self.touch(torrent_hash=torrent_hash, seeding_time=self.torrents[torrent_hash].info["seeding_time"] + 60)
+        return hashes
+
+
+class TorrentPopulation:
+    """
+    Generates torrents with the fields qbit-cleaner reads. A fraction of them has only not working trackers,
+    is stopped, incomplete or protected, so every job has something to do.
+    """
+    categories: list[str] = ["movies", "tv", "music", "books", "games", "misc"]
+
+    def __init__(self, seed: int = 0) -> None:
+        self.random = random.Random(seed)
+
+
+    def generate(
+        self,
+        torrent_count: int,
+        torrents_path: str = "/data/torrents",
+        files_per_torrent: int = 4,
+        broken_tracker_fraction: float = 0.1,
+        stopped_fraction: float = 0.05,
+        incomplete_fraction: float = 0.05,
+        protected_fraction: float = 0.02,
+        tree: Optional["SyntheticTree"] = None,
+    ) -> dict[str, FakeTorrent]:
+        """
+        Args:
+            torrent_count (int): How many torrents to create, ignored if a tree is given
+            torrents_path (str): The (not necessarily existing) dir the content paths are in
+            files_per_torrent (int): How many files every torrent has, ignored if a tree is given
+            broken_tracker_fraction (float): Fraction of torrents without a working tracker
+            stopped_fraction (float): Fraction of stopped torrents
+            incomplete_fraction (float): Fraction of not completed torrents
+            protected_fraction (float): Fraction of torrents with the protected tag
+            tree (SyntheticTree): Use the torrents of a generated tree, so content paths and files exist on disk
+
+        Returns:
+            dict: The torrents per hash
+        """
+        files_by_content_path: dict[str, list[str]] = {}
+        if tree:
+            content_paths: list[str] = tree.content_paths
+            tree_content_paths: set[str] = set(content_paths)
+            for file_path in tree.known_paths:
+                # Files are in the content path or nested in it
+                content_path = file_path
+                while content_path not in tree_content_paths and content_path != os.path.dirname(content_path):
+                    content_path = os.path.dirname(content_path)
+                files_by_content_path.setdefault(content_path, []).append(file_path)
+        else:
+            content_paths = []
+            for i in range(torrent_count):
+                category = self.categories[i % len(self.categories)]
+                if files_per_torrent == 1:
+                    content_path = os.path.join(torrents_path, category, f"torrent-{i}.mkv")
+                    files_by_content_path[content_path] = [content_path]
+                else:
+                    content_path = os.path.join(torrents_path, category, f"torrent-{i}")
+                    files_by_content_path[content_path] = [os.path.join(content_path, f"file-{j}.mkv") for j in range(files_per_torrent)]
+                content_paths.append(content_path)
+
+        now = int(time.time())
+        torrents: dict[str, FakeTorrent] = {}
+        for i, content_path in enumerate(content_paths):
+            torrent_hash = f"{self.random.getrandbits(160):040x}"
+            save_path = os.path.dirname(content_path)
+            name = os.path.basename(content_path)
+            file_paths = sorted(files_by_content_path.get(content_path, [content_path]))
+            # Like torrents_files, file names of multi file torrents start with the name of the torrent
+            file_names = [os.path.relpath(file_path, save_path) for file_path in file_paths]
+
+            is_broken = self.random.random() < broken_tracker_fraction
+            is_stopped = self.random.random() < stopped_fraction
+            is_incomplete = self.random.random() < incomplete_fraction
+            is_protected = self.random.random() < protected_fraction
+            added_on = now - self.random.randint(60 * 60, 400 * 24 * 60 * 60)
+            completion_on = -1 if is_incomplete else added_on + self.random.randint(60, 24 * 60 * 60)
+            total_size = self.random.randint(50 * 1024 * 1024, 50 * 1024 * 1024 * 1024)
+            tracker_url = f"https://tracker-{i % 7}.example.org/announce"
+
+            if is_incomplete:
+                state = "stoppedDL" if is_stopped else "downloading"
+            else:
+                state = "stoppedUP" if is_stopped else "stalledUP"
+            info: dict[str, Any] = {
+                "hash": torrent_hash,
+                "infohash_v1": torrent_hash,
+                "name": name,
+                "category": self.categories[i % len(self.categories)],
+                "tags": "protected" if is_protected else "",
+                "state": state,
+                "save_path": save_path,
+                "content_path": content_path,
+                "tracker": "" if is_broken else tracker_url,
+                "trackers_count": 1,
+                "added_on": added_on,
+                "completion_on": completion_on,
+                "seeding_time": 0 if is_incomplete else now - completion_on,
+                "ratio": round(self.random.uniform(0, 5), 3),
+                "size": total_size,
+                "total_size": total_size,
+                "progress": 0.5 if is_incomplete else 1,
+                "num_seeds": 0,
+                "num_leechs": 0,
+            }
+            # DHT, PeX and LSD are disabled, like for torrents of private trackers
+            trackers: list[dict[str, Any]] = [
+                {"url": url, "status": 0, "tier": -1, "num_peers": 0, "num_seeds": 0, "num_leeches": 0, "num_downloaded": 0, "msg": ""}
+                for url in ("** [DHT] **", "** [PeX] **", "** [LSD] **")
+            ]
+            trackers.append({
+                "url": tracker_url,
+                "status": 4 if is_broken else 2,
+                "tier": 0,
+                "num_peers": 0,
+                "num_seeds": 0,
+                "num_leeches": 0,
+                "num_downloaded": 0,
+                "msg": "unregistered torrent" if is_broken else "",
+            })
+            torrents[torrent_hash] = FakeTorrent(info=info, trackers=trackers, file_names=file_names)
+        return torrents
+
+
+class FakeQbittorrentHandler(BaseHTTPRequestHandler):
+    server: "FakeQbittorrentServer"
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, with nagle every keep-alive request would wait for a delayed ack
+    disable_nagle_algorithm = True
+
+
+    def do_GET(self) -> None:
+        self.__handle()
+
+
+    def do_POST(self) -> None:
+        self.__handle()
+
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+    def __handle(self) -> None:
+        url = urlsplit(self.path)
+        params: dict[str, str] = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        content_length = int(self.headers.get("Content-Length") or 0)
+        if content_length:
+            body = self.rfile.read(content_length).decode()
+            params.update({key: values[-1] for key, values in parse_qs(body).items()})
+
+        state = self.server.state
+        endpoint = url.path.removeprefix("/api/v2/")
+        if endpoint == "/__stats":
+            with state.lock:
+                self.__send_json(data={"call_counts": dict(state.call_counts), "torrents": len(state.torrents), "rid": state.rid})
+            return
+        if endpoint == "/__reset_stats":
+            with state.lock:
+                state.call_counts.clear()
+            self.__send_text(text="Ok.")
+            return
+
+        with state.lock:
+            state.call_counts[endpoint] += 1
+        if self.server.latency_seconds > 0:
+            time.sleep(self.server.latency_seconds)
+
+        if endpoint == "auth/login":
+            if params.get("username") != self.server.username or params.get("password") != self.server.password:
+                self.__send_text(text="Fails.")
+                return
+            sid = secrets.token_hex(16)
+            with state.lock:
+                state.sessions.add(sid)
+            self.__send_text(text="Ok.", headers={"Set-Cookie": f"SID={sid}; HttpOnly; path=/"})
+            return
+        if not self.__is_authorized():
+            self.__send_text(text="Forbidden", status=403)
+            return
+
+        match endpoint:
+            case "auth/logout":
+                self.__send_text(text="")
+            case "app/version":
+                self.__send_text(text=APP_VERSION)
+            case "app/webapiVersion":
+                self.__send_text(text=WEB_API_VERSION)
+            case "torrents/info":
+                hashes: Optional[set[str]] = set(params["hashes"].split("|")) if params.get("hashes") else None
+                with state.lock:
+                    torrents = [dict(torrent.info) for torrent_hash, torrent in state.torrents.items() if hashes is None or torrent_hash in hashes]
+                self.__send_json(data=torrents)
+            case "torrents/trackers" | "torrents/files":
+                with state.lock:
+                    torrent: Optional[FakeTorrent] = state.torrents.get(params.get("hash", ""))
+                    if torrent is None:
+                        data: Any = None
+                    elif endpoint == "torrents/trackers":
+                        data = [dict(tracker) for tracker in torrent.trackers]
+                    else:
+                        data = [
+                            {"index": i, "name": file_name, "size": 0, "progress": 1, "priority": 1, "is_seed": True, "piece_range": [0, 0], "availability": 1}
+                            for i, file_name in enumerate(torrent.file_names)
+                        ]
+                if data is None:
+                    self.__send_text(text="Not Found", status=404)
+                else:
+                    self.__send_json(data=data)
+            case "torrents/stop" | "torrents/pause":
+                for torrent_hash in self.__get_hashes(params=params):
+                    is_complete = state.torrents[torrent_hash].info["progress"] >= 1
+                    state.touch(torrent_hash=torrent_hash, state="stoppedUP" if is_complete else "stoppedDL")
+                self.__send_text(text="")
+            case "torrents/delete":
+                delete_files = params.get("deleteFiles", "false").lower() == "true"
+                torrent_hashes = self.__get_hashes(params=params)
+                with state.lock:
+                    for torrent_hash in torrent_hashes:
+                        state.rid += 1
+                        del state.torrents[torrent_hash]
+                        state.removed.append((state.rid, torrent_hash))
+                        if delete_files:
+                            state.deleted_with_files.add(torrent_hash)
+                self.__send_text(text="")
+            case "sync/maindata":
+                self.__send_json(data=self.__get_maindata(rid=int(params.get("rid") or 0)))
+            case _:
+                self.__send_text(text="Not Found", status=404)
+
+
+    def __get_maindata(self, rid: int) -> dict[str, Any]:
+        state = self.server.state
+        with state.lock:
+            # Like qbittorrent, an unknown rid gets a full update
+            is_full_update = rid <= 0 or rid > state.rid
+            torrents: dict[str, dict[str, Any]] = {
+                torrent_hash: {key: value for key, value in torrent.info.items() if key != "hash"}
+                for torrent_hash, torrent in state.torrents.items()
+                if is_full_update or torrent.changed_rid > rid
+            }
+            removed_hashes: list[str] = [] if is_full_update else [torrent_hash for removed_rid, torrent_hash in state.removed if removed_rid > rid]
+            data: dict[str, Any] = {"rid": state.rid, "torrents": torrents}
+            if is_full_update:
+                data.update({"full_update": True, "categories": {}, "tags": [], "server_state": {}})
+            if removed_hashes:
+                data["torrents_removed"] = removed_hashes
+            return data
+
+
+    def __get_hashes(self, params: dict[str, str]) -> list[str]:
+        state = self.server.state
+        with state.lock:
+            if params.get("hashes") == "all":
+                return list(state.torrents)
+            return [torrent_hash for torrent_hash in params.get("hashes", "").split("|") if torrent_hash in state.torrents]
+
+
+    def __is_authorized(self) -> bool:
+        cookies: dict[str, str] = {}
+        for cookie in (self.headers.get("Cookie") or "").split(";"):
+            key, _, value = cookie.strip().partition("=")
+            cookies[key] = value
+        with self.server.state.lock:
+            return cookies.get("SID") in self.server.state.sessions
+
+
+    def __send_json(self, data: Any) -> None:
+        self.__send(body=json.dumps(data).encode(), content_type="application/json")
+
+
+    def __send_text(self, text: str, status: int = 200, headers: dict[str, str] = {}) -> None:
+        self.__send(body=text.encode(), content_type="text/plain; charset=UTF-8", status=status, headers=headers)
+
+
+    def __send(self, body: bytes, content_type: str, status: int = 200, headers: dict[str, str] = {}) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeQbittorrentServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, torrents: dict[str, FakeTorrent], host: str = "127.0.0.1", port: int = 0, latency_seconds: float = 0, username: str = "admin", password: str = "adminadmin") -> None:
+        super().__init__((host, port), FakeQbittorrentHandler)
+        self.state = FakeQbittorrentState(torrents=torrents)
+        self.latency_seconds = latency_seconds
+        self.username = username
+        self.password = password
+        self.thread: Optional[threading.Thread] = None
+
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+    def start(self) -> None:
+        """
+        Serves in a background thread
+        """
+        self.thread = threading.Thread(target=self.serve_forever, name="fake-qbittorrent", daemon=True)
+        self.thread.start()
+
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+    def get_call_counts(self) -> dict[str, int]:
+        with self.state.lock:
+            return dict(self.state.call_counts)
+
+
+    def reset_call_counts(self) -> None:
+        with self.state.lock:
+            self.state.call_counts.clear()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Local stand-in for the qBittorrent WebUI API")
+    parser.add_argument("--torrents", type=int, default=20000)
+    parser.add_argument("--files-per-torrent", type=int, default=4)
+    parser.add_argument("--torrents-path", default="/data/torrents")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added to every request")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="adminadmin")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torrents = TorrentPopulation(seed=args.seed).generate(torrent_count=args.torrents, torrents_path=args.torrents_path, files_per_torrent=args.files_per_torrent)
+    server = FakeQbittorrentServer(
+        torrents=torrents,
+        host=args.host,
+        port=args.port,
+        latency_seconds=args.latency_ms / 1000,
+        username=args.username,
+        password=args.password,
+    )
+    print(f"Serving {len(torrents)} torrents on http://{args.host}:{server.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import os
+import random
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from src.utils.db_manager import DbManager
+from src.utils.strike_utils import StrikeType, StrikeUtils
+
+
+@dataclass
+class SyntheticTree:
+    data_path: str
+    torrents_path: str
+    media_path: str
+    # Content path of every torrent (a dir, or the file for single file torrents)
+    content_paths: list[str] = field(default_factory=list)
+    # Every file that belongs to a torrent, like DeleteOrphaned.get_qbit_file_paths returns them
+    known_paths: set[str] = field(default_factory=set)
+    # Content paths that have at least one file hard linked into the media path
+    linked_content_paths: set[str] = field(default_factory=set)
+    # Files and empty dirs that don't belong to any torrent
+    orphan_paths: set[str] = field(default_factory=set)
+
+
+class TreeGenerator:
+    """
+    Generates a torrents and media path like the ones qbit-cleaner works on.
+    Torrents are spread over category dirs, files are empty (only the tree shape matters for the jobs).
+    """
+    def __init__(self, seed: int = 0) -> None:
+        self.random = random.Random(seed)
+
+
+    def generate(self, root_path: str, torrent_count: int, files_per_torrent: int, hardlink_fraction: float, orphan_fraction: float) -> SyntheticTree:
+        """
+        Args:
+            root_path (str): The (empty) dir the data path is created in
+            torrent_count (int): How many torrents to create
+            files_per_torrent (int): How many files every torrent has, 1 creates single file torrents
+            hardlink_fraction (float): Fraction of torrents that are hard linked into the media path
+            orphan_fraction (float): Orphans to create, relative to torrent_count (half files, half dirs)
+
+        Returns:
+            SyntheticTree: The paths of the generated tree
+        """
+        data_path = os.path.join(root_path, "data")
+        tree = SyntheticTree(
+            data_path=data_path,
+            torrents_path=os.path.join(data_path, "torrents"),
+            media_path=os.path.join(data_path, "media"),
+        )
+        categories: list[str] = ["movies", "tv", "music", "books", "games", "misc"]
+        for category in categories:
+            os.makedirs(os.path.join(tree.torrents_path, category), exist_ok=True)
+        os.makedirs(tree.media_path, exist_ok=True)
+
+        for i in range(torrent_count):
+            category = categories[i % len(categories)]
+            is_linked = self.random.random() < hardlink_fraction
+            if files_per_torrent == 1:
+                content_path = os.path.join(tree.torrents_path, category, f"torrent-{i}.mkv")
+                file_paths = [content_path]
+            else:
+                content_path = os.path.join(tree.torrents_path, category, f"torrent-{i}")
+                os.makedirs(os.path.join(content_path, "extras"))
+                # Every 4th file is nested one level deeper, like samples or subtitles
+                file_paths = [
+                    os.path.join(content_path, "extras" if j % 4 == 3 else "", f"file-{j}.mkv")
+                    for j in range(files_per_torrent)
+                ]
+            for file_path in file_paths:
+                self.__touch(path=file_path)
+            tree.content_paths.append(content_path)
+            tree.known_paths.update(file_paths)
+
+            if is_linked:
+                media_dir = os.path.join(tree.media_path, category, f"title-{i}")
+                os.makedirs(media_dir)
+                # Only the last file is linked, so the media check can't stop at the first file
+                os.link(file_paths[-1], os.path.join(media_dir, os.path.basename(file_paths[-1])))
+                tree.linked_content_paths.add(content_path)
+
+        for i in range(int(torrent_count * orphan_fraction)):
+            category = categories[i % len(categories)]
+            if i % 2 == 0:
+                orphan_path = os.path.join(tree.torrents_path, category, f"orphan-{i}.mkv")
+                self.__touch(path=orphan_path)
+            else:
+                orphan_path = os.path.join(tree.torrents_path, category, f"orphan-{i}")
+                os.makedirs(orphan_path)
+            tree.orphan_paths.add(orphan_path)
+
+        return tree
+
+
+    def __touch(self, path: str) -> None:
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+
+
+class StrikeGenerator:
+    """
+    Fills the strike tables with streaks like they build up over weeks of job runs:
+    most streaks are ongoing, some have been interrupted and a few have reached the limit long ago.
+    """
+    def __init__(self, seed: int = 0) -> None:
+        self.random = random.Random(seed)
+
+
+    def generate(self, strike_type: StrikeType, hashes: list[str], max_days: int = 60) -> None:
+        """
+        Replaces the streaks of the strike type with one streak per hash
+
+        Args:
+            strike_type (StrikeType): The strike type to fill
+            hashes (list[str]): The hashes to give a streak
+            max_days (int): The maximum age of a streak in days
+        """
+        today: int = date.today().toordinal()
+        now = int(datetime.now().timestamp())
+        rows: list[tuple[str, int, int, int, int]] = []
+        for torrent_hash in hashes:
+            streak_days = self.random.randint(1, max_days)
+            # 80% struck yesterday or today, the rest had a gap and starts over on the next strike
+            last_strike_day = today - self.random.choice([0, 1, 1, 1, 0, 1, 1, 0, 2, 7])
+            streak_start_day = last_strike_day - streak_days + 1
+            strikes = self.random.randint(streak_days, streak_days * 3)
+            rows.append((torrent_hash, strikes, streak_start_day, last_strike_day, now - streak_days * 24 * 60 * 60))
+
+        strike_utils = StrikeUtils(strike_type=strike_type)
+        with DbManager() as db:
+            db.execute(query=f"DELETE FROM {strike_utils.streaks_table}")
+            db.execute(query=f"DELETE FROM {strike_utils.history_table}")
+            db.execute_many(
+                query=f"INSERT INTO {strike_utils.streaks_table} (hash, strikes, streak_start_day, last_strike_day, first_seen) VALUES (?, ?, ?, ?, ?)",
+                params_seq=rows,
+            )
@@ -0,0 +1,246 @@
+"""
+Offline benchmarks of the filesystem and strike db hot paths, on synthetic data in a temp dir.
+Needs no qbittorrent, nothing outside of the temp dir is touched.
+
+    python -m benchmarks.run --scales 1000 10000 100000 --output benchmark_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Optional
+import yaml
+from loguru import logger
+
+
+def create_config_folder(work_path: str, qbittorrent_port: int = 8080, jobs: Optional[dict[str, dict[str, Any]]] = None) -> str:
+    """
+    Writes a benchmark config.yaml and points CONFIG_FOLDER_PATH to it.
+    The config and db path are read when src is imported, so this has to be called before that.
+
+    Args:
+        work_path (str): The dir the config folder is created in
+        qbittorrent_port (int): The port of the (fake) qbittorrent on localhost
+        jobs (dict): Overrides of the job configs
+
+    Returns:
+        str: The path of the config folder
+    """
+    config: dict[str, Any] = {
+        "testing": {"job": None},
+        "notifications": {"discord_webhook_url": None},
+        "qbittorrent": {"host": "127.0.0.1", "port": qbittorrent_port, "username": "admin", "password": "adminadmin", "protected_tag": "protected"},
+        "jobs": {
+            "delete_orphaned": {"interval_hours": 1, "min_strike_days": 3, "required_strikes": 3, "action": "test"},
+            "delete_forgotten": {"interval_hours": 1, "min_seeding_days": 20, "min_strike_days": 3, "required_strikes": 3, "action": "test"},
+            "delete_not_working_trackers": {"interval_hours": 1, "min_strike_days": 5, "required_strikes": 10, "action": "test"},
+        },
+    }
+    for job_name, job_config in (jobs or {}).items():
+        config["jobs"][job_name].update(job_config)
+
+    config_path = os.path.join(work_path, "config")
+    os.makedirs(config_path)
+    with open(os.path.join(config_path, "config.yaml"), "w") as f:
+        yaml.safe_dump(config, f)
+    os.environ["CONFIG_FOLDER_PATH"] = config_path
+    return config_path
+
+
+class BenchmarkRunner:
+    def __init__(self, repeats: int) -> None:
+        self.repeats = repeats
+        self.results: list[dict[str, Any]] = []
+
+
+    def annotate(self, **values: Any) -> None:
+        """
+        Adds values (e.g. api call counts) to the result of the last benchmark
+        """
+        self.results[-1].update(values)
+
+
+    def measure(self, name: str, scale: int, items: int, method: Callable[[], Any], setup: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Runs method `repeats` times (setup is not timed) and records the timings
+
+        Args:
+            name (str): The name of the benchmark
+            scale (int): The torrent count of the generated data
+            items (int): How many items (paths, hashes) one run of method handles
+            method (Callable): The code to time
+            setup (Callable): Brings the state back before every run
+
+        Returns:
+            Any: The return value of the last run
+        """
+        timings: list[float] = []
+        result: Any = None
+        for _ in range(self.repeats):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            result = method()
+            timings.append(time.perf_counter() - start)
+
+        median_seconds = statistics.median(timings)
+        self.results.append({
+            "benchmark": name,
+            "scale": scale,
+            "items": items,
+            "repeats": self.repeats,
+            "min_seconds": min(timings),
+            "median_seconds": median_seconds,
+            "max_seconds": max(timings),
+            "items_per_second": items / median_seconds if median_seconds > 0 else None,
+        })
+        print(f"{name:<40} scale={scale:<8} items={items:<8} median={median_seconds:.4f}s min={min(timings):.4f}s", flush=True)
+        return result
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def write_results(runner: BenchmarkRunner, args: argparse.Namespace) -> None:
+    output = {
+        "created": datetime.now().isoformat(),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": runner.results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def run_scale(runner: BenchmarkRunner, work_path: str, scale: int, args: argparse.Namespace) -> None:
+    from benchmarks.baseline import FindMediaLibraryCheck
+    from benchmarks.generators import StrikeGenerator, TreeGenerator
+    from src.utils.file_utils import FileUtils
+    from src.utils.media_index import MediaIndex
+    from src.utils.strike_utils import StrikeType, StrikeUtils
+
+    tree_path = os.path.join(work_path, f"tree-{scale}")
+    os.makedirs(tree_path)
+    start = time.perf_counter()
+    tree = TreeGenerator(seed=args.seed).generate(
+        root_path=tree_path,
+        torrent_count=scale,
+        files_per_torrent=args.files_per_torrent,
+        hardlink_fraction=args.hardlink_fraction,
+        orphan_fraction=args.orphan_fraction,
+    )
+    print(f"Generated {len(tree.known_paths)} torrent files and {len(tree.orphan_paths)} orphans in {time.perf_counter() - start:.2f}s", flush=True)
+
+    file_utils = FileUtils(data_path=tree.data_path, torrents_path=tree.torrents_path, media_path=tree.media_path)
+
+    # Media library checks, the find based check is the baseline
+    find_media_library_check = FindMediaLibraryCheck(data_path=tree.data_path, media_path=tree.media_path)
+    find_sample: list[str] = tree.content_paths[:args.find_sample]
+    runner.measure(
+        name="is_content_in_media_library (sample)",
+        scale=scale,
+        items=len(find_sample),
+        method=lambda: [find_media_library_check.is_content_in_media_library(content_path=content_path) for content_path in find_sample],
+    )
+    media_index = MediaIndex(media_path=tree.media_path)
+    runner.measure(name="media_index_refresh_full", scale=scale, items=len(tree.linked_content_paths), method=lambda: media_index.refresh(full_rebuild=True))
+    media_inode_index: set[tuple[int, int]] = runner.measure(name="media_index_refresh_incremental", scale=scale, items=len(tree.linked_content_paths), method=media_index.refresh)
+    linked: list[bool] = runner.measure(
+        name="is_content_in_media_index",
+        scale=scale,
+        items=len(tree.content_paths),
+        method=lambda: [file_utils.is_content_in_media_index(content_path=content_path, media_inode_index=media_inode_index) for content_path in tree.content_paths],
+    )
+    if sum(linked) != len(tree.linked_content_paths):
+        raise AssertionError(f"Media index found {sum(linked)} linked torrents, expected {len(tree.linked_content_paths)}")
+
+    # Orphan walk
+    orphans = runner.measure(
+        name="walk_orphan_candidates",
+        scale=scale,
+        items=len(tree.known_paths) + len(tree.orphan_paths),
+        method=lambda: list(file_utils.walk_orphan_candidates(root_path=tree.torrents_path, known_paths=tree.known_paths)),
+    )
+    orphan_paths: set[str] = {entry.path for entry, _ in orphans}
+    if orphan_paths != tree.orphan_paths:
+        raise AssertionError(f"Orphan walk found {len(orphan_paths)} orphans, expected {len(tree.orphan_paths)}")
+
+    # Strikes, every run starts from the same pre-populated streaks
+    hashes: list[str] = [f"{i:040x}" for i in range(scale)]
+    strike_hashes: list[str] = hashes[:scale // 2]
+    reset_hashes: list[str] = hashes[scale // 2:scale // 2 + scale // 10]
+    alive_hashes: list[str] = hashes[:scale - scale // 10]
+    strike_generator = StrikeGenerator(seed=args.seed)
+    strike_utils = StrikeUtils(strike_type=StrikeType.DELETE_FORGOTTEN)
+    populate_strikes: Callable[[], None] = lambda: strike_generator.generate(strike_type=StrikeType.DELETE_FORGOTTEN, hashes=hashes)
+    runner.measure(
+        name="strike_torrents",
+        scale=scale,
+        items=len(strike_hashes) + len(reset_hashes),
+        method=lambda: strike_utils.strike_torrents(strike_hashes=strike_hashes, reset_hashes=reset_hashes),
+        setup=populate_strikes,
+    )
+    runner.measure(
+        name="cleanup_db",
+        scale=scale,
+        items=len(alive_hashes),
+        method=lambda: strike_utils.cleanup_db(hashes=alive_hashes),
+        setup=populate_strikes,
+    )
+    runner.measure(name="get_struck_hashes", scale=scale, items=scale, method=strike_utils.get_struck_hashes, setup=populate_strikes)
+
+    shutil.rmtree(tree_path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks of qbit-cleaner on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000], help="Torrent counts to benchmark")
+    parser.add_argument("--files-per-torrent", type=int, default=4)
+    parser.add_argument("--hardlink-fraction", type=float, default=0.5)
+    parser.add_argument("--orphan-fraction", type=float, default=0.05)
+    parser.add_argument("--find-sample", type=int, default=20, help="How many torrents are checked with the (slow) find based media check")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=None, help="Where the synthetic data is generated, a temp dir by default")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where the json results are written to")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=os.getenv("LOG_LEVEL") or "WARNING")
+
+    work_path = tempfile.mkdtemp(prefix="qbit-cleaner-bench-", dir=args.work_dir)
+    try:
+        create_config_folder(work_path=work_path)
+
+        from src.utils.db_manager import DbManager
+        from src.utils.db_scripts import DbScripts
+        DbScripts().create_tables()
+
+        runner = BenchmarkRunner(repeats=args.repeats)
+        for scale in args.scales:
+            run_scale(runner=runner, work_path=work_path, scale=scale, args=args)
+        DbManager.close_connections()
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    write_results(runner=runner, args=args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
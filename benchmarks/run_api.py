@@ -0,0 +1,141 @@
+"""
+Benchmarks the qbittorrent api code against the local fake qbittorrent (see fake_qbittorrent.py)
+and records the api calls of every step, so additional round-trips show up in the results.
+
+    python -m benchmarks.run_api --torrents 20000 --latency-ms 2 --output api_benchmark_results.json
+"""
+import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
+from loguru import logger
+
+from benchmarks.fake_qbittorrent import FakeQbittorrentServer, TorrentPopulation
+from benchmarks.run import BenchmarkRunner, create_config_folder, write_results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the qbittorrent api code of qbit-cleaner against a fake qbittorrent")
+    parser.add_argument("--torrents", type=int, default=20000)
+    parser.add_argument("--files-per-torrent", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added to every request of the fake qbittorrent")
+    parser.add_argument("--changed-fraction", type=float, default=0.01, help="Fraction of torrents changed before the delta sync")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="api_benchmark_results.json", help="Where the json results are written to")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=os.getenv("LOG_LEVEL") or "WARNING")
+
+    torrents = TorrentPopulation(seed=args.seed).generate(torrent_count=args.torrents, files_per_torrent=args.files_per_torrent)
+    server = FakeQbittorrentServer(torrents=torrents, latency_seconds=args.latency_ms / 1000)
+    server.start()
+    work_path = tempfile.mkdtemp(prefix="qbit-cleaner-api-bench-")
+    runner = BenchmarkRunner(repeats=1)
+    scale: int = args.torrents
+    try:
+        # Strike limit is reached on the first run, so the actions are part of the benchmark
+        create_config_folder(work_path=work_path, qbittorrent_port=server.port, jobs={
+            "delete_not_working_trackers": {"required_strikes": 1, "min_strike_days": 1, "action": "stop"},
+        })
+        # The paths of the generated torrents, nothing is scanned with action stop
+        os.environ.setdefault("TORRENTS_PATH", "/data/torrents")
+        os.environ.setdefault("MEDIA_PATH", "/data/media")
+        from src.utils.db_manager import DbManager
+        from src.utils.db_scripts import DbScripts
+        DbScripts().create_tables()
+
+        def measure(name: str, items: int, method, setup=None):
+            def reset_and_setup() -> None:
+                if setup:
+                    setup()
+                server.reset_call_counts()
+            result = runner.measure(name=name, scale=scale, items=items, method=method, setup=reset_and_setup)
+            call_counts = server.get_call_counts()
+            runner.annotate(call_counts=call_counts, round_trips=sum(call_counts.values()))
+            print(f"{"":<40} calls={call_counts}", flush=True)
+            return result
+
+        def login() -> None:
+            from src.utils.qbit_connection import QBIT_CONNECTION
+            QBIT_CONNECTION.get_client()
+        measure(name="login", items=1, method=login)
+
+        from src.jobs.delete_not_working_trackers import DeleteNotWorkingTrackers
+        from src.utils.torrent_files_cache import TorrentFilesCache
+        from src.utils.torrent_snapshot import TORRENT_SNAPSHOT
+
+        # Torrent list
+        snapshot = measure(name="snapshot_full_sync", items=scale, method=TORRENT_SNAPSHOT.get_torrents)
+        changed_count = math.ceil(scale * args.changed_fraction)
+        def change_torrents() -> None:
+            server.state.touch_random(count=changed_count, seed=args.seed)
+            TORRENT_SNAPSHOT.invalidate()
+        snapshot = measure(name="snapshot_delta_sync", items=changed_count, method=TORRENT_SNAPSHOT.get_torrents, setup=change_torrents)
+        expected_seeding_times = {torrent_hash: torrent.info["seeding_time"] for torrent_hash, torrent in server.state.torrents.items()}
+        if len(snapshot) != scale or any(torrent.seeding_time != expected_seeding_times[torrent.hash] for torrent in snapshot):
+            raise AssertionError("Torrent snapshot doesn't match the torrents of qbittorrent after the delta sync")
+
+        # File lists
+        measure(name="files_cache_cold", items=scale, method=lambda: TorrentFilesCache().get_file_names(torrents=snapshot))
+        if server.get_call_counts().get("torrents/files", 0) != scale:
+            raise AssertionError("Cold files cache has to fetch every file list once")
+        measure(name="files_cache_warm", items=scale, method=lambda: TorrentFilesCache().get_file_names(torrents=snapshot))
+        if server.get_call_counts().get("torrents/files", 0) != 0:
+            raise AssertionError("Warm files cache must not fetch any file list")
+
+        # Tracker job, the first run stops all torrents without working trackers
+        expected_stopped: set[str] = {
+            torrent_hash for torrent_hash, torrent in server.state.torrents.items()
+            if not torrent.info["tracker"] and "protected" not in torrent.info["tags"] and not torrent.info["state"].startswith("stopped")
+        }
+        measure(name="delete_not_working_trackers_first_run", items=scale, method=DeleteNotWorkingTrackers().run)
+        call_counts = server.get_call_counts()
+        if call_counts.get("torrents/trackers", 0) != len(expected_stopped):
+            raise AssertionError(f"Expected {len(expected_stopped)} trackers calls, got {call_counts.get("torrents/trackers", 0)}")
+        if call_counts.get("torrents/stop", 0) != math.ceil(len(expected_stopped) / 100):
+            raise AssertionError(f"Expected the stops to be batched, got {call_counts.get("torrents/stop", 0)} stop calls for {len(expected_stopped)} torrents")
+        stopped: set[str] = {torrent_hash for torrent_hash in expected_stopped if server.state.torrents[torrent_hash].info["state"].startswith("stopped")}
+        if stopped != expected_stopped:
+            raise AssertionError(f"{len(expected_stopped - stopped)} torrents without working trackers have not been stopped")
+        measure(name="delete_not_working_trackers_second_run", items=scale, method=DeleteNotWorkingTrackers().run, setup=TORRENT_SNAPSHOT.invalidate)
+
+        # Orphan plan on a small tree, a file renamed inside a cached torrent must not become an orphan
+        from benchmarks.generators import TreeGenerator
+        from src.jobs.delete_orphaned import DeleteOrphaned
+        tree = TreeGenerator(seed=args.seed).generate(root_path=work_path, torrent_count=60, files_per_torrent=args.files_per_torrent, hardlink_fraction=0, orphan_fraction=0.1)
+        tree_torrents = TorrentPopulation(seed=args.seed).generate(torrent_count=0, tree=tree)
+        server.state.add_torrents(torrents=tree_torrents)
+        os.environ["TORRENTS_PATH"] = tree.torrents_path
+        os.environ["MEDIA_PATH"] = tree.media_path
+        def get_orphan_paths() -> set[str]:
+            # Every orphan is struck, the strike limit doesn't matter here
+            return set(DeleteOrphaned().plan().strike_hashes)
+        orphan_paths = measure(name="delete_orphaned_plan", items=len(tree_torrents), method=get_orphan_paths, setup=TORRENT_SNAPSHOT.invalidate)
+        if orphan_paths != tree.orphan_paths:
+            raise AssertionError(f"Orphan plan found {len(orphan_paths)} orphans, expected {len(tree.orphan_paths)}")
+        renamed_hash, renamed_torrent = next((torrent_hash, torrent) for torrent_hash, torrent in tree_torrents.items() if len(torrent.file_names) > 1)
+        file_name: str = renamed_torrent.file_names[0]
+        new_file_name: str = f"{os.path.splitext(file_name)[0]}-renamed.mkv"
+        save_path: str = renamed_torrent.info["save_path"]
+        def rename_file() -> None:
+            os.rename(os.path.join(save_path, file_name), os.path.join(save_path, new_file_name))
+            server.state.rename_file(torrent_hash=renamed_hash, file_name=file_name, new_file_name=new_file_name)
+            TORRENT_SNAPSHOT.invalidate()
+        orphan_paths = measure(name="delete_orphaned_plan_renamed_file", items=len(tree_torrents), method=get_orphan_paths, setup=rename_file)
+        if orphan_paths != tree.orphan_paths:
+            raise AssertionError(f"Orphan plan after renaming {file_name} found {sorted(orphan_paths - tree.orphan_paths)} as orphans")
+
+        DbManager.close_connections()
+    finally:
+        server.stop()
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    write_results(runner=runner, args=args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,15 @@
+import argparse
 import sys
 import os
 from loguru import logger
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cleans up orphaned files, forgotten torrents and torrents without working trackers of qbittorrent")
+    parser.add_argument("--validate", action="store_true", help="Check config.yaml and the environment variables and exit, without connecting to qbittorrent")
+    parser.add_argument("--plan", nargs="+", metavar="JOB", help="Write what the given jobs would do to plans/<job>.json in the config folder and exit, without changing strikes, torrents or files")
+    args = parser.parse_args()
+
     log_level = os.getenv("LOG_LEVEL") or "INFO"
     if log_level == "TRACE":
         log_format = "[{time:YYYY-MM-DD HH:mm:ss}] [<level>{level}</level>] [{file}:{function}:{line}]: {message}"
@@ -21,4 +27,8 @@ if __name__ == "__main__":
     )
 
     from src import main
+    if args.validate:
+        sys.exit(main.validate())
+    if args.plan:
+        sys.exit(main.plan(job_names=args.plan))
     sys.exit(main.main())
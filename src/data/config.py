@@ -1,25 +1,106 @@
 import os
+import threading
+import typing
 import yaml
+from collections.abc import Iterator, Mapping
 from loguru import logger
 
 from src.data.constants import CONFIG_FILE_PATH
 
 
-class Config:
+# Keys that are read with CONFIG[...], optional keys are read with .get() and have defaults
+REQUIRED_KEYS: dict[str, tuple[str, ...]] = {
+    "testing": ("job",),
+    "notifications": ("discord_webhook_url",),
+    "qbittorrent": ("host", "port", "username", "password", "protected_tag"),
+}
+REQUIRED_JOB_KEYS: dict[str, tuple[str, ...]] = {
+    "delete_orphaned": ("interval_hours", "min_strike_days", "required_strikes", "action"),
+    "delete_forgotten": ("interval_hours", "min_seeding_days", "min_strike_days", "required_strikes", "action"),
+    "delete_not_working_trackers": ("interval_hours", "min_strike_days", "required_strikes", "action"),
+}
+JOB_ACTIONS: dict[str, tuple[str, ...]] = {
+    "delete_orphaned": ("test", "delete"),
+    "delete_forgotten": ("test", "stop", "delete"),
+    "delete_not_working_trackers": ("test", "stop", "delete"),
+}
+
+
+class Config(Mapping[str, typing.Any]):
+    """
+    The yaml config, only read from disk when it's first accessed
+    """
     def __init__(self) -> None:
-        logger.debug("Loading yaml config")
-        self.config_yaml = None
-        if os.path.exists(CONFIG_FILE_PATH):
-            with open(CONFIG_FILE_PATH) as f:
-                self.config_yaml = yaml.safe_load(f)
-        else:
-            logger.critical("Config does not exist, please create it")
+        self.config_yaml: typing.Optional[dict[str, typing.Any]] = None
+        self.lock = threading.Lock()
+
+
+    def get_config(self) -> dict[str, typing.Any]:
+        with self.lock:
+            if self.config_yaml is None:
+                logger.debug("Loading yaml config")
+                if not os.path.exists(CONFIG_FILE_PATH):
+                    logger.critical("Config does not exist, please create it")
+                    raise FileNotFoundError(CONFIG_FILE_PATH)
+                with open(CONFIG_FILE_PATH) as f:
+                    config_yaml = yaml.safe_load(f)
+                if not config_yaml:
+                    raise FileNotFoundError(CONFIG_FILE_PATH)
+                self.config_yaml = config_yaml
+            return self.config_yaml
+
+
+    def __getitem__(self, key: str) -> typing.Any:
+        return self.get_config()[key]
+
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.get_config())
+
+
+    def __len__(self) -> int:
+        return len(self.get_config())
+
+
+    def validate(self) -> list[str]:
+        """
+        Checks that the config can be loaded and has all required keys, without connecting to anything
+
+        Returns:
+            list: The problems found, empty if the config is valid
+        """
+        try:
+            config = self.get_config()
+        except (OSError, yaml.YAMLError) as e:
+            return [f"Could not load {CONFIG_FILE_PATH}: {e}"]
+        if not isinstance(config, dict):
+            return [f"{CONFIG_FILE_PATH} has to be a mapping"]
+
+        problems: list[str] = []
+        for section, keys in REQUIRED_KEYS.items():
+            problems.extend(self.__get_missing_keys(section_path=section, section=config.get(section), keys=keys))
+        jobs = config.get("jobs")
+        for job_name, keys in REQUIRED_JOB_KEYS.items():
+            job_config = jobs.get(job_name) if isinstance(jobs, dict) else None
+            missing_keys: list[str] = self.__get_missing_keys(section_path=f"jobs.{job_name}", section=job_config, keys=keys)
+            problems.extend(missing_keys)
+            if missing_keys:
+                continue
+            if job_config["action"] not in JOB_ACTIONS[job_name]:
+                problems.append(f"jobs.{job_name}.action has to be one of {", ".join(JOB_ACTIONS[job_name])}, not {job_config["action"]}")
+            for key in ("interval_hours", "min_strike_days", "required_strikes", "min_seeding_days"):
+                if key in job_config and not isinstance(job_config[key], (int, float)):
+                    problems.append(f"jobs.{job_name}.{key} has to be a number")
+        testing_job = (config.get("testing") or {}).get("job")
+        if testing_job and testing_job not in REQUIRED_JOB_KEYS:
+            problems.append(f"testing.job has to be one of {", ".join(REQUIRED_JOB_KEYS)}, not {testing_job}")
+        return problems
 
 
-    def get_config(self):
-        if not self.config_yaml:
-            raise FileNotFoundError()
-        return self.config_yaml
+    def __get_missing_keys(self, section_path: str, section: typing.Any, keys: tuple[str, ...]) -> list[str]:
+        if not isinstance(section, dict):
+            return [f"{section_path} is missing"]
+        return [f"{section_path}.{key} is missing" for key in keys if key not in section]
 
 
-CONFIG = Config().get_config()
+CONFIG = Config()
@@ -1,9 +1,11 @@
 import os
 
 
-CONFIG_FOLDER_PATH = "/config"
+CONFIG_FOLDER_PATH = os.getenv("CONFIG_FOLDER_PATH") or "/config"
 DATA_FOLDER_PATH = "/data"
 
-os.makedirs(CONFIG_FOLDER_PATH, exist_ok=True)
 DATA_FILE_PATH = f"{CONFIG_FOLDER_PATH}/data.db"
 CONFIG_FILE_PATH = f"{CONFIG_FOLDER_PATH}/config.yaml"
+METRICS_FILE_PATH = f"{CONFIG_FOLDER_PATH}/metrics.json"
+PROFILES_FOLDER_PATH = f"{CONFIG_FOLDER_PATH}/profiles"
+PLANS_FOLDER_PATH = f"{CONFIG_FOLDER_PATH}/plans"
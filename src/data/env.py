@@ -5,11 +5,19 @@ from loguru import logger
 
 class Env:
     def __init__(self) -> None:
-        logger.debug("Loading env")
-        dotenv.load_dotenv()
+        self.is_loaded = False
+
+
+    def __load(self) -> None:
+        # .env is only read when the first variable is needed
+        if not self.is_loaded:
+            logger.debug("Loading env")
+            dotenv.load_dotenv()
+            self.is_loaded = True
 
 
     def __get_var(self, var_name: str) -> str:
+        self.__load()
         env: str | None = os.getenv(var_name)
         if env is None:
             raise ValueError(f"Environment variable '{var_name}' is not set.")
@@ -24,4 +32,33 @@ class Env:
         return self.__get_var("MEDIA_PATH")
 
 
+    def get_profile_jobs(self) -> list[str] | None:
+        """
+        Returns:
+            list: The jobs set in PROFILE_JOBS (comma separated), None if it's not set
+        """
+        self.__load()
+        env: str | None = os.getenv("PROFILE_JOBS")
+        if env is None:
+            return None
+        return [job_name.strip() for job_name in env.split(",") if job_name.strip()]
+
+
+    def validate(self) -> list[str]:
+        """
+        Returns:
+            list: The problems with the required environment variables, empty if they are valid
+        """
+        problems: list[str] = []
+        for get_path in (self.get_torrents_path, self.get_media_path):
+            try:
+                path: str = get_path()
+            except ValueError as e:
+                problems.append(str(e))
+                continue
+            if not os.path.isdir(path):
+                problems.append(f"{path} is not a directory")
+        return problems
+
+
 ENV = Env()
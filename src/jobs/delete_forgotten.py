@@ -1,16 +1,25 @@
 from datetime import datetime
-from qbittorrentapi import TorrentDictionary
+from typing import Optional
 from loguru import logger
 
+from src.utils.action_utils import ActionResult, ActionUtils, TorrentActionBatch
+from src.utils.content_index import ContentIdentityIndex
 from src.utils.file_utils import FileUtils
+from src.utils.io_budget import IO_BUDGET
+from src.utils.job_plan import JobPlan, PlannedAction
+from src.utils.job_stop import JOB_STOP, JobAbortedError
+from src.utils.media_check_cache import MediaCheckCache
+from src.utils.media_index import MediaIndex
+from src.utils.metrics import METRICS
 from src.utils.datetime_utils import DateTimeUtils
 from src.utils.discord_webhook_utils import DiscordWebhookUtils, EmbedColor
-from src.utils.strike_utils import StrikeUtils, StrikeType
+from src.utils.strike_utils import StrikeResult, StrikeUtils, StrikeType
+from src.utils.torrent_record import TorrentPreFilter, TorrentRecord
 
 from src.data.env import ENV
 from src.data.constants import DATA_FOLDER_PATH
 from src.data.config import CONFIG
-from src.utils.qbit_connection import QBIT_CONNECTION
+from src.utils.torrent_snapshot import TORRENT_SNAPSHOT
 
 
 class DeleteForgotten:
@@ -20,119 +29,187 @@ class DeleteForgotten:
             torrents_path=ENV.get_torrents_path(),
             media_path=ENV.get_media_path(),
         )
+        self.media_index = MediaIndex(media_path=ENV.get_media_path())
+        self.media_inode_index: set[tuple[int, int]] = set()
+        self.media_check_cache = MediaCheckCache(file_utils=self.file_utils)
 
 
     def run(self) -> None:
         logger.info("Running 'delete_forgotten' job")
+        with IO_BUDGET.background_io():
+            plan: JobPlan = self.plan()
+            plan.export()
+            self.apply(plan=plan)
+        logger.info(f"job delete_forgotten finished, next run in {CONFIG["jobs"]["delete_forgotten"]["interval_hours"]} hours")
+
 
-        logger.trace("Getting not_criteria_matching_content_paths")
-        not_criteria_matching_content_paths: set[str] = self.get_not_criteria_matching_content_paths()
+    def plan(self) -> JobPlan:
+        """
+        Evaluates all torrents and decides what to do with them, without changing strikes, torrents or files
 
-        # Get client
-        qbt_client = QBIT_CONNECTION.get_client()
+        Returns:
+            JobPlan: The strikes, resets and actions of this run
+        """
+        self.media_check_cache.clear()
+        logger.trace("Refreshing media_inode_index")
+        with METRICS.phase("refresh_media_index"):
+            self.media_inode_index = self.media_index.refresh(full_rebuild=CONFIG["jobs"]["delete_forgotten"].get("rebuild_media_index", False))
 
         # Get torrents
-        logger.trace("Checking torrents")
-        for torrent in qbt_client.torrents_info():
-            torrent: TorrentDictionary
-            hash: str = torrent.hash
-            name: str = torrent.name
-            content_path: str = torrent.content_path
-            seeding_time_days: int = torrent.seeding_time / 60 / 60 / 24
+        with METRICS.phase("get_torrents"):
+            torrents: list[TorrentRecord] = TORRENT_SNAPSHOT.get_torrents()
+        METRICS.increment("torrents_evaluated_total", len(torrents))
+
+        with METRICS.phase("evaluate"):
+            # Cheap criteria for all torrents at once, the media library is only checked for the remaining ones
+            logger.trace("Pre-filtering torrents")
+            min_seeding_days: float = CONFIG["jobs"]["delete_forgotten"]["min_seeding_days"]
+            candidates, not_matching_torrents = TorrentPreFilter(
+                protected_tag=CONFIG["qbittorrent"]["protected_tag"],
+                require_completed=True,
+            ).split(torrents=torrents)
+            reset_hashes: list[str] = [torrent.hash for torrent in not_matching_torrents]
+
+            logger.trace("Checking candidates")
+            strike_torrents: list[TorrentRecord] = []
+            for torrent in candidates:
+                JOB_STOP.check()
+                # Ignore if criteria not matching
+                if not self.is_criteria_matching(torrent=torrent):
+                    reset_hashes.append(torrent.hash)
+                    continue
+                strike_torrents.append(torrent)
+
+        # Check if the strike limit will be reached
+        with METRICS.phase("project_strikes"):
+            strike_results: dict[str, StrikeResult] = StrikeUtils(strike_type=StrikeType.DELETE_FORGOTTEN).project_strikes(
+                strike_hashes=[torrent.hash for torrent in strike_torrents],
+            )
 
-            strike_utils = StrikeUtils(strike_type=StrikeType.DELETE_FORGOTTEN, torrent_hash=hash)
+        found_torrents: list[TorrentRecord] = []
+        for torrent in strike_torrents:
+            name: str = torrent.name
+            seeding_time_days: float = torrent.seeding_time_days
+            strike_result: StrikeResult = strike_results[torrent.hash]
 
-            # Ignore if criteria not matching
-            if not self.is_criteria_matching(torrent=torrent, check_seeding_time=False):
-                strike_utils.reset_torrent()
-                continue
-            # Strike torrent and check if limit reached
-            is_torrent_limit_reached: bool = strike_utils.strike_torrent()
-            if not is_torrent_limit_reached:
+            if not strike_result.is_limit_reached:
                 required_strikes = CONFIG["jobs"]["delete_forgotten"]["required_strikes"]
                 min_strike_days = CONFIG["jobs"]["delete_forgotten"]["min_strike_days"]
-                logger.debug(f"Torrent is forgotten but doesn't reach strike criteria ({strike_utils.get_strikes()}/{required_strikes} strikes, {strike_utils.get_consecutive_days()}/{min_strike_days} days): {name}")
+                logger.debug(f"Torrent is forgotten but doesn't reach strike criteria ({strike_result.strikes}/{required_strikes} strikes, {strike_result.consecutive_days}/{min_strike_days} days): {name}")
                 continue
             # Torrents seeding less than x days
-            if seeding_time_days < CONFIG["jobs"]["delete_forgotten"]["min_seeding_days"]:
-                logger.debug(f"Torrent is forgotten but but doesn't reach seed days criteria (seeding {round(seeding_time_days, 2)}/{CONFIG["jobs"]["delete_forgotten"]["min_seeding_days"]} days): {name}")
+            if seeding_time_days < min_seeding_days:
+                logger.debug(f"Torrent is forgotten but but doesn't reach seed days criteria (seeding {round(seeding_time_days, 2)}/{min_seeding_days} days): {name}")
                 continue
 
             logger.info(f"Found forgotten Torrent: {name}")
-            self.take_action(torrent=torrent, content_path=content_path, not_criteria_matching_content_paths=not_criteria_matching_content_paths)
-            self.send_discord_notification(embed_title="Found forgotten torrent", torrent=torrent)
-
-        # Clean strike db
-        hashes = [torrent.hash for torrent in qbt_client.torrents_info()]
-        StrikeUtils(strike_type=StrikeType.DELETE_FORGOTTEN, torrent_hash="unused").cleanup_db(hashes=hashes)
-
-        logger.info(f"job delete_forgotten finished, next run in {CONFIG["jobs"]["delete_forgotten"]["interval_hours"]} hours")
-
+            found_torrents.append(torrent)
+
+        # Files are only deleted if no torrent that stays in qbittorrent uses them
+        action: str = CONFIG["jobs"]["delete_forgotten"]["action"]
+        needed_groups: set[str] = set()
+        content_index: Optional[ContentIdentityIndex] = None
+        if action == "delete" and found_torrents:
+            with METRICS.phase("content_index"):
+                content_index = ContentIdentityIndex(file_utils=self.file_utils, torrents=torrents)
+                found_hashes: set[str] = {torrent.hash for torrent in found_torrents}
+                needed_groups = content_index.get_groups(torrent.hash for torrent in torrents if torrent.hash not in found_hashes)
+
+        planned_actions: list[PlannedAction] = []
+        for torrent in found_torrents:
+            name: str = torrent.name
+            note: Optional[str] = None
+            content_group: Optional[str] = content_index.get_group(torrent.hash) if content_index else None
+            if content_group in needed_groups:
+                logger.warning(f"Only deleting torrent and not files for {name} Some other torrent that is not deleted uses these files")
+                note = "Files are used by a torrent that is not deleted"
+            planned_actions.append(PlannedAction(
+                key=torrent.hash,
+                name=name,
+                action=action,
+                delete_files=action == "delete" and note is None,
+                strike_result=strike_results[torrent.hash],
+                note=note,
+                content_group=content_group,
+                context=torrent,
+            ))
+
+        return JobPlan.create(
+            job_name="delete_forgotten",
+            strike_hashes=[torrent.hash for torrent in strike_torrents],
+            reset_hashes=reset_hashes,
+            strike_results=strike_results,
+            actions=planned_actions,
+        )
 
-    def get_not_criteria_matching_content_paths(self) -> set[str]:
-        content_paths: list[str] = []
 
-        qbt_client = QBIT_CONNECTION.get_client()
+    def apply(self, plan: JobPlan) -> None:
+        """
+        Writes the strikes of the plan, takes its actions in batches and sends its notifications
+        """
+        with METRICS.phase("strike"):
+            strike_results: dict[str, StrikeResult] = StrikeUtils(strike_type=StrikeType.DELETE_FORGOTTEN).strike_torrents(
+                strike_hashes=plan.strike_hashes,
+                reset_hashes=plan.reset_hashes,
+            )
 
-        for torrent in qbt_client.torrents_info():
-            torrent: TorrentDictionary
-            content_path = torrent.content_path
-            if not self.is_criteria_matching(torrent=torrent, check_seeding_time=True):
-                content_paths.append(content_path)
+        action_batch = TorrentActionBatch()
+        found_actions: list[PlannedAction] = []
+        for planned_action in plan.get_applicable_actions(strike_results=strike_results):
+            self.take_action(action_batch=action_batch, planned_action=planned_action)
+            found_actions.append(planned_action)
+
+        # Apply all actions at once, after the torrent list has been fully evaluated
+        with METRICS.phase("act"):
+            action_results: dict[str, ActionResult] = action_batch.apply()
+        for planned_action in found_actions:
+            torrent: TorrentRecord = planned_action.context
+            action_result: Optional[ActionResult] = action_results.get(planned_action.key)
+            self.send_discord_notification(embed_title="Found forgotten torrent", torrent=torrent, action_result=action_result)
+        DiscordWebhookUtils().flush()
 
-        return set(content_paths)
+        # Clean strike db
+        with METRICS.phase("cleanup_db"):
+            hashes = [torrent.hash for torrent in TORRENT_SNAPSHOT.get_torrents()]
+            StrikeUtils(strike_type=StrikeType.DELETE_FORGOTTEN).cleanup_db(hashes=hashes)
 
 
-    def is_criteria_matching(self, torrent: TorrentDictionary, check_seeding_time: bool) -> bool:
+    def is_criteria_matching(self, torrent: TorrentRecord) -> bool:
+        """
+        Checks the criteria that need the filesystem, the cheap ones are checked by TorrentPreFilter before
+        """
         name: str = torrent.name
-        tags: str = torrent.tags
         content_path: str = torrent.content_path
-        completed_on_raw: int = torrent.completion_on
-        seeding_time_days: int = torrent.seeding_time / 60 / 60 / 24
 
-        # Protected tags
-        if CONFIG["qbittorrent"]["protected_tag"] in tags.lower():
-            logger.trace(f"Not matching criteria due to protection tag: {name}")
-            return False
-        # Uncompleted torrents
-        if completed_on_raw == -1:
-            logger.trace(f"Not matching criteria due to not completed: {name}")
-            return False
         # Torrents that have a connection to the media library
         try:
-            if self.file_utils.is_content_in_media_library(content_path=content_path):
+            if self.media_check_cache.is_content_in_media_index(content_path=content_path, media_inode_index=self.media_inode_index):
                 logger.trace(f"Not matching criteria due to has content in media library: {name}")
                 return False
+        except JobAbortedError:
+            raise
         except Exception:
-            logger.trace(f"Not matching criteria due to error while checking for is_content_in_media_library: {name}")
-            return False
-        # Torrents seeding less than x days
-        if check_seeding_time and seeding_time_days < CONFIG["jobs"]["delete_forgotten"]["min_seeding_days"]:
-            logger.trace(f"Torrent is forgotten but but doesn't reach seed days criteria (seeding {round(seeding_time_days, 2)}/{CONFIG["jobs"]["delete_forgotten"]["min_seeding_days"]} days): {name}")
+            logger.trace(f"Not matching criteria due to error while checking for is_content_in_media_index: {name}")
             return False
 
         return True
 
 
-    def take_action(self, torrent: TorrentDictionary, content_path: str, not_criteria_matching_content_paths: set[str]) -> None:
-        match CONFIG["jobs"]["delete_forgotten"]["action"]:
+    def take_action(self, action_batch: TorrentActionBatch, planned_action: PlannedAction) -> None:
+        match planned_action.action:
             case "test":
                 logger.info("Action = test | Torrent remains unhandled")
             case "stop":
                 logger.info("Action = stop | Stopping torrent")
-                torrent.stop()
+                action_batch.stop(torrent_hash=planned_action.key)
             case "delete":
-                logger.info("Action = delete | Deleting torrent + files")
-                if content_path in not_criteria_matching_content_paths:
-                    logger.warning(f"Only deleting torrent and not files for {torrent.name} Some other torrent that uses these files doesn't match criteria")
-                    torrent.delete(delete_files=False)
-                else:
-                    torrent.delete(delete_files=True)
+                logger.info(f"Action = delete | Deleting torrent{" + files" if planned_action.delete_files else ""}")
+                action_batch.delete(torrent_hash=planned_action.key, delete_files=planned_action.delete_files)
             case _:
                 logger.warning("Invalid action for delete_forgotten job")
 
 
-    def send_discord_notification(self, embed_title: str, torrent: TorrentDictionary) -> None:
+    def send_discord_notification(self, embed_title: str, torrent: TorrentRecord, action_result: Optional[ActionResult]) -> None:
             name: str = torrent.name
             category: str = torrent.category
             tags: str = torrent.tags
@@ -140,7 +217,7 @@ class DeleteForgotten:
             ratio: float = torrent.ratio
             total_size_gib: int = torrent.total_size / 1024 / 1024 / 1024
             total_size_gb: int = torrent.total_size / 1000 / 1000 / 1000
-            seeding_time_days: int = torrent.seeding_time / 60 / 60 / 24
+            seeding_time_days: float = torrent.seeding_time_days
             completed_on_raw: int = torrent.completion_on
             completed_on: datetime = datetime.fromtimestamp(completed_on_raw)
             added_on_raw: int = torrent.added_on
@@ -150,7 +227,7 @@ class DeleteForgotten:
                 embed_color=EmbedColor.BLUE,
                 title=embed_title,
                 fields=[
-                    { "name": "Action", "value": CONFIG["jobs"]["delete_forgotten"]["action"] },
+                    { "name": "Action", "value": ActionUtils().get_action_readable(action=CONFIG["jobs"]["delete_forgotten"]["action"], action_result=action_result) },
                     { "name": "Name", "value": name },
                     { "name": "Tracker", "value": tracker },
 
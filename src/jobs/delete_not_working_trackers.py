@@ -1,74 +1,184 @@
 from datetime import datetime
-from qbittorrentapi import TorrentDictionary, Tracker, TrackersList
+from typing import Optional
+from qbittorrentapi import Tracker, TrackersList
 from loguru import logger
 
+from src.utils.action_utils import ActionResult, ActionUtils, TorrentActionBatch
+from src.utils.content_index import ContentIdentityIndex
 from src.utils.datetime_utils import DateTimeUtils
 from src.utils.discord_webhook_utils import DiscordWebhookUtils, EmbedColor
-from src.utils.strike_utils import StrikeUtils, StrikeType
+from src.utils.file_utils import FileUtils
+from src.utils.io_budget import IO_BUDGET
+from src.utils.job_plan import JobPlan, PlannedAction
+from src.utils.job_stop import JOB_STOP
+from src.utils.metrics import METRICS
+from src.utils.strike_utils import StrikeResult, StrikeUtils, StrikeType
+from src.utils.torrent_record import TorrentPreFilter, TorrentRecord
 
 from src.utils.qbit_connection import QBIT_CONNECTION
+from src.utils.torrent_snapshot import TORRENT_SNAPSHOT
+from src.data.env import ENV
+from src.data.constants import DATA_FOLDER_PATH
 from src.data.config import CONFIG
 
 
 class DeleteNotWorkingTrackers:
+    def __init__(self) -> None:
+        self.file_utils = FileUtils(
+            data_path=DATA_FOLDER_PATH,
+            torrents_path=ENV.get_torrents_path(),
+            media_path=ENV.get_media_path(),
+        )
+
+
     def run(self) -> None:
         logger.info("Running 'delete_not_working_trackers' job")
+        plan: JobPlan = self.plan()
+        plan.export()
+        self.apply(plan=plan)
+        logger.info(f"job delete_not_working_trackers finished, next run in {CONFIG["jobs"]["delete_not_working_trackers"]["interval_hours"]} hours")
 
-        logger.trace("Getting working_content_paths")
-        working_content_paths: set[str] = self.get_working_content_paths()
 
-        qbt_client = QBIT_CONNECTION.get_client()
+    def plan(self) -> JobPlan:
+        """
+        Evaluates all torrents and decides what to do with them, without changing strikes or torrents
+
+        Returns:
+            JobPlan: The strikes, resets and actions of this run
+        """
+        with METRICS.phase("get_torrents"):
+            qbt_client = QBIT_CONNECTION.get_client()
+            torrents: list[TorrentRecord] = TORRENT_SNAPSHOT.get_torrents()
+        METRICS.increment("torrents_evaluated_total", len(torrents))
+
+        # First pass with the data of torrents_info, without any trackers call
+        logger.trace("Getting candidates")
+        with METRICS.phase("evaluate"):
+            pre_filtered_torrents, not_matching_torrents = TorrentPreFilter(
+                protected_tag=CONFIG["qbittorrent"]["protected_tag"],
+                exclude_stopped=True,
+            ).split(torrents=torrents)
+            reset_hashes: list[str] = [torrent.hash for torrent in not_matching_torrents]
+            candidates: list[TorrentRecord] = []
+            for torrent in pre_filtered_torrents:
+                if not self.is_candidate(torrent=torrent):
+                    reset_hashes.append(torrent.hash)
+                    continue
+                candidates.append(torrent)
+        logger.debug(f"Found {len(candidates)}/{len(torrents)} torrents without a working tracker in torrents_info")
+
+        # Fetch the full tracker lists only for the candidates, once per run
+        logger.trace("Getting trackers of candidates")
+        with METRICS.phase("get_trackers"):
+            trackers_by_hash: dict[str, TrackersList] = {}
+            for torrent in candidates:
+                JOB_STOP.check()
+                trackers_by_hash[torrent.hash] = qbt_client.torrents_trackers(torrent.hash)
+
+        with METRICS.phase("evaluate"):
+            logger.trace("Checking candidates")
+            strike_torrents: list[TorrentRecord] = []
+            for torrent in candidates:
+                # Ignore if criteria not matching
+                if not self.is_criteria_matching(torrent=torrent, trackers=trackers_by_hash[torrent.hash]):
+                    reset_hashes.append(torrent.hash)
+                    continue
+                strike_torrents.append(torrent)
+
+        with METRICS.phase("project_strikes"):
+            strike_results: dict[str, StrikeResult] = StrikeUtils(strike_type=StrikeType.DELETE_NOT_WORKING_TRACKERS).project_strikes(
+                strike_hashes=[torrent.hash for torrent in strike_torrents],
+            )
 
-        logger.trace("Checking torrents")
-        for torrent in qbt_client.torrents_info():
-            torrent: TorrentDictionary
-            hash: str = torrent.hash
+        found_torrents: list[TorrentRecord] = []
+        for torrent in strike_torrents:
             name: str = torrent.name
-            content_path: str = torrent.content_path
-            trackers: TrackersList = qbt_client.torrents_trackers(torrent.hash)
-
-            strike_utils = StrikeUtils(strike_type=StrikeType.DELETE_NOT_WORKING_TRACKERS, torrent_hash=hash)
+            strike_result: StrikeResult = strike_results[torrent.hash]
 
-            # Ignore if criteria not matching
-            if not self.is_criteria_matching(torrent=torrent, trackers=trackers):
-                strike_utils.reset_torrent()
-                continue
             # Ignore not reaching criteria
-            is_torrent_limit_reached: bool = strike_utils.strike_torrent()
-            if not is_torrent_limit_reached:
+            if not strike_result.is_limit_reached:
                 required_strikes = CONFIG["jobs"]["delete_not_working_trackers"]["required_strikes"]
                 min_strike_days = CONFIG["jobs"]["delete_not_working_trackers"]["min_strike_days"]
-                logger.debug(f"Torrent has no working trackers but doesn't reach strike criteria ({strike_utils.get_strikes()}/{required_strikes} strikes, {strike_utils.get_consecutive_days()}/{min_strike_days} days): {name}")
+                logger.debug(f"Torrent has no working trackers but doesn't reach strike criteria ({strike_result.strikes}/{required_strikes} strikes, {strike_result.consecutive_days}/{min_strike_days} days): {name}")
                 continue
 
             logger.info(f"Found torrent without working trackers: {name}")
-            self.take_action(torrent=torrent, content_path=content_path, working_content_paths=working_content_paths)
-            self.send_discord_notification(torrent=torrent, trackers=trackers)
+            found_torrents.append(torrent)
+
+        # Files are only deleted if no torrent that stays in qbittorrent uses them
+        action: str = CONFIG["jobs"]["delete_not_working_trackers"]["action"]
+        needed_groups: set[str] = set()
+        content_index: Optional[ContentIdentityIndex] = None
+        if action == "delete" and found_torrents:
+            with METRICS.phase("content_index"), IO_BUDGET.background_io():
+                content_index = ContentIdentityIndex(file_utils=self.file_utils, torrents=torrents)
+                found_hashes: set[str] = {torrent.hash for torrent in found_torrents}
+                needed_groups = content_index.get_groups(torrent.hash for torrent in torrents if torrent.hash not in found_hashes)
+
+        planned_actions: list[PlannedAction] = []
+        for torrent in found_torrents:
+            name: str = torrent.name
+            note: Optional[str] = None
+            content_group: Optional[str] = content_index.get_group(torrent.hash) if content_index else None
+            if content_group in needed_groups:
+                logger.warning(f"Only deleting torrent and not files for {name} Some other torrent that is not deleted uses these files")
+                note = "Files are used by a torrent that is not deleted"
+            planned_actions.append(PlannedAction(
+                key=torrent.hash,
+                name=name,
+                action=action,
+                delete_files=action == "delete" and note is None,
+                strike_result=strike_results[torrent.hash],
+                note=note,
+                content_group=content_group,
+                context=(torrent, trackers_by_hash[torrent.hash]),
+            ))
+
+        return JobPlan.create(
+            job_name="delete_not_working_trackers",
+            strike_hashes=[torrent.hash for torrent in strike_torrents],
+            reset_hashes=reset_hashes,
+            strike_results=strike_results,
+            actions=planned_actions,
+        )
 
-        hashes = [torrent.hash for torrent in qbt_client.torrents_info()]
-        StrikeUtils(strike_type=StrikeType.DELETE_NOT_WORKING_TRACKERS, torrent_hash="unused").cleanup_db(hashes=hashes)
 
-        logger.info(f"job delete_not_working_trackers finished, next run in {CONFIG["jobs"]["delete_not_working_trackers"]["interval_hours"]} hours")
+    def apply(self, plan: JobPlan) -> None:
+        """
+        Writes the strikes of the plan, takes its actions in batches and sends its notifications
+        """
+        with METRICS.phase("strike"):
+            strike_results: dict[str, StrikeResult] = StrikeUtils(strike_type=StrikeType.DELETE_NOT_WORKING_TRACKERS).strike_torrents(
+                strike_hashes=plan.strike_hashes,
+                reset_hashes=plan.reset_hashes,
+            )
+
+        action_batch = TorrentActionBatch()
+        found_actions: list[PlannedAction] = []
+        for planned_action in plan.get_applicable_actions(strike_results=strike_results):
+            self.take_action(action_batch=action_batch, planned_action=planned_action)
+            found_actions.append(planned_action)
 
+        # Apply all actions at once, after the torrent list has been fully evaluated
+        with METRICS.phase("act"):
+            action_results: dict[str, ActionResult] = action_batch.apply()
+        for planned_action in found_actions:
+            torrent, trackers = planned_action.context
+            self.send_discord_notification(torrent=torrent, trackers=trackers, action_result=action_results.get(planned_action.key))
+        DiscordWebhookUtils().flush()
 
-    def get_working_content_paths(self) -> set[str]:
-        content_paths: list[str] = []
-        qbt_client = QBIT_CONNECTION.get_client()
-        for torrent in qbt_client.torrents_info():
-            torrent: TorrentDictionary
-            content_path = torrent.content_path
-            trackers: TrackersList = qbt_client.torrents_trackers(torrent.hash)
+        with METRICS.phase("cleanup_db"):
+            hashes = [torrent.hash for torrent in TORRENT_SNAPSHOT.get_torrents()]
+            StrikeUtils(strike_type=StrikeType.DELETE_NOT_WORKING_TRACKERS).cleanup_db(hashes=hashes)
 
-            # 0 = Disabled
-            # 1 = Not contacted yet
-            # 2 = Working
-            # 3 = Updating
-            # 4 = Not working
-            working: bool = any(tracker["status"] == 2 for tracker in trackers)
 
-            if working:
-                content_paths.append(content_path)
-        return set(content_paths)
+    def has_working_tracker(self, trackers: TrackersList) -> bool:
+        # 0 = Disabled
+        # 1 = Not contacted yet
+        # 2 = Working
+        # 3 = Updating
+        # 4 = Not working
+        return any(tracker["status"] == 2 for tracker in trackers)
 
 
     def get_tracker_infos(self, name: str, trackers: TrackersList) -> list[str]:
@@ -95,54 +205,50 @@ class DeleteNotWorkingTrackers:
         return tracker_infos
 
 
-    def is_criteria_matching(self, torrent: TorrentDictionary, trackers: TrackersList) -> bool:
+    def is_candidate(self, torrent: TorrentRecord) -> bool:
+        """
+        Cheap pre-check that only uses the data of torrents_info.
+        Protected and stopped torrents are already filtered out by TorrentPreFilter.
+
+        Returns:
+            bool: True if the trackers of the torrent have to be checked, false otherwise
+        """
         name: str = torrent.name
-        tags: str = torrent.tags
 
-        # Ignore protected tags
-        if CONFIG["qbittorrent"]["protected_tag"] in tags.lower():
-            logger.trace(f"Not matching criteria due to protection tag: {name}")
-            return False
-        # Ignore stopped torrents
-        if torrent.state_enum.is_stopped:
-            logger.trace(f"Not matching criteria due to stopped: {name}")
+        # tracker is only set when a tracker of the torrent is working
+        if torrent.tracker:
+            logger.trace(f"Not matching criteria due to working trackers: {name}")
             return False
 
-        # 0 = Disabled
-        # 1 = Not contacted yet
-        # 2 = Working
-        # 3 = Updating
-        # 4 = Not working
-        working: bool = any(tracker["status"] == 2 for tracker in trackers)
+        return True
+
+
+    def is_criteria_matching(self, torrent: TorrentRecord, trackers: TrackersList) -> bool:
+        name: str = torrent.name
 
         # Ignore working trackers
-        if working:
+        if self.has_working_tracker(trackers=trackers):
             logger.trace(f"Not matching criteria due to working trackers: {name}")
             return False
 
         return True
 
 
-    def take_action(self, torrent: TorrentDictionary, content_path: str, working_content_paths: set[str]) -> None:
-        match CONFIG["jobs"]["delete_not_working_trackers"]["action"]:
+    def take_action(self, action_batch: TorrentActionBatch, planned_action: PlannedAction) -> None:
+        match planned_action.action:
             case "test":
                 logger.info("Action = test | Torrent remains unhandled")
             case "stop":
                 logger.info("Action = stop | Stopping torrent")
-                torrent.stop()
+                action_batch.stop(torrent_hash=planned_action.key)
             case "delete":
-                logger.info("Action = delete | Deleting torrent + files")
-                # Ignore if another working torrent has the same files
-                if content_path in working_content_paths:
-                    logger.warning(f"Only deleting torrent and not files for {torrent.name} Some other torrent that uses these files has working trackers")
-                    torrent.delete(delete_files=False)
-                else:
-                    torrent.delete(delete_files=True)
+                logger.info(f"Action = delete | Deleting torrent{" + files" if planned_action.delete_files else ""}")
+                action_batch.delete(torrent_hash=planned_action.key, delete_files=planned_action.delete_files)
             case _:
                 logger.warning("Invalid action for delete_not_working_trackers job")
 
 
-    def send_discord_notification(self, torrent: TorrentDictionary, trackers: TrackersList) -> None:
+    def send_discord_notification(self, torrent: TorrentRecord, trackers: TrackersList, action_result: Optional[ActionResult]) -> None:
         name: str = torrent.name
         tracker_infos: list[str] = self.get_tracker_infos(name=name, trackers=trackers)
         category: str = torrent.category
@@ -150,14 +256,14 @@ class DeleteNotWorkingTrackers:
         ratio: float = torrent.ratio
         total_size_gib: int = torrent.total_size / 1024 / 1024 / 1024
         total_size_gb: int = torrent.total_size / 1000 / 1000 / 1000
-        seeding_time_days: int = torrent.seeding_time / 60 / 60 / 24
+        seeding_time_days: float = torrent.seeding_time_days
         completed_on_raw: int = torrent.completion_on
         completed_on: datetime = datetime.fromtimestamp(completed_on_raw)
         added_on_raw: int = torrent.added_on
         added_on: datetime = datetime.fromtimestamp(added_on_raw)
 
         fields: list[dict[str, str | bool]] = [
-            { "name": "Action", "value": CONFIG["jobs"]["delete_not_working_trackers"]["action"] },
+            { "name": "Action", "value": ActionUtils().get_action_readable(action=CONFIG["jobs"]["delete_not_working_trackers"]["action"], action_result=action_result) },
             { "name": "Name", "value": name },
         ]
         for tracker_info in tracker_infos:
@@ -1,83 +1,240 @@
 import os
 from datetime import datetime
+from typing import Optional
 from loguru import logger
 
+from src.utils.change_journal import ChangeJournal
 from src.utils.datetime_utils import DateTimeUtils
+from src.utils.db_manager import DbManager
+from src.utils.file_utils import FileUtils
+from src.utils.io_budget import IO_BUDGET
+from src.utils.job_plan import JobPlan, PlannedAction
+from src.utils.metrics import METRICS
+from src.utils.stat_engine import STAT_ENGINE
 from src.utils.discord_webhook_utils import DiscordWebhookUtils, EmbedColor
-from src.utils.strike_utils import StrikeUtils, StrikeType
+from src.utils.strike_utils import StrikeResult, StrikeUtils, StrikeType
+from src.utils.torrent_files_cache import TorrentFilesCache
+from src.utils.torrent_record import TorrentRecord
 
 from src.data.env import ENV
+from src.data.constants import DATA_FOLDER_PATH
 from src.data.config import CONFIG
-from src.utils.qbit_connection import QBIT_CONNECTION
+from src.utils.torrent_snapshot import TORRENT_SNAPSHOT
 
 
 class DeleteOrphaned:
-    def run(self) -> None:
-        def handle_path(path: str, is_file: bool) -> None:
-            if path in qbit_file_paths:
-                logger.trace(f"{path} is in qbit_file_paths, ignoring it")
-                return
-            if not is_file and len(os.listdir(path)) != 0:
-                logger.trace(f"{path} is not empty, ignoring it")
-                return
-            orphaned_paths.append(path)
-            strike_utils = StrikeUtils(strike_type=StrikeType.DELETE_ORPHANED, torrent_hash=path)
-            if not strike_utils.strike_torrent():
-                required_strikes = CONFIG["jobs"]["delete_orphaned"]["required_strikes"]
-                min_strike_days = CONFIG["jobs"]["delete_orphaned"]["min_strike_days"]
-                logger.debug(f"Torrent is orphaned but doesn't reach strike criteria ({strike_utils.get_strikes()}/{required_strikes} strikes, {strike_utils.get_consecutive_days()}/{min_strike_days} days): {path}")
-                return
-            logger.info(f"Found orphaned {"file" if is_file else "dir"}: {path}")
-            stats = os.stat(path)
-            self.take_action(is_file=is_file, path=path)
-            self.send_discord_notification(embed_title=f"Found orphaned {"file" if is_file else "dir"}", file_path=path, stats=stats)
+    def __init__(self) -> None:
+        self.file_utils = FileUtils(
+            data_path=DATA_FOLDER_PATH,
+            torrents_path=ENV.get_torrents_path(),
+            media_path=ENV.get_media_path(),
+        )
+        self.previous_qbit_file_paths: Optional[set[str]] = None
+        # Torrents whose files come from the torrent files cache, set by get_qbit_file_paths
+        self.multi_file_torrents: list[TorrentRecord] = []
+        self.change_journal: Optional[ChangeJournal] = None
+        self.is_change_journal_started = False
 
-        logger.info("Running 'delete_orphaned' job")
-
-        qbit_file_paths: set[str] = self.get_qbit_file_paths()
-        logger.debug(f"Found {len(qbit_file_paths)} files in qbittorrent")
-
-        orphaned_paths = []
-
-        for root, dirnames, filenames in os.walk(ENV.get_torrents_path(), topdown=False):
-            for filename in filenames:
-                file_path = os.path.join(root, filename)
-                handle_path(path=file_path, is_file=True)
-            for dirname in dirnames:
-                dirpath = os.path.join(root, dirname)
-                handle_path(path=dirpath, is_file=False)
-
-        StrikeUtils(strike_type=StrikeType.DELETE_ORPHANED, torrent_hash="unused").cleanup_db(hashes=orphaned_paths)
 
+    def run(self) -> None:
+        logger.info("Running 'delete_orphaned' job")
+        self.start_change_journal()
+        with IO_BUDGET.background_io():
+            plan: JobPlan = self.plan()
+            plan.export()
+            self.apply(plan=plan)
         logger.info(f"job delete_orphaned finished, next run in {CONFIG["jobs"]["delete_orphaned"]["interval_hours"]} hours")
 
 
-    def take_action(self, is_file: bool, path: str) -> None:
-        match CONFIG["jobs"]["delete_orphaned"]["action"]:
+    def start_change_journal(self) -> None:
+        """
+        Starts watching the torrents path on the first run, one-shot plans don't need the watches.
+        The first run walks the whole torrents path anyway.
+        """
+        if self.is_change_journal_started:
+            return
+        self.is_change_journal_started = True
+        if CONFIG["jobs"]["delete_orphaned"].get("watch_changes", False):
+            self.change_journal = ChangeJournal(root_path=ENV.get_torrents_path())
+            if not self.change_journal.start():
+                self.change_journal = None
+
+
+    def plan(self) -> JobPlan:
+        """
+        Finds the orphaned files and decides what to do with them, without changing strikes or files.
+        Consumes the changes of the change journal.
+
+        Returns:
+            JobPlan: The strikes and actions of this run, keyed by path
+        """
+        with METRICS.phase("get_qbit_file_paths"):
+            qbit_file_paths: set[str] = self.get_qbit_file_paths()
+        logger.debug(f"Found {len(qbit_file_paths)} files in qbittorrent")
+
+        with METRICS.phase("find_orphans"):
+            orphaned_entries: list[tuple[os.DirEntry, bool]] = self.get_orphaned_entries(qbit_file_paths=qbit_file_paths)
+            orphaned_entries = self.drop_renamed_torrent_files(orphaned_entries=orphaned_entries, qbit_file_paths=qbit_file_paths)
+        self.previous_qbit_file_paths = qbit_file_paths
+        METRICS.increment("torrents_evaluated_total", len(orphaned_entries))
+
+        orphaned_hashes: list[str] = [entry.path for entry, _ in orphaned_entries]
+        with METRICS.phase("project_strikes"):
+            strike_results: dict[str, StrikeResult] = StrikeUtils(strike_type=StrikeType.DELETE_ORPHANED).project_strikes(strike_hashes=orphaned_hashes)
+
+        action: str = CONFIG["jobs"]["delete_orphaned"]["action"]
+        limit_reached_entries: list[tuple[os.DirEntry, bool]] = []
+        for entry, is_file in orphaned_entries:
+            strike_result: StrikeResult = strike_results[entry.path]
+            if not strike_result.is_limit_reached:
+                required_strikes = CONFIG["jobs"]["delete_orphaned"]["required_strikes"]
+                min_strike_days = CONFIG["jobs"]["delete_orphaned"]["min_strike_days"]
+                logger.debug(f"Torrent is orphaned but doesn't reach strike criteria ({strike_result.strikes}/{required_strikes} strikes, {strike_result.consecutive_days}/{min_strike_days} days): {entry.path}")
+                continue
+            limit_reached_entries.append((entry, is_file))
+
+        # The stats are needed for the notifications
+        planned_actions: list[PlannedAction] = []
+        entry_paths: list[str] = [entry.path for entry, _ in limit_reached_entries]
+        for (entry, is_file), (path, stats) in zip(limit_reached_entries, STAT_ENGINE.stat_many(paths=entry_paths)):
+            if isinstance(stats, OSError):
+                logger.warning(f"Could not stat orphaned {"file" if is_file else "dir"}, ignoring it: {path} ({stats})")
+                continue
+            logger.info(f"Found orphaned {"file" if is_file else "dir"}: {path}")
+            planned_actions.append(PlannedAction(
+                key=path,
+                name=path,
+                action=action,
+                delete_files=action == "delete",
+                strike_result=strike_results[path],
+                context=(is_file, stats),
+            ))
+
+        return JobPlan.create(
+            job_name="delete_orphaned",
+            strike_hashes=orphaned_hashes,
+            reset_hashes=[],
+            strike_results=strike_results,
+            actions=planned_actions,
+        )
+
+
+    def apply(self, plan: JobPlan) -> None:
+        """
+        Writes the strikes of the plan, deletes its files and sends its notifications
+        """
+        # Strike and clean strike db in one transaction
+        with METRICS.phase("strike"), DbManager():
+            strike_results: dict[str, StrikeResult] = StrikeUtils(strike_type=StrikeType.DELETE_ORPHANED).strike_torrents(strike_hashes=plan.strike_hashes)
+            StrikeUtils(strike_type=StrikeType.DELETE_ORPHANED).cleanup_db(hashes=plan.strike_hashes)
+
+        for planned_action in plan.get_applicable_actions(strike_results=strike_results):
+            is_file, stats = planned_action.context
+            with METRICS.phase("act"):
+                self.take_action(is_file=is_file, planned_action=planned_action)
+            self.send_discord_notification(embed_title=f"Found orphaned {"file" if is_file else "dir"}", file_path=planned_action.key, stats=stats)
+        DiscordWebhookUtils().flush()
+
+
+    def get_orphaned_entries(self, qbit_file_paths: set[str]) -> list[tuple[os.DirEntry, bool]]:
+        changes: Optional[tuple[set[str], set[str]]] = self.change_journal.take_changes() if self.change_journal else None
+        if changes is None or self.previous_qbit_file_paths is None:
+            if self.change_journal:
+                self.change_journal.begin_full_walk()
+            logger.debug("Walking the whole torrents path")
+            return list(self.file_utils.walk_orphan_candidates(root_path=ENV.get_torrents_path(), known_paths=qbit_file_paths))
+
+        # Only re-evaluate what changed since the last run: dirty dirs, new dirs, paths that already have strikes
+        # and paths of torrents that have been removed from qbittorrent since then
+        dirty_dirs, created_dirs = changes
+        struck_paths: set[str] = set(StrikeUtils(strike_type=StrikeType.DELETE_ORPHANED).get_struck_hashes())
+        removed_qbit_file_paths: set[str] = self.previous_qbit_file_paths - qbit_file_paths
+        logger.debug(f"Re-evaluating {len(dirty_dirs)} changed dirs, {len(created_dirs)} new dirs, {len(struck_paths)} struck paths and {len(removed_qbit_file_paths)} paths removed from qbittorrent")
+
+        orphaned_entries: dict[str, tuple[os.DirEntry, bool]] = {}
+        for created_dir in created_dirs:
+            for entry, is_file in self.file_utils.walk_orphan_candidates(root_path=created_dir, known_paths=qbit_file_paths):
+                orphaned_entries[entry.path] = (entry, is_file)
+        for entry, is_file in self.file_utils.get_orphan_candidates(
+            root_path=ENV.get_torrents_path(),
+            paths=struck_paths | removed_qbit_file_paths | created_dirs,
+            dirty_dirs=dirty_dirs,
+            known_paths=qbit_file_paths,
+        ):
+            orphaned_entries[entry.path] = (entry, is_file)
+        return list(orphaned_entries.values())
+
+
+    def drop_renamed_torrent_files(self, orphaned_entries: list[tuple[os.DirEntry, bool]], qbit_file_paths: set[str]) -> list[tuple[os.DirEntry, bool]]:
+        """
+        A file renamed inside a multi file torrent keeps the content_path of the torrent, so its cached file list still
+        has the old name and the renamed file looks orphaned. The file lists of the torrents that contain orphan candidates
+        are fetched again before anything is struck, their files are added to qbit_file_paths.
+
+        Returns:
+            list: The orphaned entries that are not a file of a torrent
+        """
+        torrents_by_content_path: dict[str, TorrentRecord] = {torrent.content_path.rstrip("/"): torrent for torrent in self.multi_file_torrents}
+        root_path: str = ENV.get_torrents_path().rstrip("/")
+        refresh_torrents: dict[str, TorrentRecord] = {}
+        for entry, is_file in orphaned_entries:
+            if not is_file:
+                continue
+            dir_path: str = os.path.dirname(entry.path)
+            while dir_path.startswith(f"{root_path}/"):
+                torrent: Optional[TorrentRecord] = torrents_by_content_path.get(dir_path)
+                if torrent is not None:
+                    refresh_torrents[torrent.hash] = torrent
+                    break
+                dir_path = os.path.dirname(dir_path)
+        if not refresh_torrents:
+            return orphaned_entries
+
+        logger.debug(f"Orphan candidates are in {len(refresh_torrents)} torrents, fetching their file lists again")
+        file_names_by_hash: dict[str, list[str]] = TorrentFilesCache().refresh_file_names(torrents=list(refresh_torrents.values()))
+        for torrent in refresh_torrents.values():
+            qbit_file_paths.update(self.get_torrent_file_paths(torrent=torrent, file_names=file_names_by_hash[torrent.hash]))
+        return [(entry, is_file) for entry, is_file in orphaned_entries if entry.path not in qbit_file_paths]
+
+
+    def take_action(self, is_file: bool, planned_action: PlannedAction) -> None:
+        path: str = planned_action.key
+        match planned_action.action:
             case "test":
                 logger.info("Action = test | Doing nothing")
             case "delete":
                 logger.info("Action = delete | Deleting files")
+                IO_BUDGET.spend()
                 if is_file:
                     os.remove(path)
                 else:
                     os.rmdir(path)
+                METRICS.increment("actions_total", action="delete")
             case _:
                 logger.warning("Invalid action for delete_orphaned job")
 
 
     def get_qbit_file_paths(self) -> set[str]:
         qbit_paths = []
-        qbt_client = QBIT_CONNECTION.get_client()
-        for torrent in qbt_client.torrents_info():
+        multi_file_torrents: list[TorrentRecord] = []
+        for torrent in TORRENT_SNAPSHOT.get_torrents():
+            IO_BUDGET.spend()
             if os.path.isfile(torrent.content_path):
                 qbit_paths.append(torrent.content_path)
                 continue
-            files = [f"{torrent.content_path}/{"/".join(str(file.name).split("/")[1:])}" for file in torrent.files]
-            qbit_paths.extend(files)
+            multi_file_torrents.append(torrent)
+        file_names_by_hash: dict[str, list[str]] = TorrentFilesCache().get_file_names(torrents=multi_file_torrents)
+        for torrent in multi_file_torrents:
+            qbit_paths.extend(self.get_torrent_file_paths(torrent=torrent, file_names=file_names_by_hash[torrent.hash]))
+        self.multi_file_torrents = multi_file_torrents
         return set(qbit_paths)
 
 
+    def get_torrent_file_paths(self, torrent: TorrentRecord, file_names: list[str]) -> list[str]:
+        # File names start with the name of the torrent, which is the last part of the content path
+        return [f"{torrent.content_path}/{"/".join(file_name.split("/")[1:])}" for file_name in file_names]
+
+
     def send_discord_notification(self, embed_title: str, file_path: str, stats: os.stat_result) -> None:
             DiscordWebhookUtils().send_webhook_embed(
                 embed_color=EmbedColor.PURPLE,
@@ -1,47 +1,129 @@
 import signal
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Callable
 from loguru import logger
 
 from src.jobs.delete_orphaned import DeleteOrphaned
 from src.jobs.delete_forgotten import DeleteForgotten
 from src.jobs.delete_not_working_trackers import DeleteNotWorkingTrackers
+from src.utils.db_manager import DbManager
 from src.utils.db_scripts import DbScripts
 from src.utils.job_manager import JobManager
+from src.utils.job_plan import JobPlan
+from src.utils.job_profiler import JobProfiler
+from src.utils.metrics import METRICS
+from src.utils.discord_webhook_utils import DiscordWebhookUtils
+from src.utils.qbit_connection import QBIT_CONNECTION
 
 from src.data.config import CONFIG
+from src.data.env import ENV
+
+
+def validate() -> int:
+    """
+    Checks the config and the environment variables, without connecting to qbittorrent or touching the db
+
+    Returns:
+        int: The exit code, 1 if there are problems
+    """
+    problems: list[str] = CONFIG.validate() + ENV.validate()
+    for problem in problems:
+        logger.error(f"Invalid config: {problem}")
+    if problems:
+        return 1
+    logger.info("Config is valid")
+    return 0
+
+
+def plan(job_names: list[str]) -> int:
+    """
+    Makes the plans of the given jobs at the same time and writes them to plans/<job>.json,
+    without changing strikes, torrents or files
+
+    Returns:
+        int: The exit code
+    """
+    if validate() != 0:
+        return 1
+    job_classes: dict[str, Callable[[], DeleteOrphaned | DeleteForgotten | DeleteNotWorkingTrackers]] = {
+        "delete_orphaned": DeleteOrphaned,
+        "delete_forgotten": DeleteForgotten,
+        "delete_not_working_trackers": DeleteNotWorkingTrackers,
+    }
+    unknown_job_names: list[str] = [job_name for job_name in job_names if job_name not in job_classes]
+    if unknown_job_names:
+        logger.critical(f"Jobs {", ".join(unknown_job_names)} do not exist.")
+        return 1
+
+    DbScripts().create_tables()
+    with ThreadPoolExecutor(max_workers=len(job_names), thread_name_prefix="plan") as executor:
+        futures = {job_name: executor.submit(lambda job_name=job_name: job_classes[job_name]().plan()) for job_name in job_names}
+    for job_name, future in futures.items():
+        job_plan: JobPlan = future.result()
+        logger.info(f"Wrote plan of {job_name} with {len(job_plan.actions)} actions to {job_plan.write_json()}")
+    DbManager.close_connections()
+    return 0
 
 
 def main() -> int:
     def shutdown(signum, frame):
-        logger.info("Shutting down scheduler...")
-        job_manager.running = False
+        logger.info("Shutting down scheduler, waiting for running jobs...")
+        # Running jobs still use their db connections, so everything below happens after they finished
+        job_manager.shutdown()
+        logger.info("Sending queued discord notifications")
+        DiscordWebhookUtils().flush()
         logger.info("Logging out of Qbittorrent")
-        try:
-            QBIT_CONNECTION.get_client().auth_log_out()
-        except ConnectionError:
-            pass
+        QBIT_CONNECTION.log_out()
+        METRICS.stop_http_server()
+        DbManager.close_connections()
         return 0
 
+    # Fail fast on a broken config, before anything is started
+    if validate() != 0:
+        return 1
+
     # Db setup
     DbScripts().create_tables()
 
-    # Login to qbittorrent
-    from src.utils.qbit_connection import QBIT_CONNECTION
-    try:
-        QBIT_CONNECTION.get_client()
-    except ConnectionError:
-        logger.critical("Couldn't establish connection with qbittorrent, exiting")
-        return 1
-
     # Jobs
     jobs: dict[str, Callable[[], None]] = {
         "delete_orphaned": DeleteOrphaned().run,
         "delete_forgotten": DeleteForgotten().run,
         "delete_not_working_trackers": DeleteNotWorkingTrackers().run,
     }
+    jobs = {job_name: METRICS.track_job(job_name=job_name, job_method=job_method) for job_name, job_method in jobs.items()}
 
-    # Testing
+    # Profiling, PROFILE_JOBS overrides the configured jobs
+    profiling_config: dict = CONFIG.get("profiling") or {}
+    profile_jobs: list[str] | None = ENV.get_profile_jobs()
+    job_profiler = JobProfiler(
+        job_names=set(profile_jobs if profile_jobs is not None else profiling_config.get("jobs") or []),
+        cpu=bool(profiling_config.get("cpu", True)),
+        memory=bool(profiling_config.get("memory", False)),
+        keep_runs=int(profiling_config.get("keep_runs", 10)),
+    )
+    jobs = {job_name: job_profiler.wrap(job_name=job_name, job_method=job_method) for job_name, job_method in jobs.items()}
+
+    # Metrics endpoint
+    metrics_config: dict = CONFIG.get("metrics") or {}
+    if metrics_config.get("port"):
+        try:
+            METRICS.start_http_server(host=metrics_config.get("host") or "127.0.0.1", port=int(metrics_config["port"]))
+        except OSError as e:
+            logger.error(f"Couldn't start the metrics endpoint: {e}")
+
+    # Jobs that use the same resource never run at the same time
+    job_resources: dict[str, set[str]] = {
+        "delete_orphaned": {"filesystem"},
+        "delete_forgotten": {"filesystem"},
+        "delete_not_working_trackers": {"qbittorrent"},
+    }
+    # Deleting torrents without working trackers scans the content of every torrent (ContentIdentityIndex)
+    if CONFIG["jobs"]["delete_not_working_trackers"]["action"] == "delete":
+        job_resources["delete_not_working_trackers"].add("filesystem")
+
+    # Testing, the job logs in itself
     testing_job: str | None = CONFIG["testing"]["job"]
     if testing_job:
         job_method: Optional[Callable[[], None]] = jobs.get(testing_job)
@@ -50,20 +132,31 @@ def main() -> int:
             return 1
         logger.info(f"Testing {testing_job}")
         job_method()
+        DiscordWebhookUtils().flush()
         logger.info(f"Testing {testing_job} finished, sleeping now")
         while True:
             time.sleep(1)
 
+    # Login to qbittorrent while waiting for the first job run
+    QBIT_CONNECTION.connect_in_background()
+
     # Define shutdown on signal
     signal.signal(signal.SIGTERM, shutdown)
     signal.signal(signal.SIGINT, shutdown)
 
     # Job setup
-    job_manager = JobManager()
+    scheduler_config: dict = CONFIG.get("scheduler") or {}
+    job_manager = JobManager(max_workers=int(scheduler_config.get("max_workers", 2)))
     for job_name, job_method in jobs.items():
         interval_hours = int(CONFIG["jobs"][job_name]["interval_hours"])
         if interval_hours != 0:
-            job_manager.add_job(job_method=job_method, interval_hours=interval_hours)
+            job_manager.add_job(
+                job_name=job_name,
+                job_method=job_method,
+                interval_hours=interval_hours,
+                resources=job_resources[job_name],
+                jitter_seconds=float(scheduler_config.get("start_jitter_seconds", 0)),
+            )
             logger.info(f"job {job_name} has been added, next run in {interval_hours} hours")
 
     try:
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+import qbittorrentapi
+from loguru import logger
+
+from src.utils.metrics import METRICS
+from src.utils.qbit_connection import QBIT_CONNECTION
+from src.utils.torrent_snapshot import TORRENT_SNAPSHOT
+
+
+class TorrentAction(Enum):
+    STOP = "stop"
+    DELETE = "delete"
+
+
+@dataclass(frozen=True)
+class ActionResult:
+    action: TorrentAction
+    delete_files: bool
+    error: Optional[str] = None
+
+    @property
+    def is_success(self) -> bool:
+        return self.error is None
+
+
+class TorrentActionBatch:
+    """
+    Collects the stop and delete decisions of a job run, so qbittorrent is changed once at the end of the run
+    and not while the job is still iterating the torrent list.
+    """
+    def __init__(self, chunk_size: int = 100) -> None:
+        self.chunk_size = chunk_size
+        self.actions: dict[str, tuple[TorrentAction, bool]] = {}
+
+
+    def stop(self, torrent_hash: str) -> None:
+        self.actions[torrent_hash] = (TorrentAction.STOP, False)
+
+
+    def delete(self, torrent_hash: str, delete_files: bool) -> None:
+        self.actions[torrent_hash] = (TorrentAction.DELETE, delete_files)
+
+
+    def apply(self) -> dict[str, ActionResult]:
+        """
+        Applies all collected actions with one api call per action, delete_files flag and chunk.
+
+        Returns:
+            dict: The outcome per torrent hash, a failed api call fails every hash of its chunk
+        """
+        hashes_by_action: dict[tuple[TorrentAction, bool], list[str]] = {}
+        for torrent_hash, action in self.actions.items():
+            hashes_by_action.setdefault(action, []).append(torrent_hash)
+        self.actions = {}
+        if not hashes_by_action:
+            return {}
+
+        results: dict[str, ActionResult] = {}
+        qbt_client = QBIT_CONNECTION.get_client()
+        for (action, delete_files), torrent_hashes in hashes_by_action.items():
+            for i in range(0, len(torrent_hashes), self.chunk_size):
+                chunk: list[str] = torrent_hashes[i:i + self.chunk_size]
+                error: Optional[str] = None
+                try:
+                    match action:
+                        case TorrentAction.STOP:
+                            qbt_client.torrents_stop(torrent_hashes=chunk)
+                        case TorrentAction.DELETE:
+                            qbt_client.torrents_delete(delete_files=delete_files, torrent_hashes=chunk)
+                    logger.debug(f"Applied {action.value} (delete_files={delete_files}) to {len(chunk)} torrents")
+                    METRICS.increment("actions_total", len(chunk), action=action.value)
+                except qbittorrentapi.APIError as e:
+                    error = str(e) or type(e).__name__
+                    logger.error(f"Failed to {action.value} {len(chunk)} torrents: {error}")
+                for torrent_hash in chunk:
+                    results[torrent_hash] = ActionResult(action=action, delete_files=delete_files, error=error)
+
+        TORRENT_SNAPSHOT.invalidate()
+        return results
+
+
+class ActionUtils:
+    def get_action_readable(self, action: str, action_result: Optional[ActionResult]) -> str:
+        if action_result is None:
+            return action
+        action_readable = action_result.action.value
+        if action_result.action == TorrentAction.DELETE and not action_result.delete_files:
+            action_readable += " (files kept)"
+        if not action_result.is_success:
+            action_readable += f" (failed: {action_result.error})"
+        return action_readable
@@ -0,0 +1,183 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+from typing import Optional
+from loguru import logger
+
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class ChangeJournal:
+    """
+    Watches a tree with inotify and records the dirs whose entries changed.
+    The journal is only usable after begin_full_walk has been called once,
+    it needs a full walk again after the kernel queue overflowed and is unusable when a watch can't be added.
+    """
+    def __init__(self, root_path: str) -> None:
+        self.root_path = root_path.rstrip("/") or "/"
+        self.fd: int = -1
+        self.path_by_wd: dict[int, str] = {}
+        self.dirty_dirs: set[str] = set()
+        self.created_dirs: set[str] = set()
+        self.is_valid = False
+        self.is_broken = False
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.libc: Optional[ctypes.CDLL] = None
+
+
+    def start(self) -> bool:
+        """
+        Starts watching the tree in a background thread
+
+        Returns:
+            bool: True if watching works, false otherwise (e.g. not linux)
+        """
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify is not available, delete_orphaned will always walk the whole torrents path: {e}")
+            return False
+        if self.fd < 0:
+            logger.warning(f"inotify_init1 failed ({os.strerror(ctypes.get_errno())}), delete_orphaned will always walk the whole torrents path")
+            return False
+
+        with self.lock:
+            self.__add_watches(dir_path=self.root_path)
+        self.thread = threading.Thread(target=self.__read_events, name="change-journal", daemon=True)
+        self.thread.start()
+        logger.info(f"Watching {len(self.path_by_wd)} dirs in {self.root_path} for changes")
+        return True
+
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+    def begin_full_walk(self) -> None:
+        """
+        Needs to be called right before a full walk, changes from then on are recorded for the next run
+        """
+        with self.lock:
+            self.dirty_dirs.clear()
+            self.created_dirs.clear()
+            self.is_valid = not self.is_broken and self.thread is not None
+
+
+    def take_changes(self) -> Optional[tuple[set[str], set[str]]]:
+        """
+        Takes the recorded changes and starts recording again
+
+        Returns:
+            tuple: The dirs whose entries changed and the dirs that were created or moved into the tree.
+                None if the journal is not usable and a full walk is needed.
+        """
+        with self.lock:
+            if not self.is_valid:
+                return None
+            changes = (self.dirty_dirs, self.created_dirs)
+            self.dirty_dirs = set()
+            self.created_dirs = set()
+            return changes
+
+
+    def __add_watches(self, dir_path: str) -> None:
+        pending_dirs: list[str] = [dir_path]
+        while pending_dirs:
+            path = pending_dirs.pop()
+            wd: int = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                logger.warning(f"Could not watch {path} ({os.strerror(error)}), falling back to full walks")
+                self.is_broken = True
+                self.is_valid = False
+                continue
+            # Adding a watch to an already watched dir (e.g. moved) returns the same wd
+            self.path_by_wd[wd] = path
+            try:
+                with os.scandir(path) as entries:
+                    pending_dirs.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+
+    def __remove_watches(self, dir_path: str) -> None:
+        prefix = f"{dir_path}/"
+        for wd, path in list(self.path_by_wd.items()):
+            if path == dir_path or path.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.path_by_wd[wd]
+
+
+    def __read_events(self) -> None:
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([self.fd], [], [], 1)
+            if not readable:
+                continue
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                logger.error(f"Could not read inotify events, falling back to full walks: {e}")
+                with self.lock:
+                    self.is_broken = True
+                    self.is_valid = False
+                return
+            with self.lock:
+                self.__handle_events(buffer=buffer)
+
+
+    def __handle_events(self, buffer: bytes) -> None:
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = os.fsdecode(buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_length].rstrip(b"\0"))
+            offset += EVENT_HEADER.size + name_length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed, next delete_orphaned run walks the whole torrents path")
+                self.is_valid = False
+                continue
+            if mask & IN_IGNORED:
+                self.path_by_wd.pop(wd, None)
+                continue
+
+            dir_path = self.path_by_wd.get(wd)
+            if dir_path is None or not name:
+                continue
+            path = os.path.join(dir_path, name)
+            logger.trace(f"inotify event {hex(mask)} for {path}")
+            self.dirty_dirs.add(dir_path)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.created_dirs.add(path)
+                    self.__add_watches(dir_path=path)
+                elif mask & IN_MOVED_FROM:
+                    self.__remove_watches(dir_path=path)
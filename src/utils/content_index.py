@@ -0,0 +1,74 @@
+from typing import Iterable
+from loguru import logger
+
+from src.utils.file_utils import FileUtils
+from src.utils.job_stop import JOB_STOP
+from src.utils.torrent_record import TorrentRecord
+
+
+class ContentIdentityIndex:
+    """
+    Groups torrents that use the same files: torrents with the same content path and torrents
+    with hard links of the same file (same st_dev and st_ino), e.g. cross-seeds under another path.
+    Built once per run with one stat pass over the content of all torrents.
+    """
+    def __init__(self, file_utils: FileUtils, torrents: Iterable[TorrentRecord]) -> None:
+        # Union-find over torrent hashes, a group is identified by its root hash
+        self.parents: dict[str, str] = {}
+        self.__build(file_utils=file_utils, torrents=torrents)
+
+
+    def __build(self, file_utils: FileUtils, torrents: Iterable[TorrentRecord]) -> None:
+        hash_by_content_path: dict[str, str] = {}
+        hash_by_inode: dict[tuple[int, int], str] = {}
+        torrent_count = 0
+        for torrent in torrents:
+            JOB_STOP.check()
+            torrent_count += 1
+            self.parents[torrent.hash] = torrent.hash
+            content_path: str = torrent.content_path.rstrip("/")
+            # Every content path is only scanned once
+            first_hash = hash_by_content_path.setdefault(content_path, torrent.hash)
+            if first_hash != torrent.hash:
+                self.__union(torrent.hash, first_hash)
+                continue
+            for inode in file_utils.get_content_inodes(content_path=content_path):
+                inode_hash = hash_by_inode.setdefault(inode, torrent.hash)
+                if inode_hash != torrent.hash:
+                    self.__union(torrent.hash, inode_hash)
+        group_count: int = len({self.__find(torrent_hash) for torrent_hash in self.parents})
+        logger.debug(f"Built content identity index of {torrent_count} torrents with {len(hash_by_inode)} hard linked files in {group_count} groups")
+
+
+    def __find(self, torrent_hash: str) -> str:
+        root: str = torrent_hash
+        while self.parents[root] != root:
+            root = self.parents[root]
+        # Path compression, so later lookups are O(1)
+        while self.parents[torrent_hash] != root:
+            self.parents[torrent_hash], torrent_hash = root, self.parents[torrent_hash]
+        return root
+
+
+    def __union(self, torrent_hash: str, other_hash: str) -> None:
+        root, other_root = self.__find(torrent_hash), self.__find(other_hash)
+        if root != other_root:
+            self.parents[other_root] = root
+
+
+    def get_group(self, torrent_hash: str) -> str:
+        """
+        Returns:
+            str: The id of the group of the torrent, the torrent hash itself if it's unknown
+        """
+        if torrent_hash not in self.parents:
+            return torrent_hash
+        return self.__find(torrent_hash)
+
+
+    def get_groups(self, torrent_hashes: Iterable[str]) -> set[str]:
+        """
+        Returns:
+            set: The ids of the groups of the torrents
+        """
+        return {self.get_group(torrent_hash) for torrent_hash in torrent_hashes}
@@ -1,37 +1,99 @@
+import os
 import sqlite3
-from typing import Any, List, Optional, Tuple
+import threading
+from typing import Any, Iterable, List, Optional, Tuple
 
-from src.data.constants import DATA_FILE_PATH
+from src.data.constants import CONFIG_FOLDER_PATH, DATA_FILE_PATH
+from src.utils.metrics import METRICS
 
 
 class DbManager:
+    """
+    Gives access to a long-lived connection per thread (WAL, synchronous=NORMAL, statement cache).
+    The outermost `with DbManager() as db` is one transaction, nested ones join it as savepoints,
+    so wrapping several calls in an outer `with DbManager()` commits them at once.
+    """
+    __local = threading.local()
+    __connections: list[sqlite3.Connection] = []
+    __connections_lock = threading.Lock()
+
     def __init__(self):
         self.conn: Optional[sqlite3.Connection] = None
+        self.savepoint: Optional[str] = None
+
+    @classmethod
+    def __get_connection(cls) -> sqlite3.Connection:
+        conn: Optional[sqlite3.Connection] = getattr(cls.__local, "conn", None)
+        if conn is None:
+            os.makedirs(CONFIG_FOLDER_PATH, exist_ok=True)
+            # Transactions are handled by __enter__ and __exit__, not by the sqlite3 module
+            conn = sqlite3.connect(DATA_FILE_PATH, isolation_level=None, check_same_thread=False, cached_statements=256, timeout=60)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA cache_size = -65536")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            cls.__local.conn = conn
+            cls.__local.depth = 0
+            with cls.__connections_lock:
+                cls.__connections.append(conn)
+        return conn
+
+    @classmethod
+    def close_connections(cls) -> None:
+        with cls.__connections_lock:
+            for conn in cls.__connections:
+                conn.close()
+            cls.__connections.clear()
+        cls.__local = threading.local()
 
     def __enter__(self) -> "DbManager":
-        self.conn = sqlite3.connect(DATA_FILE_PATH)
-        self.conn.row_factory = sqlite3.Row
+        self.conn = self.__get_connection()
+        depth: int = self.__local.depth
+        if depth == 0:
+            self.conn.execute("BEGIN")
+        else:
+            self.savepoint = f"db_manager_{depth}"
+            self.conn.execute(f"SAVEPOINT {self.savepoint}")
+        self.__local.depth = depth + 1
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         if not self.conn:
             return
-        if exc_type is None:
-            self.conn.commit()
+        self.__local.depth -= 1
+        if self.savepoint is None:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
         else:
-            self.conn.rollback()
-        self.conn.close()
+            if exc_type is not None:
+                self.conn.execute(f"ROLLBACK TO {self.savepoint}")
+            self.conn.execute(f"RELEASE {self.savepoint}")
+            self.savepoint = None
         self.conn = None
 
-    def execute(self, query: str, params: Tuple[Any, ...] = ()) -> None:
+    def execute(self, query: str, params: Tuple[Any, ...] = ()) -> int:
         if not self.conn:
             raise RuntimeError("DbManager must be used as a context manager (with DbManager() as db).")
+        METRICS.increment("db_statements_total", method="execute")
         cur = self.conn.execute(query, params)
+        row_count = cur.rowcount
+        cur.close()
+        return row_count
+
+    def execute_many(self, query: str, params_seq: Iterable[Tuple[Any, ...]]) -> None:
+        if not self.conn:
+            raise RuntimeError("DbManager must be used as a context manager.")
+        METRICS.increment("db_statements_total", method="execute_many")
+        cur = self.conn.executemany(query, params_seq)
         cur.close()
 
     def execute_fetchall(self, query: str, params: Tuple[Any, ...] = ()) -> List[sqlite3.Row]:
         if not self.conn:
             raise RuntimeError("DbManager must be used as a context manager.")
+        METRICS.increment("db_statements_total", method="execute_fetchall")
         cur = self.conn.execute(query, params)
         rows = cur.fetchall()
         cur.close()
@@ -40,6 +102,7 @@ class DbManager:
     def execute_fetchone(self, query: str, params: Tuple[Any, ...] = ()) -> Optional[sqlite3.Row]:
         if not self.conn:
             raise RuntimeError("DbManager must be used as a context manager.")
+        METRICS.increment("db_statements_total", method="execute_fetchone")
         cur = self.conn.execute(query, params)
         row = cur.fetchone()
         cur.close()
@@ -1,9 +1,20 @@
+from loguru import logger
+
 from src.utils.db_manager import DbManager
 from src.utils.strike_utils import StrikeType
 
 
 class DbScripts:
     def create_tables(self) -> None:
+        # Nested DbManager contexts join this one, so the whole setup is committed at once
+        with DbManager():
+            self.create_strike_tables()
+            self.migrate()
+            self.create_media_index_tables()
+            self.create_torrent_files_cache_tables()
+
+
+    def create_strike_tables(self) -> None:
         for strike_type in StrikeType:
             create_sql = f"""
             CREATE TABLE IF NOT EXISTS {strike_type.value}_strikes (
@@ -12,5 +23,121 @@ class DbScripts:
                 timestamp TIMESTAMP NOT NULL
             );
             """
+            create_streaks_sql = f"""
+            CREATE TABLE IF NOT EXISTS {strike_type.value}_strike_streaks (
+                hash VARCHAR(255) PRIMARY KEY,
+                strikes INTEGER NOT NULL,
+                streak_start_day INTEGER NOT NULL,
+                last_strike_day INTEGER NOT NULL,
+                first_seen INTEGER NOT NULL
+            );
+            """
+            create_index_sql = f"""
+            CREATE INDEX IF NOT EXISTS {strike_type.value}_strikes_hash ON {strike_type.value}_strikes (hash);
+            """
             with DbManager() as db:
                 db.execute(create_sql)
+                db.execute(create_streaks_sql)
+                db.execute(create_index_sql)
+
+
+    def migrate(self) -> None:
+        with DbManager() as db:
+            row = db.execute_fetchone("PRAGMA user_version")
+        user_version: int = row[0] if row else 0
+
+        if user_version < 1:
+            self.migrate_strike_logs_to_streaks()
+            with DbManager() as db:
+                db.execute("PRAGMA user_version = 1")
+
+        if user_version < 2:
+            # The media index lost its nlink column, it's rebuilt on the next delete_forgotten run
+            with DbManager() as db:
+                db.execute("DROP TABLE IF EXISTS media_index_files")
+                db.execute("DROP TABLE IF EXISTS media_index_dirs")
+                db.execute("PRAGMA user_version = 2")
+
+        if user_version < 3:
+            # The torrent mirror is only kept in memory now
+            with DbManager() as db:
+                db.execute("DROP TABLE IF EXISTS torrent_mirror")
+                db.execute("DROP TABLE IF EXISTS torrent_mirror_state")
+                db.execute("PRAGMA user_version = 3")
+
+
+    def migrate_strike_logs_to_streaks(self) -> None:
+        """
+        Converts the old one row per strike logs to one streak row per hash.
+        The streak is the run of consecutive strike days that ends with the last strike day.
+        """
+        for strike_type in StrikeType:
+            # julianday('0001-01-01') is 1721425.5 and date(1, 1, 1).toordinal() is 1
+            migrate_sql = f"""
+            INSERT OR REPLACE INTO {strike_type.value}_strike_streaks (hash, strikes, streak_start_day, last_strike_day, first_seen)
+            WITH days AS (
+                SELECT DISTINCT hash, CAST(julianday(date(timestamp)) - 1721424.5 AS INTEGER) AS day
+                FROM {strike_type.value}_strikes
+            ),
+            islands AS (
+                SELECT hash, day, day + ROW_NUMBER() OVER (PARTITION BY hash ORDER BY day DESC) AS island
+                FROM days
+            ),
+            streaks AS (
+                SELECT hash, MIN(day) AS streak_start_day, MAX(day) AS last_strike_day
+                FROM (SELECT hash, day, island, MAX(island) OVER (PARTITION BY hash) AS latest_island FROM islands)
+                WHERE island = latest_island
+                GROUP BY hash
+            ),
+            counts AS (
+                SELECT hash, COUNT(*) AS strikes, CAST(strftime('%s', MIN(timestamp)) AS INTEGER) AS first_seen
+                FROM {strike_type.value}_strikes
+                GROUP BY hash
+            )
+            SELECT counts.hash, counts.strikes, streaks.streak_start_day, streaks.last_strike_day, counts.first_seen
+            FROM counts JOIN streaks ON streaks.hash = counts.hash
+            """
+            with DbManager() as db:
+                migrated_count = db.execute(migrate_sql)
+            if migrated_count > 0:
+                logger.info(f"Migrated strikes of {migrated_count} torrents to {strike_type.value}_strike_streaks")
+
+
+    def create_media_index_tables(self) -> None:
+        create_sqls = [
+            """
+            CREATE TABLE IF NOT EXISTS media_index_dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime_ns INTEGER NOT NULL
+            );
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS media_index_dirs_parent ON media_index_dirs (parent);
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS media_index_files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                PRIMARY KEY (dir, name)
+            );
+            """,
+        ]
+        with DbManager() as db:
+            for create_sql in create_sqls:
+                db.execute(create_sql)
+
+
+    def create_torrent_files_cache_tables(self) -> None:
+        create_sql = """
+        CREATE TABLE IF NOT EXISTS torrent_files_cache (
+            hash VARCHAR(255) PRIMARY KEY,
+            content_path TEXT NOT NULL,
+            save_path TEXT NOT NULL,
+            file_names TEXT NOT NULL
+        );
+        """
+        with DbManager() as db:
+            db.execute(create_sql)
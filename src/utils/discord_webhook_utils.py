@@ -1,4 +1,6 @@
 from datetime import datetime, timezone
+import queue
+import threading
 import time
 import typing
 import requests
@@ -15,31 +17,171 @@ class EmbedColor(Enum):
     PURPLE = 0xd880ff
 
 
-class DiscordWebhookUtils:
+class DiscordWebhookQueue:
+    """
+    Delivers webhooks in a background thread, so jobs never wait for discord.
+    Embeds without content are packed into one message (up to 10 embeds and 6000 characters),
+    the rate limit headers are used to wait before discord has to answer with 429.
+    """
+    max_embeds_per_message = 10
+    max_embed_chars_per_message = 6000
+    batch_wait_seconds = 1
+
     def __init__(self) -> None:
-        self.webhook_url: str = CONFIG["notifications"]["discord_webhook_url"]
+        self.queue: queue.Queue[tuple[str, dict[str, typing.Any]]] = queue.Queue()
+        self.session = requests.Session()
+        self.thread: typing.Optional[threading.Thread] = None
+        self.thread_lock = threading.Lock()
+        self.rate_limited_until: float = 0
+
+
+    def enqueue(self, webhook_url: str, data: dict[str, typing.Any]) -> None:
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__deliver_forever, name="discord-webhook", daemon=True)
+                self.thread.start()
+        self.queue.put((webhook_url, data))
+
+
+    def flush(self, timeout_seconds: float = 60) -> None:
+        """
+        Waits until all queued webhooks have been delivered (or the timeout has been reached)
+        """
+        deadline = time.monotonic() + timeout_seconds
+        while self.queue.unfinished_tasks > 0:
+            if time.monotonic() > deadline:
+                logger.warning(f"{self.queue.unfinished_tasks} discord webhooks have not been delivered")
+                return
+            time.sleep(0.1)
 
 
-    def __make_request(self, json: typing.Any) -> None:
-        if not self.webhook_url:
-            return
-
+    def __deliver_forever(self) -> None:
+        # A webhook that didn't fit into the previous message starts the next one
+        carried_over: typing.Optional[tuple[str, dict[str, typing.Any]]] = None
+        while True:
+            webhook_url, data = carried_over or self.queue.get()
+            carried_over = None
+            task_count = 1
+            try:
+                if self.__is_packable(data=data):
+                    # Give the job a moment to queue more embeds, then pack them into this message
+                    data = {"content": "", "embeds": list(data["embeds"])}
+                    embed_chars = self.__get_embed_chars(embed=data["embeds"][0])
+                    deadline = time.monotonic() + self.batch_wait_seconds
+                    while len(data["embeds"]) < self.max_embeds_per_message:
+                        try:
+                            next_webhook_url, next_data = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                        except queue.Empty:
+                            break
+                        if next_webhook_url != webhook_url or not self.__is_packable(data=next_data):
+                            carried_over = (next_webhook_url, next_data)
+                            break
+                        next_embed_chars = self.__get_embed_chars(embed=next_data["embeds"][0])
+                        if embed_chars + next_embed_chars > self.max_embed_chars_per_message:
+                            carried_over = (next_webhook_url, next_data)
+                            break
+                        data["embeds"].extend(next_data["embeds"])
+                        embed_chars += next_embed_chars
+                        task_count += 1
+                self.__deliver(webhook_url=webhook_url, data=data)
+            except Exception:
+                # A broken message must not stop the delivery of the following ones
+                logger.exception("Failed to send discord webhook")
+            finally:
+                for _ in range(task_count):
+                    self.queue.task_done()
+
+
+    def __is_packable(self, data: dict[str, typing.Any]) -> bool:
+        return not data.get("content") and len(data.get("embeds", [])) == 1
+
+
+    def __get_embed_chars(self, embed: dict[str, typing.Any]) -> int:
+        chars = len(str(embed.get("title", ""))) + len(str(embed.get("description", "")))
+        for field in embed.get("fields", []):
+            chars += len(str(field.get("name", ""))) + len(str(field.get("value", "")))
+        return chars
+
+
+    def __deliver(self, webhook_url: str, data: dict[str, typing.Any]) -> None:
         while True:
-            response = requests.post(self.webhook_url, json=json)
-            if response.status_code == 204:
-                logger.trace("Discord webhook sent successfully")
+            wait_seconds = self.rate_limited_until - time.monotonic()
+            if wait_seconds > 0:
+                logger.trace(f"Waiting {round(wait_seconds, 2)}s for the discord rate limit")
+                time.sleep(wait_seconds)
+
+            try:
+                response = self.session.post(webhook_url, json=data, timeout=30)
+            except requests.RequestException as e:
+                logger.error(f"Failed to send discord webhook: {e}")
+                return
+            self.__update_rate_limit(response=response)
+
+            if response.status_code in (200, 204):
+                logger.trace(f"Discord webhook with {len(data.get("embeds", []))} embeds sent successfully")
                 return
             elif response.status_code == 429:
-                data: dict = response.json()
-                retry_after_seconds: float = data.get("retry_after", 1)
+                retry_after_seconds: float = self.__get_retry_after_seconds(response=response)
                 logger.warning(f"Discord webhook rate limited. Retrying after {round(retry_after_seconds, 2)}s")
-                time.sleep(retry_after_seconds)
+                self.rate_limited_until = max(self.rate_limited_until, time.monotonic() + retry_after_seconds)
                 continue
             else:
                 logger.error(f"Failed to send discord webhook: {response.status_code} - {response.text}")
                 return
 
 
+    def __get_retry_after_seconds(self, response: requests.Response) -> float:
+        """
+        Returns:
+            float: retry_after of the body, the Retry-After header if the body is not json (e.g. a proxy error page) or 1
+        """
+        try:
+            return float(response.json()["retry_after"])
+        except (ValueError, KeyError, TypeError):
+            pass
+        try:
+            return float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            return 1
+
+
+    def __update_rate_limit(self, response: requests.Response) -> None:
+        remaining: typing.Optional[str] = response.headers.get("X-RateLimit-Remaining")
+        reset_after: typing.Optional[str] = response.headers.get("X-RateLimit-Reset-After")
+        if remaining is None or reset_after is None:
+            return
+        try:
+            is_exhausted: bool = int(remaining) <= 0
+            reset_after_seconds = float(reset_after)
+        except ValueError:
+            logger.debug(f"Ignoring invalid discord rate limit headers: {remaining}, {reset_after}")
+            return
+        if is_exhausted:
+            self.rate_limited_until = max(self.rate_limited_until, time.monotonic() + reset_after_seconds)
+
+
+DISCORD_WEBHOOK_QUEUE = DiscordWebhookQueue()
+
+
+class DiscordWebhookUtils:
+    def __init__(self) -> None:
+        self.webhook_url: str = CONFIG["notifications"]["discord_webhook_url"]
+
+
+    def __make_request(self, json: typing.Any) -> None:
+        if not self.webhook_url:
+            return
+
+        DISCORD_WEBHOOK_QUEUE.enqueue(webhook_url=self.webhook_url, data=json)
+
+
+    def flush(self) -> None:
+        if not self.webhook_url:
+            return
+
+        DISCORD_WEBHOOK_QUEUE.flush()
+
+
     def send_webhook_embed(self, embed_color: EmbedColor, title: str, description: str = "", content: str = "", fields: list[dict[str, str | bool]] = []) -> None:
         if not self.webhook_url:
             return
@@ -1,7 +1,13 @@
 import os
-import subprocess
+import stat
+from typing import Generator, Iterator, Sequence
 from loguru import logger
 
+from src.utils.io_budget import IO_BUDGET
+from src.utils.job_stop import JOB_STOP
+from src.utils.metrics import METRICS
+from src.utils.stat_engine import STAT_ENGINE
+
 
 class FileUtils:
     def __init__(self, data_path: str, torrents_path: str, media_path: str) -> None:
@@ -10,95 +16,244 @@ class FileUtils:
         self.media_path = media_path if media_path.endswith("/") else f"{media_path}/"
 
 
-    def find_hard_links(self, file_path: str) -> list[str]:
+    def get_content_inodes(self, content_path: str) -> set[tuple[int, int]]:
         """
-        Finds all hard links to a given file on a Linux system.
+        Collects the identity of every hard linked file of a torrent.
+        Files with a link count of 1 can only be shared through the same path, so they are skipped.
 
         Args:
-            file_path (str): The path to the file.
+            content_path (str): The path to the file/dir
 
         Returns:
-            list: A list of paths to all hard links, including the original.
-                Returns an empty list if the file is not found or an error occurs.
+            set: A set of (st_dev, st_ino) tuples, empty if the content doesn't exist
         """
-        if not os.path.exists(file_path):
-            logger.error(f"Error: File not found at '{file_path}'")
-            return []
-
         try:
-            stats = os.stat(file_path)
-            inode_num = stats.st_ino
+            METRICS.increment("fs_operations_total", operation="stat")
+            stats = IO_BUDGET.stat(content_path, follow_symlinks=False)
+        except OSError:
+            return set()
+        if not stat.S_ISDIR(stats.st_mode):
+            return {(stats.st_dev, stats.st_ino)} if stats.st_nlink > 1 else set()
+        return self.__get_hard_linked_inodes(file_paths=self.__get_file_paths(root_path=content_path))
 
-            command = ['find', self.data_path, '-xdev', '-inum', str(inode_num)]
-            result = subprocess.check_output(command, stderr=subprocess.DEVNULL, text=True)
-            result_list: list[str] = result.strip().split('\n')
-            logger.trace(f"Hard links for {file_path}")
-            [logger.trace(f"--> {r}") for r in result_list]
-            return result_list
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            logger.error(f"An error occurred: {e}")
-            return []
 
-
-    def get_link_count(self, file_path: str) -> int:
+    def __get_file_paths(self, root_path: str) -> list[str]:
+        """
+        Lists all files below root_path, symlinks are not followed
         """
-        Gets the link count to a given file
+        file_paths: list[str] = []
+        pending_dirs: list[str] = [root_path]
+        scandir_count = 0
+        while pending_dirs:
+            JOB_STOP.check()
+            dir_path = pending_dirs.pop()
+            try:
+                scandir_count += 1
+                with IO_BUDGET.scandir(dir_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            file_paths.append(entry.path)
+            except OSError as e:
+                logger.warning(f"Could not scan {dir_path} for hard linked files: {e}")
+        METRICS.increment("fs_operations_total", scandir_count, operation="scandir")
+        return file_paths
 
-        Args:
-            file_path (str): The path to the file.
 
-        Returns:
-            int: An int of the count of links, including the original (always minimum of 1).
-                Returns -1 if an error happened.
+    def __get_hard_linked_inodes(self, file_paths: Sequence[str]) -> set[tuple[int, int]]:
         """
-        try:
-            file_stat = os.stat(file_path)
-            link_count = file_stat.st_nlink
-            logger.trace(f"link count for {file_path} is {link_count}")
-            return link_count
-        except FileNotFoundError: # This can happen if a file is deleted while the script is running
-            logger.warning(f"Warning: Could not find file {file_path}")
-        except Exception as e:
-            logger.error(f"An error occurred with {file_path}: {e}")
-        return -1
-
-
-    def is_content_in_media_library(self, content_path: str) -> bool:
+        Stats the files with the stat engine and collects the (st_dev, st_ino) of the ones with more than one link
+        """
+        inodes: set[tuple[int, int]] = set()
+        for file_path, stats in STAT_ENGINE.stat_many(paths=file_paths, follow_symlinks=False):
+            if isinstance(stats, OSError):
+                logger.warning(f"Could not stat {file_path} for hard linked files: {stats}")
+                continue
+            if stats.st_nlink > 1:
+                inodes.add((stats.st_dev, stats.st_ino))
+        METRICS.increment("fs_operations_total", len(file_paths), operation="stat")
+        return inodes
+
+
+    def is_content_in_media_index(self, content_path: str, media_inode_index: set[tuple[int, int]]) -> bool:
         """
-        Checks if the content_path has any connection to the media_path via a link.
-        Recursively goes through all files in the folder and checks for links to the media path.
-        content_path supports file path and dir path.
+        Checks if the content_path has any connection to the media_path via a link, by checking its files
+        against the media inode index.
         Args:
             content_path (str): The path to the file/dir
+            media_inode_index (set): The index returned by MediaIndex.refresh
         Returns:
             bool: Whether any of the content (or links of it) is in the media path
         Raises:
             Exception: When something wents wrong and this should not be processed
         """
-        def has_file_content_in_media_library(file_path: str) -> bool:
-            link_count: int = self.get_link_count(file_path=file_path)
-            if link_count == -1:
-                raise Exception("Exception while searching for link count")
-            if link_count > 1:
-                if any([self.media_path in f for f in self.find_hard_links(file_path=file_path)]):
+        def has_files_content_in_media_index(file_paths: Sequence[str]) -> bool:
+            # Stops at the first file in the media library, the remaining files are not stat'ed
+            for file_path, stats in STAT_ENGINE.stat_many(paths=file_paths):
+                METRICS.increment("fs_operations_total", operation="stat")
+                if isinstance(stats, FileNotFoundError): # This can happen if a file is deleted while the script is running
+                    logger.warning(f"Warning: Could not find file {file_path}")
+                    raise Exception("Exception while searching for link count")
+                if isinstance(stats, OSError):
+                    raise stats
+                if stats.st_nlink > 1 and (stats.st_dev, stats.st_ino) in media_inode_index:
                     logger.trace(f"{file_path} does have hard links in media library")
                     return True
-                else:
-                    logger.trace(f"{file_path} does not have hard links in media library")
             return False
 
+        METRICS.increment("fs_operations_total", operation="stat")
+        IO_BUDGET.spend()
         if os.path.isdir(content_path):
             logger.trace(f"{content_path} is a dir")
             for root, _, files in os.walk(content_path):
-                for filename in files:
-                    file_path = os.path.join(root, filename)
-                    if has_file_content_in_media_library(file_path=file_path):
-                        return True
+                JOB_STOP.check()
+                METRICS.increment("fs_operations_total", operation="scandir")
+                IO_BUDGET.spend()
+                if has_files_content_in_media_index(file_paths=[os.path.join(root, filename) for filename in files]):
+                    return True
         elif os.path.isfile(content_path):
+            METRICS.increment("fs_operations_total", operation="stat")
             logger.trace(f"{content_path} is a file")
-            if has_file_content_in_media_library(file_path=content_path):
+            if has_files_content_in_media_index(file_paths=[content_path]):
                 return True
         else:
+            METRICS.increment("fs_operations_total", operation="stat")
             logger.warning(f"Not a dir or file, probably be deleted: {content_path}")
             raise Exception("Exception while checking for isdir or isfile")
         return False
+
+
+    def walk_orphan_candidates(self, root_path: str, known_paths: set[str]) -> Iterator[tuple[os.DirEntry, bool]]:
+        """
+        Walks root_path bottom-up (same order as os.walk with topdown=False) and yields every
+        file that is not in known_paths and every empty dir that is not in known_paths.
+        Every dir is read only once, emptiness is decided from the entries that were already enumerated.
+        root_path itself is never yielded.
+
+        Args:
+            root_path (str): The path to walk
+            known_paths (set[str]): Paths that are not orphaned
+
+        Yields:
+            tuple: The DirEntry of the orphan candidate and whether it is a file
+        """
+        def walk_dir(dir_path: str) -> Generator[tuple[os.DirEntry, bool], None, int]:
+            JOB_STOP.check()
+            file_entries: list[os.DirEntry] = []
+            dir_entries: list[os.DirEntry] = []
+            METRICS.increment("fs_operations_total", operation="scandir")
+            try:
+                with IO_BUDGET.scandir(dir_path) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        (dir_entries if is_dir else file_entries).append(entry)
+            except OSError as e:
+                logger.warning(f"Could not scan {dir_path}: {e}")
+                return -1
+
+            empty_dir_entries: list[os.DirEntry] = []
+            for dir_entry in dir_entries:
+                # Symlinked dirs are not followed, like in os.walk
+                if dir_entry.is_symlink():
+                    METRICS.increment("fs_operations_total", operation="scandir")
+                    try:
+                        IO_BUDGET.spend()
+                        entry_count = len(os.listdir(dir_entry.path))
+                    except OSError as e:
+                        logger.warning(f"Could not scan {dir_entry.path}: {e}")
+                        entry_count = -1
+                else:
+                    entry_count = yield from walk_dir(dir_path=dir_entry.path)
+                if entry_count == 0:
+                    empty_dir_entries.append(dir_entry)
+                else:
+                    logger.trace(f"{dir_entry.path} is not empty, ignoring it")
+
+            for file_entry in file_entries:
+                if file_entry.path in known_paths:
+                    logger.trace(f"{file_entry.path} is in qbit_file_paths, ignoring it")
+                    continue
+                yield file_entry, True
+            for dir_entry in empty_dir_entries:
+                if dir_entry.path in known_paths:
+                    logger.trace(f"{dir_entry.path} is in qbit_file_paths, ignoring it")
+                    continue
+                yield dir_entry, False
+
+            return len(file_entries) + len(dir_entries)
+
+        yield from walk_dir(dir_path=root_path)
+
+
+    def get_orphan_candidates(self, root_path: str, paths: set[str], dirty_dirs: set[str], known_paths: set[str]) -> Iterator[tuple[os.DirEntry, bool]]:
+        """
+        Evaluates single paths and the files of dirty dirs instead of walking the whole root_path.
+        A path is an orphan candidate under the same rules as in walk_orphan_candidates,
+        every parent dir is read only once. Paths outside of root_path and root_path itself are ignored.
+
+        Args:
+            root_path (str): The path that is normally walked
+            paths (set[str]): Files and dirs to evaluate (not their subtrees)
+            dirty_dirs (set[str]): Dirs whose own emptiness and direct files have to be evaluated
+            known_paths (set[str]): Paths that are not orphaned
+
+        Yields:
+            tuple: The DirEntry of the orphan candidate and whether it is a file
+        """
+        root_path = root_path.rstrip("/") or "/"
+        root_prefix = f"{root_path}/"
+        target_paths: set[str] = {path.rstrip("/") for path in paths | dirty_dirs}
+        target_paths = {path for path in target_paths if path.startswith(root_prefix)}
+
+        names_by_parent: dict[str, set[str]] = {}
+        for path in target_paths:
+            parent, name = os.path.split(path)
+            names_by_parent.setdefault(parent, set()).add(name)
+        for dirty_dir in dirty_dirs:
+            dirty_dir = dirty_dir.rstrip("/") or "/"
+            if dirty_dir == root_path or dirty_dir.startswith(root_prefix):
+                names_by_parent.setdefault(dirty_dir, set())
+
+        # Deepest dirs first, like a bottom-up walk
+        for parent in sorted(names_by_parent, key=lambda path: path.count("/"), reverse=True):
+            JOB_STOP.check()
+            names = names_by_parent[parent]
+            is_dirty = parent in dirty_dirs or f"{parent}/" in dirty_dirs
+            METRICS.increment("fs_operations_total", operation="scandir")
+            try:
+                with IO_BUDGET.scandir(parent) as entries:
+                    for entry in entries:
+                        if entry.name not in names and not is_dirty:
+                            continue
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        # Dirs of a dirty parent are only evaluated if they are dirty or targets themselves
+                        if is_dir and entry.name not in names:
+                            continue
+                        if entry.path in known_paths:
+                            logger.trace(f"{entry.path} is in qbit_file_paths, ignoring it")
+                            continue
+                        if not is_dir:
+                            yield entry, True
+                            continue
+                        METRICS.increment("fs_operations_total", operation="scandir")
+                        try:
+                            with IO_BUDGET.scandir(entry.path) as children:
+                                is_empty = next(children, None) is None
+                        except OSError as e:
+                            logger.warning(f"Could not scan {entry.path}: {e}")
+                            continue
+                        if is_empty:
+                            yield entry, False
+                        else:
+                            logger.trace(f"{entry.path} is not empty, ignoring it")
+            except FileNotFoundError:
+                logger.trace(f"{parent} does not exist anymore, ignoring it")
+            except OSError as e:
+                logger.warning(f"Could not scan {parent}: {e}")
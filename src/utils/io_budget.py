@@ -0,0 +1,249 @@
+import ctypes
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+from loguru import logger
+
+from src.data.config import CONFIG
+from src.utils.metrics import METRICS
+
+
+# linux/ioprio.h
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3
+# (ioprio_set, ioprio_get) syscall numbers
+IOPRIO_SYSCALLS: dict[str, tuple[int, int]] = {
+    "x86_64": (251, 252),
+    "aarch64": (30, 31),
+    "armv7l": (314, 315),
+    "i686": (289, 290),
+}
+
+
+class IoBudget:
+    """
+    Limits the filesystem operations (stat, scandir) of all jobs together, so scans don't slow down seeding.
+    - max_ops_per_second: token bucket with a burst of one second
+    - slow_op_ms: halves the rate every second while operations take longer than this on average
+      and raises it again slowly when they are fast
+    - idle_io_priority: the threads of the scans get the idle io class (ioprio_set) while scanning
+
+    Everything is read from the io_budget config on first use and does nothing if it isn't set.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.is_loaded = False
+        self.is_enabled = False
+        self.max_ops_per_second: float = 0
+        self.min_ops_per_second: float = 10
+        self.slow_op_seconds: float = 0
+        self.is_idle_io_priority = False
+        self.libc: Optional[ctypes.CDLL] = None
+        self.normal_io_priority: Optional[int] = None
+        # Current rate, 0 is unlimited
+        self.ops_per_second: float = 0
+        # Rate before backing off without max_ops_per_second, the rate is unlimited again once it's reached
+        self.unlimited_ops_per_second: float = 0
+        self.tokens: float = 0
+        self.updated_at: float = 0
+        # Measurements of the current one second window
+        self.window_start: float = 0
+        self.window_ops = 0
+        self.window_latency_seconds: float = 0
+        self.window_latency_count = 0
+
+
+    def __load(self) -> None:
+        with self.lock:
+            if self.is_loaded:
+                return
+            io_budget_config: dict[str, Any] = CONFIG.get("io_budget") or {}
+            self.max_ops_per_second = float(io_budget_config.get("max_ops_per_second") or 0)
+            self.slow_op_seconds = float(io_budget_config.get("slow_op_ms") or 0) / 1000
+            self.is_idle_io_priority = bool(io_budget_config.get("idle_io_priority", False))
+            self.min_ops_per_second = min(self.min_ops_per_second, self.max_ops_per_second) if self.max_ops_per_second > 0 else self.min_ops_per_second
+            self.ops_per_second = self.max_ops_per_second
+            self.tokens = self.max_ops_per_second
+            self.updated_at = self.window_start = time.monotonic()
+            self.is_enabled = self.max_ops_per_second > 0 or self.slow_op_seconds > 0
+            if self.is_idle_io_priority:
+                self.normal_io_priority = self.__get_io_priority()
+            self.is_loaded = True
+            if self.is_enabled or self.is_idle_io_priority:
+                logger.debug(f"IO budget: {self.max_ops_per_second or "unlimited"} ops/s, slow op {self.slow_op_seconds * 1000}ms, idle io priority {self.is_idle_io_priority}")
+
+
+    def spend(self, count: int = 1) -> None:
+        """
+        Waits until count filesystem operations are allowed
+        """
+        if not self.is_loaded:
+            self.__load()
+        if not self.is_enabled:
+            return
+        wait_seconds: float = 0
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.__adjust_rate(now=now)
+            self.window_ops += count
+            if self.ops_per_second > 0:
+                self.tokens = min(self.ops_per_second, self.tokens + (now - self.updated_at) * self.ops_per_second) - count
+                self.updated_at = now
+                if self.tokens < 0:
+                    wait_seconds = -self.tokens / self.ops_per_second
+        if wait_seconds > 0:
+            METRICS.increment("io_budget_wait_seconds_total", wait_seconds)
+            time.sleep(wait_seconds)
+
+
+    def __adjust_rate(self, now: float) -> None:
+        window_seconds: float = now - self.window_start
+        observed_ops_per_second: float = self.window_ops / window_seconds
+        average_latency_seconds: float = self.window_latency_seconds / self.window_latency_count if self.window_latency_count else 0
+        self.window_start = now
+        self.window_ops = 0
+        self.window_latency_seconds = 0
+        self.window_latency_count = 0
+        # After an idle gap (e.g. between job runs) the window says nothing about the current rate, a new one is started
+        if self.slow_op_seconds <= 0 or window_seconds > 2:
+            return
+
+        if average_latency_seconds > self.slow_op_seconds:
+            if self.ops_per_second > 0:
+                current_ops_per_second = min(self.ops_per_second, observed_ops_per_second)
+            else:
+                current_ops_per_second = self.unlimited_ops_per_second = observed_ops_per_second
+            self.ops_per_second = max(self.min_ops_per_second, current_ops_per_second / 2)
+            self.tokens = min(self.tokens, self.ops_per_second)
+            logger.debug(f"Filesystem operations take {round(average_latency_seconds * 1000, 2)}ms, backing off to {round(self.ops_per_second)} ops/s")
+        elif self.ops_per_second > 0 and self.ops_per_second != self.max_ops_per_second:
+            self.ops_per_second *= 1.25
+            if self.max_ops_per_second > 0:
+                self.ops_per_second = min(self.ops_per_second, self.max_ops_per_second)
+            elif self.ops_per_second >= self.unlimited_ops_per_second:
+                self.ops_per_second = 0
+                logger.debug("Filesystem operations are fast again, not limiting them anymore")
+        METRICS.set_gauge("io_budget_ops_per_second", self.ops_per_second)
+
+
+    def __record_latency(self, seconds: float) -> None:
+        # Only needed for the back-off, a lost update of the window doesn't matter
+        self.window_latency_seconds += seconds
+        self.window_latency_count += 1
+
+
+    def stat(self, path: str, follow_symlinks: bool = True) -> os.stat_result:
+        self.spend()
+        if not self.slow_op_seconds:
+            return os.stat(path, follow_symlinks=follow_symlinks)
+        start = time.perf_counter()
+        try:
+            return os.stat(path, follow_symlinks=follow_symlinks)
+        finally:
+            self.__record_latency(time.perf_counter() - start)
+
+
+    def scandir(self, path: str) -> "os._ScandirIterator[str]":
+        self.spend()
+        if not self.slow_op_seconds:
+            return os.scandir(path)
+        start = time.perf_counter()
+        try:
+            return os.scandir(path)
+        finally:
+            self.__record_latency(time.perf_counter() - start)
+
+
+    def is_background_io(self) -> bool:
+        """
+        Returns:
+            bool: Whether the current thread is inside background_io
+        """
+        return getattr(self.local, "depth", 0) > 0
+
+
+    @contextmanager
+    def background_io(self) -> Iterator[None]:
+        """
+        Gives the current thread the idle io class while inside, if idle_io_priority is enabled.
+        Can be nested.
+        """
+        if not self.is_loaded:
+            self.__load()
+        depth: int = getattr(self.local, "depth", 0)
+        previous_io_priority: Optional[int] = None
+        if self.is_idle_io_priority and depth == 0:
+            previous_io_priority = self.__get_io_priority()
+            if previous_io_priority is not None and not self.__set_io_priority(io_priority=IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT):
+                previous_io_priority = None
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            if previous_io_priority is not None:
+                self.__set_io_priority(io_priority=previous_io_priority)
+
+
+    def reset_io_priority(self) -> None:
+        """
+        Gives the current thread the io priority the process had before any scan.
+        New threads inherit the io priority of the thread that starts them, e.g. the idle class inside background_io.
+        """
+        if not self.is_loaded:
+            self.__load()
+        if self.is_idle_io_priority and self.normal_io_priority is not None and self.__get_io_priority() != self.normal_io_priority:
+            self.__set_io_priority(io_priority=self.normal_io_priority)
+
+
+    def __get_ioprio_syscalls(self) -> Optional[tuple[int, int]]:
+        syscalls: Optional[tuple[int, int]] = IOPRIO_SYSCALLS.get(platform.machine())
+        if syscalls is None:
+            logger.warning(f"idle_io_priority is not supported on {platform.system()} {platform.machine()}, disabling it")
+            self.is_idle_io_priority = False
+            return None
+        if self.libc is None:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+        return syscalls
+
+
+    def __get_io_priority(self) -> Optional[int]:
+        """
+        Returns:
+            int: The io priority of the current thread, None if it can't be read
+        """
+        syscalls: Optional[tuple[int, int]] = self.__get_ioprio_syscalls()
+        if syscalls is None or self.libc is None:
+            return None
+        # who 0 is the calling thread
+        io_priority: int = self.libc.syscall(syscalls[1], IOPRIO_WHO_PROCESS, 0)
+        if io_priority < 0:
+            logger.warning(f"Could not get the io priority, disabling idle_io_priority: {os.strerror(ctypes.get_errno())}")
+            self.is_idle_io_priority = False
+            return None
+        return io_priority
+
+
+    def __set_io_priority(self, io_priority: int) -> bool:
+        """
+        Returns:
+            bool: True if the io priority of the current thread has been changed, false otherwise
+        """
+        syscalls: Optional[tuple[int, int]] = self.__get_ioprio_syscalls()
+        if syscalls is None or self.libc is None:
+            return False
+        if self.libc.syscall(syscalls[0], IOPRIO_WHO_PROCESS, 0, io_priority) < 0:
+            logger.warning(f"Could not set the io priority, disabling idle_io_priority: {os.strerror(ctypes.get_errno())}")
+            self.is_idle_io_priority = False
+            return False
+        logger.trace(f"Changed io priority of the thread to {io_priority}")
+        return True
+
+
+IO_BUDGET = IoBudget()
@@ -1,32 +1,134 @@
+import random
+import threading
 import time
-import schedule
-from typing import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+from loguru import logger
+
+from src.utils.job_stop import JOB_STOP, JobAbortedError
+
+
+class ScheduledJob:
+    def __init__(self, job_name: str, job_method: Callable[[], None], interval_seconds: float, resources: set[str], jitter_seconds: float) -> None:
+        self.job_name = job_name
+        self.job_method = job_method
+        self.interval_seconds = interval_seconds
+        self.resources = resources
+        self.jitter_seconds = jitter_seconds
+        self.next_run: float = 0
+        self.future: Optional[Future] = None
+        # Due, but a resource is used by another job
+        self.is_waiting = False
+        self.waiting_since: float = 0
+        self.schedule_next_run(now=time.monotonic())
+
+
+    def schedule_next_run(self, now: float) -> None:
+        self.next_run = now + self.interval_seconds + random.uniform(0, self.jitter_seconds)
+
+
+    def is_running(self) -> bool:
+        return self.future is not None and not self.future.done()
 
 
 class JobManager:
-    def __init__(self) -> None:
-        self.queue: list[Callable[[], None]] = []
+    def __init__(self, max_workers: int = 2) -> None:
+        self.jobs: list[ScheduledJob] = []
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        # Jobs that use the same resource (e.g. filesystem) never run at the same time
+        self.resource_locks: dict[str, threading.Lock] = {}
+        self.wake_event = threading.Event()
         self.running = True
 
 
-    def __enqueue(self, job_func) -> None:
-        self.queue.append(job_func)
+    def add_job(self, job_name: str, job_method: Callable[[], None], interval_hours: int, resources: set[str] = set(), jitter_seconds: float = 0) -> None:
+        for resource in resources:
+            self.resource_locks.setdefault(resource, threading.Lock())
+        self.jobs.append(ScheduledJob(
+            job_name=job_name,
+            job_method=job_method,
+            interval_seconds=interval_hours * 60 * 60,
+            resources=set(resources),
+            jitter_seconds=jitter_seconds,
+        ))
+        self.wake_event.set()
+
 
+    def __run_job(self, job: ScheduledJob) -> None:
+        try:
+            job.job_method()
+        except JobAbortedError:
+            logger.info(f"Job {job.job_name} has been aborted, its plan has not been applied")
+        except Exception:
+            logger.exception(f"Job {job.job_name} failed")
 
-    def __run_pending_sequential(self) -> None:
-        if self.queue:
-            job_func = self.queue.pop(0)
-            job_func()
 
+    def __try_start_job(self, job: ScheduledJob) -> bool:
+        """
+        Submits the job if all of its resources are free, without blocking.
+        The resource locks are held by the scheduler until the run is done, so a waiting job never takes a worker.
 
-    def add_job(self, job_method: Callable[[], None], interval_hours: int) -> None:
-        schedule.every(interval_hours).hours.do(self.__enqueue, job_method)
+        Returns:
+            bool: True if the job has been submitted, false if a resource is busy
+        """
+        acquired_locks: list[threading.Lock] = []
+        for resource in sorted(job.resources):
+            lock = self.resource_locks[resource]
+            if not lock.acquire(blocking=False):
+                for acquired_lock in reversed(acquired_locks):
+                    acquired_lock.release()
+                return False
+            acquired_locks.append(lock)
+
+        def release_locks(_: Future) -> None:
+            for acquired_lock in reversed(acquired_locks):
+                acquired_lock.release()
+            # Waiting jobs can start now
+            self.wake_event.set()
+
+        job.is_waiting = False
+        job.future = self.executor.submit(self.__run_job, job)
+        job.future.add_done_callback(release_locks)
+        return True
 
 
     def start_blocking_scheduler(self) -> None:
-        while True:
-            if not self.running:
-                break
-            schedule.run_pending()
-            self.__run_pending_sequential()
-            time.sleep(1)
+        while self.running:
+            now = time.monotonic()
+            for job in self.jobs:
+                if job.next_run > now:
+                    continue
+                job.schedule_next_run(now=now)
+                if job.is_running():
+                    logger.warning(f"Skipping job {job.job_name}, the previous run is still running")
+                    continue
+                if job.is_waiting:
+                    logger.warning(f"Skipping job {job.job_name}, the previous run is still waiting for {", ".join(sorted(job.resources))}")
+                    continue
+                job.is_waiting = True
+                job.waiting_since = now
+
+            # Jobs that have been waiting the longest get a free resource first
+            for job in sorted((job for job in self.jobs if job.is_waiting), key=lambda job: job.waiting_since):
+                if not self.__try_start_job(job=job):
+                    logger.debug(f"Job {job.job_name} is waiting for {", ".join(sorted(job.resources))}")
+
+            # Sleep until the next job is due or something wakes the scheduler up (e.g. a finished job)
+            sleep_seconds: Optional[float] = min((job.next_run for job in self.jobs), default=None)
+            if sleep_seconds is not None:
+                sleep_seconds = max(sleep_seconds - time.monotonic(), 0)
+            self.wake_event.wait(timeout=sleep_seconds)
+            self.wake_event.clear()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def shutdown(self) -> None:
+        """
+        Stops the scheduler, jobs that are waiting for a resource are not started anymore.
+        Running jobs are aborted at their next dir or torrent (see JOB_STOP), this waits for them.
+        """
+        self.running = False
+        self.wake_event.set()
+        JOB_STOP.request()
+        self.executor.shutdown(wait=True, cancel_futures=True)
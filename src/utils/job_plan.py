@@ -0,0 +1,136 @@
+import json
+import os
+import typing
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from types import MappingProxyType
+from loguru import logger
+
+from src.data.config import CONFIG
+from src.data.constants import PLANS_FOLDER_PATH
+from src.utils.strike_utils import StrikeResult
+
+
+@dataclass(frozen=True)
+class PlannedAction:
+    # Torrent hash or orphaned path
+    key: str
+    name: str
+    # The configured action (test, stop or delete)
+    action: str
+    delete_files: bool
+    strike_result: StrikeResult
+    note: typing.Optional[str] = None
+    # Torrents of the same content group share files (ContentIdentityIndex), only set when files are deleted
+    content_group: typing.Optional[str] = None
+    # Job specific data for the notification (torrent, trackers, stats), not exported
+    context: typing.Any = field(default=None, compare=False, repr=False)
+
+
+@dataclass(frozen=True)
+class JobPlan:
+    """
+    Everything a job run decided, before anything has been changed:
+    which hashes get a strike or a reset, their projected strike results and the actions to take.
+    """
+    job_name: str
+    strike_hashes: tuple[str, ...]
+    reset_hashes: tuple[str, ...]
+    strike_results: typing.Mapping[str, StrikeResult]
+    actions: tuple[PlannedAction, ...]
+    created: str = field(default_factory=lambda: datetime.now().isoformat())
+
+
+    @classmethod
+    def create(cls, job_name: str, strike_hashes: typing.Iterable[str], reset_hashes: typing.Iterable[str], strike_results: dict[str, StrikeResult], actions: typing.Iterable[PlannedAction]) -> "JobPlan":
+        return cls(
+            job_name=job_name,
+            strike_hashes=tuple(strike_hashes),
+            reset_hashes=tuple(reset_hashes),
+            strike_results=MappingProxyType(dict(strike_results)),
+            actions=tuple(actions),
+        )
+
+
+    def get_applicable_actions(self, strike_results: typing.Mapping[str, StrikeResult]) -> list[PlannedAction]:
+        """
+        The actions whose strike limit is still reached with the written strikes, they could have changed since the plan
+        was made (e.g. by another run on the same day or a plan that crossed midnight).
+        A skipped torrent stays in qbittorrent, so the other torrents of its content group don't delete their files.
+
+        Args:
+            strike_results (Mapping[str, StrikeResult]): The results of the written strikes
+
+        Returns:
+            list: The actions to take
+        """
+        applicable_actions: list[PlannedAction] = []
+        kept_content_groups: set[str] = set()
+        for planned_action in self.actions:
+            if strike_results[planned_action.key].is_limit_reached:
+                applicable_actions.append(planned_action)
+                continue
+            logger.warning(f"Strike limit is not reached anymore, skipping: {planned_action.name}")
+            if planned_action.content_group is not None:
+                kept_content_groups.add(planned_action.content_group)
+
+        for i, planned_action in enumerate(applicable_actions):
+            if planned_action.delete_files and planned_action.content_group in kept_content_groups:
+                logger.warning(f"Only deleting torrent and not files for {planned_action.name} A skipped torrent uses these files")
+                applicable_actions[i] = replace(planned_action, delete_files=False, note="Files are used by a torrent that is not deleted")
+        return applicable_actions
+
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        return {
+            "job": self.job_name,
+            "created": self.created,
+            "strike_count": len(self.strike_hashes),
+            "reset_count": len(self.reset_hashes),
+            "actions": [
+                {
+                    "key": planned_action.key,
+                    "name": planned_action.name,
+                    "action": planned_action.action,
+                    "delete_files": planned_action.delete_files,
+                    "strikes": planned_action.strike_result.strikes,
+                    "consecutive_days": planned_action.strike_result.consecutive_days,
+                    "note": planned_action.note,
+                    "content_group": planned_action.content_group,
+                }
+                for planned_action in self.actions
+            ],
+            "strikes": {
+                key: {"strikes": strike_result.strikes, "consecutive_days": strike_result.consecutive_days, "is_limit_reached": strike_result.is_limit_reached}
+                for key, strike_result in self.strike_results.items()
+            },
+            "resets": list(self.reset_hashes),
+        }
+
+
+    def write_json(self) -> str:
+        """
+        Writes the plan to plans/<job>.json in the config folder, replacing the previous one
+
+        Returns:
+            str: The path of the json file
+        """
+        os.makedirs(PLANS_FOLDER_PATH, exist_ok=True)
+        path = os.path.join(PLANS_FOLDER_PATH, f"{self.job_name}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(temp_path, path)
+        return path
+
+
+    def export(self) -> None:
+        """
+        Writes the plan as json if plans.export is enabled
+        """
+        if not (CONFIG.get("plans") or {}).get("export", False):
+            return
+        try:
+            logger.debug(f"Wrote plan of {self.job_name} to {self.write_json()}")
+        except OSError as e:
+            logger.warning(f"Could not write plan of {self.job_name}: {e}")
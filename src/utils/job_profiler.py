@@ -0,0 +1,122 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import shutil
+import threading
+import tracemalloc
+from datetime import datetime
+from typing import Callable
+from loguru import logger
+
+from src.data.constants import PROFILES_FOLDER_PATH
+
+
+class JobProfiler:
+    """
+    Wraps selected jobs with cProfile and/or tracemalloc and writes the results to
+    <config>/profiles/<job>-<timestamp>. Only the newest `keep_runs` profiles per job are kept.
+    cProfile and tracemalloc are process wide, so only one job is profiled at a time.
+    """
+    def __init__(self, job_names: set[str], cpu: bool = True, memory: bool = False, keep_runs: int = 10, top_count: int = 50) -> None:
+        self.job_names = job_names
+        self.cpu = cpu
+        self.memory = memory
+        self.keep_runs = keep_runs
+        self.top_count = top_count
+        self.lock = threading.Lock()
+
+
+    def wrap(self, job_name: str, job_method: Callable[[], None]) -> Callable[[], None]:
+        """
+        Returns:
+            Callable: The job method, wrapped with the profilers if the job is selected
+        """
+        if job_name not in self.job_names or not (self.cpu or self.memory):
+            return job_method
+        logger.info(f"Profiling job {job_name} ({", ".join(name for name, enabled in (("cpu", self.cpu), ("memory", self.memory)) if enabled)})")
+
+        @functools.wraps(job_method)
+        def profiled_job_method() -> None:
+            if not self.lock.acquire(blocking=False):
+                logger.warning(f"Not profiling this run of {job_name}, another job is being profiled")
+                job_method()
+                return
+            try:
+                self.__run_profiled(job_name=job_name, job_method=job_method)
+            finally:
+                self.lock.release()
+        return profiled_job_method
+
+
+    def __run_profiled(self, job_name: str, job_method: Callable[[], None]) -> None:
+        profile_path = os.path.join(PROFILES_FOLDER_PATH, f"{job_name}-{datetime.now().strftime("%Y%m%d-%H%M%S")}")
+        profile = cProfile.Profile() if self.cpu else None
+        start_snapshot = None
+        if self.memory:
+            tracemalloc.start(25)
+            start_snapshot = tracemalloc.take_snapshot()
+
+        try:
+            if profile:
+                profile.enable()
+            job_method()
+        finally:
+            if profile:
+                profile.disable()
+            try:
+                os.makedirs(profile_path, exist_ok=True)
+                if profile:
+                    self.__write_cpu_profile(profile=profile, profile_path=profile_path)
+                if start_snapshot:
+                    self.__write_memory_profile(start_snapshot=start_snapshot, profile_path=profile_path)
+                logger.info(f"Wrote profile of {job_name} to {profile_path}")
+                self.__apply_retention(job_name=job_name)
+            except OSError as e:
+                logger.error(f"Could not write profile of {job_name}: {e}")
+            finally:
+                if start_snapshot:
+                    tracemalloc.stop()
+
+
+    def __write_cpu_profile(self, profile: cProfile.Profile, profile_path: str) -> None:
+        # job.prof can be opened with snakeviz or `python -m pstats`
+        profile.dump_stats(os.path.join(profile_path, "job.prof"))
+        report = io.StringIO()
+        stats = pstats.Stats(profile, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_count)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top_count)
+        with open(os.path.join(profile_path, "cpu.txt"), "w") as f:
+            f.write(report.getvalue())
+
+
+    def __write_memory_profile(self, start_snapshot: tracemalloc.Snapshot, profile_path: str) -> None:
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        end_snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        lines: list[str] = [
+            "Allocations of the whole process (other threads included) while the job ran",
+            f"Current: {round(current_bytes / 1024 / 1024, 2)}MiB | Peak: {round(peak_bytes / 1024 / 1024, 2)}MiB",
+            "",
+            f"Top {self.top_count} allocations still alive at the end of the run:",
+        ]
+        lines.extend(str(statistic) for statistic in end_snapshot.statistics("lineno")[:self.top_count])
+        lines.extend(["", f"Top {self.top_count} allocation changes during the run:"])
+        lines.extend(str(statistic) for statistic in end_snapshot.compare_to(start_snapshot, "lineno")[:self.top_count])
+        lines.extend(["", f"Top {self.top_count} allocation tracebacks:"])
+        for statistic in end_snapshot.statistics("traceback")[:self.top_count]:
+            lines.append(f"{statistic.count} blocks, {round(statistic.size / 1024, 1)}KiB")
+            lines.extend(f"    {line}" for line in statistic.traceback.format())
+        with open(os.path.join(profile_path, "memory.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+    def __apply_retention(self, job_name: str) -> None:
+        # Timestamps sort chronologically
+        profile_names: list[str] = sorted(
+            name for name in os.listdir(PROFILES_FOLDER_PATH)
+            if name.startswith(f"{job_name}-") and name.removeprefix(f"{job_name}-").replace("-", "").isdigit()
+        )
+        for name in profile_names[:-self.keep_runs] if self.keep_runs > 0 else []:
+            logger.debug(f"Removing old profile {name}")
+            shutil.rmtree(os.path.join(PROFILES_FOLDER_PATH, name), ignore_errors=True)
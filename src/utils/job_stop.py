@@ -0,0 +1,32 @@
+import threading
+
+
+class JobAbortedError(Exception):
+    """
+    Raised by the scans of a job once a shutdown has been requested, the job ends without applying its plan
+    """
+
+
+class JobStop:
+    """
+    Set on shutdown, so a running job doesn't hold up the shutdown for the rest of a long scan.
+    The scan loops call check() once per dir or torrent.
+    """
+    def __init__(self) -> None:
+        self.event = threading.Event()
+
+
+    def request(self) -> None:
+        self.event.set()
+
+
+    def check(self) -> None:
+        """
+        Raises:
+            JobAbortedError: If a shutdown has been requested
+        """
+        if self.event.is_set():
+            raise JobAbortedError("Shutdown has been requested")
+
+
+JOB_STOP = JobStop()
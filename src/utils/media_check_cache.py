@@ -0,0 +1,49 @@
+
+from src.utils.file_utils import FileUtils
+from src.utils.io_budget import IO_BUDGET
+from src.utils.metrics import METRICS
+
+
+class MediaCheckCache:
+    """
+    Remembers the media check result per content path for one job run, so cross-seeded torrents
+    and repeated checks of the same torrent inspect a content tree only once.
+    A result is only reused while the mtime of the content path is unchanged.
+    """
+    def __init__(self, file_utils: FileUtils) -> None:
+        self.file_utils = file_utils
+        # content_path -> (st_mtime_ns, result)
+        self.results: dict[str, tuple[int, bool]] = {}
+
+
+    def clear(self) -> None:
+        """
+        Needs to be called at the start of every run
+        """
+        self.results = {}
+
+
+    def is_content_in_media_index(self, content_path: str, media_inode_index: set[tuple[int, int]]) -> bool:
+        """
+        Same as FileUtils.is_content_in_media_index, but cached per content path
+
+        Raises:
+            Exception: When something wents wrong and this should not be processed (never cached)
+        """
+        METRICS.increment("fs_operations_total", operation="stat")
+        try:
+            mtime_ns: int = IO_BUDGET.stat(content_path).st_mtime_ns
+        except OSError:
+            # Let the uncached check raise the usual exception
+            self.results.pop(content_path, None)
+            return self.file_utils.is_content_in_media_index(content_path=content_path, media_inode_index=media_inode_index)
+
+        cached = self.results.get(content_path)
+        if cached and cached[0] == mtime_ns:
+            METRICS.increment("media_check_cache_total", result="hit")
+            return cached[1]
+
+        METRICS.increment("media_check_cache_total", result="miss")
+        result: bool = self.file_utils.is_content_in_media_index(content_path=content_path, media_inode_index=media_inode_index)
+        self.results[content_path] = (mtime_ns, result)
+        return result
@@ -0,0 +1,155 @@
+import os
+import random
+from loguru import logger
+
+from src.utils.db_manager import DbManager
+from src.utils.io_budget import IO_BUDGET
+from src.utils.job_stop import JOB_STOP
+from src.utils.metrics import METRICS
+from src.utils.stat_engine import STAT_ENGINE
+
+
+class MediaIndex:
+    def __init__(self, media_path: str) -> None:
+        self.media_path = media_path.rstrip("/") or "/"
+        self.consistency_sample_size = 64
+
+
+    def refresh(self, full_rebuild: bool = False) -> set[tuple[int, int]]:
+        """
+        Brings the persisted media inode index up to date and returns it.
+        Only directories whose mtime changed since the last scan are read again,
+        unchanged directories cost a single stat call.
+        A full rebuild happens on demand or when the consistency check fails.
+
+        Args:
+            full_rebuild (bool): Whether to ignore the stored directories and scan everything again.
+
+        Returns:
+            set: A set of (st_dev, st_ino) tuples of all files in the media path.
+                Files are stored whatever their link count, a file can get hard linked later without changing the mtime of its dir.
+        """
+        if not full_rebuild:
+            self.__scan(full_rebuild=False)
+            if not self.__is_consistent():
+                logger.warning("Media index consistency check failed, doing a full rebuild")
+                full_rebuild = True
+        if full_rebuild:
+            self.__scan(full_rebuild=True)
+
+        with DbManager() as db:
+            rows = db.execute_fetchall(query="SELECT dev, ino FROM media_index_files")
+        media_inode_index: set[tuple[int, int]] = {(row["dev"], row["ino"]) for row in rows}
+        logger.debug(f"Media index contains {len(media_inode_index)} files")
+        return media_inode_index
+
+
+    def __scan(self, full_rebuild: bool) -> None:
+        stored_dirs: dict[str, int] = {}
+        stored_children: dict[str, list[str]] = {}
+        with DbManager() as db:
+            if full_rebuild:
+                logger.debug("Rebuilding the media index from scratch")
+                db.execute(query="DELETE FROM media_index_files")
+                db.execute(query="DELETE FROM media_index_dirs")
+            else:
+                for row in db.execute_fetchall(query="SELECT path, parent, mtime_ns FROM media_index_dirs"):
+                    stored_dirs[row["path"]] = row["mtime_ns"]
+                    stored_children.setdefault(row["parent"], []).append(row["path"])
+
+        # Writes are buffered and flushed in short transactions, so other jobs are not blocked during the scan
+        rescanned_dirs: list[tuple[str, str | None, int, list[tuple[str, str, int, int]]]] = []
+        seen_dirs: set[str] = set()
+        stat_count = 0
+        rescanned_count = 0
+        pending_dirs: list[tuple[str, str | None]] = [(self.media_path, None)]
+        while pending_dirs:
+            # Dirs that are not stored yet are scanned on the next refresh after an abort
+            JOB_STOP.check()
+            dir_path, parent = pending_dirs.pop()
+            try:
+                dir_stats = IO_BUDGET.stat(dir_path)
+                stat_count += 1
+            except OSError as e:
+                logger.warning(f"Could not stat {dir_path} for the media index: {e}")
+                continue
+            seen_dirs.add(dir_path)
+
+            # Entries of a dir can't change without changing its mtime
+            if stored_dirs.get(dir_path) == dir_stats.st_mtime_ns:
+                pending_dirs.extend((child, dir_path) for child in stored_children.get(dir_path, []))
+                continue
+
+            logger.trace(f"Rescanning {dir_path} for the media index")
+            file_rows: list[tuple[str, str, int, int]] = []
+            try:
+                file_entries: list[os.DirEntry] = []
+                with IO_BUDGET.scandir(dir_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append((entry.path, dir_path))
+                        elif entry.is_file(follow_symlinks=False):
+                            file_entries.append(entry)
+                file_paths: list[str] = [entry.path for entry in file_entries]
+                for entry, (_, stats) in zip(file_entries, STAT_ENGINE.stat_many(paths=file_paths, follow_symlinks=False)):
+                    if isinstance(stats, OSError):
+                        raise stats
+                    stat_count += 1
+                    file_rows.append((dir_path, entry.name, stats.st_dev, stats.st_ino))
+            except OSError as e:
+                logger.warning(f"Could not scan {dir_path} for the media index: {e}")
+                continue
+            rescanned_count += 1
+
+            # Store the mtime from before the scan, so changes during the scan are picked up next time
+            rescanned_dirs.append((dir_path, parent, dir_stats.st_mtime_ns, file_rows))
+            if len(rescanned_dirs) >= 500:
+                self.__write_dirs(rescanned_dirs=rescanned_dirs)
+                rescanned_dirs = []
+        self.__write_dirs(rescanned_dirs=rescanned_dirs)
+
+        removed_dirs = [(dir_path,) for dir_path in stored_dirs if dir_path not in seen_dirs]
+        with DbManager() as db:
+            db.execute_many(query="DELETE FROM media_index_files WHERE dir = ?", params_seq=removed_dirs)
+            db.execute_many(query="DELETE FROM media_index_dirs WHERE path = ?", params_seq=removed_dirs)
+
+        METRICS.increment("fs_operations_total", stat_count, operation="stat")
+        METRICS.increment("fs_operations_total", rescanned_count, operation="scandir")
+        logger.debug(f"Media index refreshed ({rescanned_count} dirs rescanned, {len(removed_dirs)} dirs removed, {stat_count} stat calls)")
+
+
+    def __write_dirs(self, rescanned_dirs: list[tuple[str, str | None, int, list[tuple[str, str, int, int]]]]) -> None:
+        with DbManager() as db:
+            for dir_path, parent, mtime_ns, file_rows in rescanned_dirs:
+                db.execute(query="DELETE FROM media_index_files WHERE dir = ?", params=(dir_path,))
+                db.execute_many(query="INSERT INTO media_index_files (dir, name, dev, ino) VALUES (?, ?, ?, ?)", params_seq=file_rows)
+                db.execute(query="INSERT OR REPLACE INTO media_index_dirs (path, parent, mtime_ns) VALUES (?, ?, ?)", params=(dir_path, parent, mtime_ns))
+
+
+    def __is_consistent(self) -> bool:
+        """
+        Compares a random sample of stored files against the filesystem.
+
+        Returns:
+            bool: True if every sampled file still has the stored identity, false otherwise
+        """
+        with DbManager() as db:
+            row = db.execute_fetchone(query="SELECT MAX(rowid) AS max_rowid FROM media_index_files")
+            if not row or row["max_rowid"] is None:
+                return True
+            rowids = [random.randint(1, row["max_rowid"]) for _ in range(self.consistency_sample_size)]
+            placeholders = ", ".join("?" for _ in rowids)
+            rows = db.execute_fetchall(query=f"SELECT dir, name, dev, ino FROM media_index_files WHERE rowid IN ({placeholders})", params=tuple(rowids))
+
+        for row in rows:
+            file_path = os.path.join(row["dir"], row["name"])
+            METRICS.increment("fs_operations_total", operation="stat")
+            try:
+                stats = IO_BUDGET.stat(file_path, follow_symlinks=False)
+            except OSError:
+                logger.debug(f"Media index entry does not exist anymore: {file_path}")
+                return False
+            if (stats.st_dev, stats.st_ino) != (row["dev"], row["ino"]):
+                logger.debug(f"Media index entry is outdated: {file_path}")
+                return False
+        return True
@@ -0,0 +1,216 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterator, Optional
+from loguru import logger
+
+from src.data.constants import CONFIG_FOLDER_PATH, METRICS_FILE_PATH
+from src.utils.job_stop import JobAbortedError
+
+
+METRIC_PREFIX = "qbit_cleaner"
+METRIC_HELP: dict[str, tuple[str, str]] = {
+    "job_runs_total": ("counter", "Finished job runs"),
+    "job_last_run_seconds": ("gauge", "Wall time of the last run of a job"),
+    "job_last_run_phase_seconds": ("gauge", "Wall time of a phase in the last run of a job"),
+    "job_last_run_timestamp_seconds": ("gauge", "Unix time the last run of a job finished"),
+    "qbittorrent_requests_total": ("counter", "Requests to the qbittorrent api"),
+    "fs_operations_total": ("counter", "Filesystem calls (stat, scandir)"),
+    "db_statements_total": ("counter", "Executed sqlite statements"),
+    "media_check_cache_total": ("counter", "Media library checks answered from the per-run cache (hit) or the filesystem (miss)"),
+    "torrents_evaluated_total": ("counter", "Torrents (or orphan paths) checked by a job"),
+    "strikes_total": ("counter", "Strikes given to torrents (or orphan paths)"),
+    "actions_total": ("counter", "Actions taken on torrents (or orphan paths)"),
+    "io_budget_wait_seconds_total": ("counter", "Seconds filesystem scans waited for the io budget"),
+    "io_budget_ops_per_second": ("gauge", "Current limit of filesystem operations per second, 0 is unlimited"),
+}
+
+
+class Metrics:
+    """
+    Collects counters and timings of the job runs. Everything that happens while a job runs in the current thread
+    is labeled with that job. Exposed in prometheus text format on an optional http endpoint and as json file.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # (name, sorted labels) -> value
+        self.values: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        self.runs: Optional[list[dict[str, Any]]] = None
+        self.max_runs = 200
+        self.server: Optional[ThreadingHTTPServer] = None
+
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        job_run: Optional[dict[str, Any]] = getattr(self.local, "job_run", None)
+        job_name: str = job_run["job"] if job_run else "none"
+        key = (name, tuple(sorted({"job": job_name, **labels}.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+        if job_run is not None:
+            counter_key = ",".join([name, *(f"{label}={label_value}" for label, label_value in sorted(labels.items()))])
+            job_run["counters"][counter_key] = job_run["counters"].get(counter_key, 0) + value
+
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = value
+
+
+    @contextmanager
+    def phase(self, phase_name: str) -> Iterator[None]:
+        """
+        Times a phase of the current job run
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            job_run: Optional[dict[str, Any]] = getattr(self.local, "job_run", None)
+            if job_run is not None:
+                job_run["phases"][phase_name] = job_run["phases"].get(phase_name, 0) + time.perf_counter() - start
+
+
+    def track_job(self, job_name: str, job_method: Callable[[], None]) -> Callable[[], None]:
+        """
+        Wraps a job method, so everything it does is labeled with the job and its run is recorded
+
+        Returns:
+            Callable: The wrapped job method
+        """
+        @functools.wraps(job_method)
+        def tracked_job_method() -> None:
+            job_run: dict[str, Any] = {
+                "job": job_name,
+                "started": datetime.now().isoformat(),
+                "phases": {},
+                "counters": {},
+            }
+            self.local.job_run = job_run
+            status = "failed"
+            start = time.perf_counter()
+            try:
+                job_method()
+                status = "success"
+            except JobAbortedError:
+                status = "aborted"
+                raise
+            finally:
+                duration_seconds = time.perf_counter() - start
+                self.local.job_run = None
+                job_run["status"] = status
+                job_run["duration_seconds"] = duration_seconds
+                self.__finish_job_run(job_run=job_run)
+        return tracked_job_method
+
+
+    def __finish_job_run(self, job_run: dict[str, Any]) -> None:
+        job_name: str = job_run["job"]
+        with self.lock:
+            key = ("job_runs_total", (("job", job_name), ("status", job_run["status"])))
+            self.values[key] = self.values.get(key, 0) + 1
+            # Phases of the previous run are dropped, a phase that didn't run this time has no value
+            for value_key in [value_key for value_key in self.values if value_key[0] == "job_last_run_phase_seconds" and ("job", job_name) in value_key[1]]:
+                del self.values[value_key]
+        self.set_gauge("job_last_run_seconds", job_run["duration_seconds"], job=job_name)
+        self.set_gauge("job_last_run_timestamp_seconds", time.time(), job=job_name)
+        for phase_name, seconds in job_run["phases"].items():
+            self.set_gauge("job_last_run_phase_seconds", seconds, job=job_name, phase=phase_name)
+        logger.debug(f"Job {job_name} took {round(job_run["duration_seconds"], 2)}s (phases: {", ".join(f"{phase_name} {round(seconds, 2)}s" for phase_name, seconds in job_run["phases"].items())})")
+
+        try:
+            self.__write_json(job_run=job_run)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not write {METRICS_FILE_PATH}: {e}")
+
+
+    def __write_json(self, job_run: dict[str, Any]) -> None:
+        with self.lock:
+            # Runs of previous starts are kept, so the growth of run times over time is visible
+            if self.runs is None:
+                self.runs = []
+                if os.path.exists(METRICS_FILE_PATH):
+                    with open(METRICS_FILE_PATH) as f:
+                        self.runs = list(json.load(f).get("runs", []))
+            self.runs.append(job_run)
+            self.runs = self.runs[-self.max_runs:]
+            data: dict[str, Any] = {
+                "updated": datetime.now().isoformat(),
+                "metrics": [
+                    {"name": f"{METRIC_PREFIX}_{name}", "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.values.items())
+                ],
+                "runs": self.runs,
+            }
+        os.makedirs(CONFIG_FOLDER_PATH, exist_ok=True)
+        temp_path = f"{METRICS_FILE_PATH}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, METRICS_FILE_PATH)
+
+
+    def to_prometheus(self) -> str:
+        """
+        Returns:
+            str: All metrics in the prometheus text format
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+        lines: list[str] = []
+        last_name: Optional[str] = None
+        for (name, labels), value in values:
+            if name != last_name:
+                metric_type, metric_help = METRIC_HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {METRIC_PREFIX}_{name} {metric_help}")
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+                last_name = name
+            label_text = ",".join(f"{label}=\"{self.__escape_label_value(label_value)}\"" for label, label_value in labels)
+            lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+    def __escape_label_value(self, value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+    def start_http_server(self, host: str, port: int) -> None:
+        """
+        Serves the metrics on http://host:port/metrics in a background thread
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+
+    def stop_http_server(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+METRICS = Metrics()
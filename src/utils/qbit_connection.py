@@ -1,27 +1,38 @@
 import qbittorrentapi
+import threading
 import typing
 import time
 from loguru import logger
 
 from src.data.config import CONFIG
+from src.utils.metrics import METRICS
+
+
+class InstrumentedClient(qbittorrentapi.Client):
+    def _request(self, http_method: str, api_namespace: typing.Any, api_method: str, **kwargs: typing.Any) -> typing.Any:
+        # Every api call (including retries and logins) goes through here
+        METRICS.increment("qbittorrent_requests_total", endpoint=f"{getattr(api_namespace, "value", api_namespace)}/{api_method}")
+        return super()._request(http_method, api_namespace, api_method, **kwargs)
 
 
 class QbitConnection:
+    """
+    The client is created and logged in when it's first needed (or by connect_in_background),
+    so importing this never touches the network
+    """
     def __init__(self) -> None:
         self.max_login_try_count = 3
+        self.lock = threading.RLock()
+        self.client: typing.Optional[qbittorrentapi.Client] = None
 
-        self.conn_info: dict[str, typing.Any] = dict(
+
+    def __make_client(self) -> qbittorrentapi.Client:
+        return InstrumentedClient(
             host=CONFIG["qbittorrent"]["host"],
             port=CONFIG["qbittorrent"]["port"],
             username=CONFIG["qbittorrent"]["username"],
             password=CONFIG["qbittorrent"]["password"],
         )
-        self.client = self.__make_client()
-        self.__login()
-
-
-    def __make_client(self) -> qbittorrentapi.Client:
-        return qbittorrentapi.Client(**self.conn_info)
 
 
     def __login(self, try_count: int = 1) -> bool:
@@ -55,10 +66,49 @@ class QbitConnection:
 
 
     def get_client(self) -> qbittorrentapi.Client:
-        if self.__is_connection_ok():
-            return self.client
-        else:
-            raise ConnectionError("Unable to establish a connection to qBittorrent.")
+        # Jobs can run at the same time, only one of them should check the connection and log in again
+        with self.lock:
+            if self.client is None:
+                client = self.__make_client()
+                self.client = client
+                if not self.__login():
+                    self.client = None
+                    raise ConnectionError("Unable to establish a connection to qBittorrent.")
+                return client
+            if self.__is_connection_ok():
+                return self.client
+            else:
+                raise ConnectionError("Unable to establish a connection to qBittorrent.")
+
+
+    def connect_in_background(self) -> None:
+        """
+        Logs in on a background thread, so startup doesn't wait for qbittorrent.
+        Jobs that need the client in the meantime wait for the login.
+        """
+        def connect() -> None:
+            try:
+                self.get_client()
+            except ConnectionError:
+                logger.error("Couldn't establish connection with qbittorrent, trying again when a job needs it")
+
+        threading.Thread(target=connect, name="qbittorrent-login", daemon=True).start()
+
+
+    def log_out(self) -> None:
+        """
+        Logs out if logged in, never logs in for that
+        """
+        if not self.lock.acquire(timeout=5):
+            return
+        try:
+            if self.client is not None:
+                self.client.auth_log_out()
+                self.client = None
+        except (qbittorrentapi.APIError, ConnectionError):
+            pass
+        finally:
+            self.lock.release()
 
 
 QBIT_CONNECTION = QbitConnection()
@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Iterator, Optional, Sequence
+from loguru import logger
+
+from src.data.config import CONFIG
+from src.utils.io_budget import IO_BUDGET
+
+
+StatResult = os.stat_result | OSError
+
+
+class StatEngine:
+    """
+    Stats many paths on a bounded thread pool, for filesystems where every stat is a round-trip (e.g. NFS).
+    Results are yielded in the order of the paths and no new stats are started once the caller stops iterating,
+    so checks can stop at the first match. Every stat goes through IO_BUDGET.
+    With 1 worker (default) the paths are stat'ed one after another in the calling thread.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.workers: Optional[int] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+
+    def __get_workers(self) -> int:
+        if self.workers is None:
+            stat_engine_config: dict[str, Any] = CONFIG.get("stat_engine") or {}
+            self.workers = max(1, int(stat_engine_config.get("workers") or 1))
+        return self.workers
+
+
+    def __get_executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                logger.debug(f"Starting stat engine with {self.__get_workers()} workers")
+                self.executor = ThreadPoolExecutor(max_workers=self.__get_workers(), thread_name_prefix="stat", initializer=IO_BUDGET.reset_io_priority)
+            return self.executor
+
+
+    def stat_many(self, paths: Sequence[str], follow_symlinks: bool = True) -> Iterator[tuple[str, StatResult]]:
+        """
+        Args:
+            paths (Sequence[str]): The paths to stat
+            follow_symlinks (bool): Same as in os.stat
+
+        Yields:
+            tuple: The path and its stat result or the OSError of the stat, in the order of paths
+        """
+        workers: int = self.__get_workers()
+        if workers == 1 or len(paths) <= 1:
+            for path in paths:
+                try:
+                    yield path, IO_BUDGET.stat(path, follow_symlinks=follow_symlinks)
+                except OSError as e:
+                    yield path, e
+            return
+
+        # Chunks are small enough to keep every worker busy, they only save the io priority switches of the workers
+        chunk_size: int = max(1, min(32, len(paths) // (workers * 2)))
+        chunks: list[Sequence[str]] = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+        is_background_io: bool = IO_BUDGET.is_background_io()
+        executor: ThreadPoolExecutor = self.__get_executor()
+        pending: deque[tuple[Sequence[str], Future[list[StatResult]]]] = deque()
+        next_chunk = 0
+        try:
+            while pending or next_chunk < len(chunks):
+                # At most 2 chunks per worker are queued, so not much is stat'ed for nothing after a short-circuit
+                while next_chunk < len(chunks) and len(pending) < workers * 2:
+                    chunk = chunks[next_chunk]
+                    pending.append((chunk, executor.submit(self.__stat_chunk, chunk, follow_symlinks, is_background_io)))
+                    next_chunk += 1
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+    def __stat_chunk(self, paths: Sequence[str], follow_symlinks: bool, is_background_io: bool) -> list[StatResult]:
+        # Workers get the io priority of the thread that asked for the stats
+        with IO_BUDGET.background_io() if is_background_io else nullcontext():
+            return [self.__stat(path=path, follow_symlinks=follow_symlinks) for path in paths]
+
+
+    def __stat(self, path: str, follow_symlinks: bool) -> StatResult:
+        try:
+            return IO_BUDGET.stat(path, follow_symlinks=follow_symlinks)
+        except OSError as e:
+            return e
+
+
+STAT_ENGINE = StatEngine()
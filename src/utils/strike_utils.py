@@ -1,8 +1,11 @@
+from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 from enum import Enum
+from typing import Iterable
 from loguru import logger
 
 from src.utils.db_manager import DbManager
+from src.utils.metrics import METRICS
 from src.data.config import CONFIG
 
 
@@ -12,103 +15,154 @@ class StrikeType(Enum):
     DELETE_ORPHANED = "delete_orphaned"
 
 
+@dataclass(frozen=True)
+class StrikeResult:
+    strikes: int
+    consecutive_days: int
+    is_limit_reached: bool
+
+
 class StrikeUtils:
-    def __init__(self, strike_type: StrikeType, torrent_hash: str) -> None:
+    def __init__(self, strike_type: StrikeType) -> None:
         self.strike_type = strike_type
-        self.torrent_hash = torrent_hash
+        # One row per hash with the strike count and the current streak, days are date ordinals
+        self.streaks_table = f"{strike_type.value}_strike_streaks"
+        # Optional raw strike history, bounded by strike_history_days
+        self.history_table = f"{strike_type.value}_strikes"
 
 
-    def strike_torrent(self) -> bool:
+    def strike_torrents(self, strike_hashes: Iterable[str], reset_hashes: Iterable[str] = ()) -> dict[str, StrikeResult]:
         """
-        Strikes a torrent while keeping the min days and required strikes in mind
+        Strikes and resets many torrents at once in a single transaction
+
+        Args:
+            strike_hashes (Iterable[str]): The hashes to strike
+            reset_hashes (Iterable[str]): The hashes to reset
 
         Returns:
-            bool: True if limit has been reached, false otherwise
+            dict: The strike result of every striked hash
         """
-        logger.trace(f"Striking torrent with hash {self.torrent_hash}")
-
-        # Insert to strike
-        with DbManager() as db:
-            db.execute(query=f"INSERT INTO {self.strike_type.value}_strikes (hash, timestamp) VALUES (?, ?)", params=(self.torrent_hash, datetime.now()))
-
-        strikes: int = self.get_strikes()
-        consecutively_days: int = self.get_consecutive_days()
-
+        strike_hashes = list(dict.fromkeys(strike_hashes))
+        reset_hashes = list(dict.fromkeys(reset_hashes))
         required_strikes = CONFIG["jobs"][self.strike_type.value]["required_strikes"]
         min_strike_days = CONFIG["jobs"][self.strike_type.value]["min_strike_days"]
+        strike_history_days: int = CONFIG["jobs"][self.strike_type.value].get("strike_history_days", 0)
 
-        # If required strikes and min not working days are reached, delete torrent and return true
-        if strikes >= required_strikes and consecutively_days >= min_strike_days:
-            logger.trace(f"Torrent with hash {self.torrent_hash} has reached {strikes} strikes in {consecutively_days} days")
-            return True
+        logger.trace(f"Striking {len(strike_hashes)} and resetting {len(reset_hashes)} torrents")
+        METRICS.increment("strikes_total", len(strike_hashes))
 
-        logger.trace(f"Torrent with hash {self.torrent_hash} has not reached it's limit ({strikes}/{required_strikes} strikes, {consecutively_days}/{min_strike_days} days)")
-        return False
+        now = datetime.now()
+        today: int = now.date().toordinal()
 
-
-    def reset_torrent(self) -> None:
-        with DbManager() as db:
-            row = db.execute_fetchone(query=f"SELECT * FROM {self.strike_type.value}_strikes WHERE hash = ?", params=(self.torrent_hash,))
-            if not row:
-                return
-            logger.trace(f"Torrent with hash {self.torrent_hash} is being deleted from db due to reset")
-            db.execute(query=f"DELETE FROM {self.strike_type.value}_strikes WHERE hash = ?", params=(self.torrent_hash,))
-
-
-    def cleanup_db(self, hashes: list[str]) -> None:
         with DbManager() as db:
-            rows = db.execute_fetchall(query=f"SELECT hash FROM {self.strike_type.value}_strikes GROUP BY hash")
-
+            # Reset
+            self.__fill_temp_hashes(db=db, hashes=reset_hashes)
+            reset_count = db.execute(query=f"DELETE FROM {self.streaks_table} WHERE hash IN (SELECT hash FROM temp.strike_utils_hashes)")
+            db.execute(query=f"DELETE FROM {self.history_table} WHERE hash IN (SELECT hash FROM temp.strike_utils_hashes)")
+            logger.trace(f"Deleted {reset_count} torrents from db due to reset")
+
+            # Strike, the streak goes on if the last strike was today or yesterday
+            db.execute_many(
+                query=f"""
+                INSERT INTO {self.streaks_table} (hash, strikes, streak_start_day, last_strike_day, first_seen)
+                VALUES (?, 1, ?, ?, ?)
+                ON CONFLICT (hash) DO UPDATE SET
+                    strikes = strikes + 1,
+                    streak_start_day = CASE WHEN last_strike_day >= excluded.last_strike_day - 1 THEN streak_start_day ELSE excluded.last_strike_day END,
+                    last_strike_day = MAX(last_strike_day, excluded.last_strike_day)
+                """,
+                params_seq=[(torrent_hash, today, today, int(now.timestamp())) for torrent_hash in strike_hashes],
+            )
+
+            # Raw history
+            if strike_history_days > 0:
+                db.execute_many(query=f"INSERT INTO {self.history_table} (hash, timestamp) VALUES (?, ?)", params_seq=[(torrent_hash, now.isoformat(" ")) for torrent_hash in strike_hashes])
+            db.execute(query=f"DELETE FROM {self.history_table} WHERE timestamp < ?", params=((now - timedelta(days=strike_history_days)).isoformat(" "),))
+
+            self.__fill_temp_hashes(db=db, hashes=strike_hashes)
+            rows = db.execute_fetchall(query=f"""
+                SELECT s.hash, s.strikes, s.last_strike_day - s.streak_start_day + 1 AS consecutive_days
+                FROM {self.streaks_table} s JOIN temp.strike_utils_hashes h ON h.hash = s.hash
+            """)
+
+        results: dict[str, StrikeResult] = {}
         for row in rows:
-            torrent_hash = row["hash"]
-            logger.trace(f"not torrent_hash in hashes | not {torrent_hash} in hashes | {not torrent_hash in hashes}")
-            if not torrent_hash in hashes:
-                StrikeUtils(strike_type=self.strike_type, torrent_hash=torrent_hash).reset_torrent()
-                logger.trace(f"Deleted torrent with hash {torrent_hash} from db because it's not in qbittorrent anymore")
+            strikes: int = row["strikes"]
+            consecutively_days: int = row["consecutive_days"]
+            results[row["hash"]] = StrikeResult(
+                strikes=strikes,
+                consecutive_days=consecutively_days,
+                is_limit_reached=strikes >= required_strikes and consecutively_days >= min_strike_days,
+            )
+        return results
 
 
-    # Utils
+    def project_strikes(self, strike_hashes: Iterable[str]) -> dict[str, StrikeResult]:
+        """
+        Calculates the results strike_torrents would return today, without writing anything
+
+        Args:
+            strike_hashes (Iterable[str]): The hashes that would be striked
 
+        Returns:
+            dict: The projected strike result of every hash
+        """
+        strike_hashes = list(dict.fromkeys(strike_hashes))
+        required_strikes = CONFIG["jobs"][self.strike_type.value]["required_strikes"]
+        min_strike_days = CONFIG["jobs"][self.strike_type.value]["min_strike_days"]
+        today: int = date.today().toordinal()
 
-    def get_strikes(self) -> int:
         with DbManager() as db:
-            row = db.execute_fetchone(query=f"SELECT COUNT(*) as strikes FROM {self.strike_type.value}_strikes WHERE hash = ?", params=(self.torrent_hash,))
+            self.__fill_temp_hashes(db=db, hashes=strike_hashes)
+            rows = db.execute_fetchall(query=f"""
+                SELECT s.hash, s.strikes, s.streak_start_day, s.last_strike_day
+                FROM {self.streaks_table} s JOIN temp.strike_utils_hashes h ON h.hash = s.hash
+            """)
+        rows_by_hash = {row["hash"]: row for row in rows}
+
+        results: dict[str, StrikeResult] = {}
+        for torrent_hash in strike_hashes:
+            row = rows_by_hash.get(torrent_hash)
+            if row is None:
+                strikes, streak_start_day, last_strike_day = 1, today, today
+            else:
+                # Same as the upsert of strike_torrents
+                strikes = row["strikes"] + 1
+                streak_start_day = row["streak_start_day"] if row["last_strike_day"] >= today - 1 else today
+                last_strike_day = max(row["last_strike_day"], today)
+            consecutively_days: int = last_strike_day - streak_start_day + 1
+            results[torrent_hash] = StrikeResult(
+                strikes=strikes,
+                consecutive_days=consecutively_days,
+                is_limit_reached=strikes >= required_strikes and consecutively_days >= min_strike_days,
+            )
+        return results
+
+
+    def cleanup_db(self, hashes: Iterable[str]) -> None:
+        with DbManager() as db:
+            self.__fill_temp_hashes(db=db, hashes=hashes)
+            deleted_count = db.execute(query=f"""
+                DELETE FROM {self.streaks_table}
+                WHERE NOT EXISTS (SELECT 1 FROM temp.strike_utils_hashes h WHERE h.hash = {self.streaks_table}.hash)
+            """)
+            db.execute(query=f"""
+                DELETE FROM {self.history_table}
+                WHERE NOT EXISTS (SELECT 1 FROM temp.strike_utils_hashes h WHERE h.hash = {self.history_table}.hash)
+            """)
+        logger.trace(f"Deleted {deleted_count} torrents from db because they are not in qbittorrent anymore")
 
-        if not row:
-            return 0
-        
-        return row["strikes"]
 
+    def __fill_temp_hashes(self, db: DbManager, hashes: Iterable[str]) -> None:
+        db.execute(query="CREATE TEMP TABLE IF NOT EXISTS strike_utils_hashes (hash VARCHAR(255) PRIMARY KEY)")
+        db.execute(query="DELETE FROM temp.strike_utils_hashes")
+        db.execute_many(query="INSERT OR IGNORE INTO temp.strike_utils_hashes (hash) VALUES (?)", params_seq=[(torrent_hash,) for torrent_hash in hashes])
 
-    def get_consecutive_days(self) -> int:
-        with DbManager() as db:
-            rows = db.execute_fetchall(query=f"SELECT * FROM {self.strike_type.value}_strikes WHERE hash = ? ORDER BY timestamp DESC", params=(self.torrent_hash,))
 
-        if not rows:
-            return 0
+    # Utils
+
 
-        consecutively_days = 0
-        last_date: date | None = None
-        for row in rows:
-            row_date = datetime.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S.%f").date()
-            if last_date is None:
-                last_date = row_date
-                consecutively_days += 1
-                logger.trace("row_date is none")
-                continue
-            elif row_date == last_date:
-                logger.trace(f"row_date == last_date | {row_date} == {last_date} | {row_date == last_date}")
-                continue
-            else: # row_date is not None and row_date != last_date
-                if row_date == last_date - timedelta(days=1):
-                    logger.trace(f"row_date == last_date - timedelta(days=1) | {row_date} == {last_date - timedelta(days=1)} | {row_date == last_date - timedelta(days=1)}")
-                    last_date = row_date
-                    consecutively_days += 1
-                else:
-                    logger.trace(f"row_date == last_date - timedelta(days=1) | {row_date} == {last_date - timedelta(days=1)} | {row_date == last_date - timedelta(days=1)}")
-                    break
-
-            logger.trace(f"consecutively_days: {consecutively_days}")
-            logger.trace(f"last_date {last_date}")
-
-        return consecutively_days
+    def get_struck_hashes(self) -> list[str]:
+        with DbManager() as db:
+            rows = db.execute_fetchall(query=f"SELECT hash FROM {self.streaks_table}")
+        return [row["hash"] for row in rows]
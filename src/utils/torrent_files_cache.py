@@ -0,0 +1,72 @@
+import json
+import qbittorrentapi
+from loguru import logger
+
+from src.utils.db_manager import DbManager
+from src.utils.qbit_connection import QBIT_CONNECTION
+from src.utils.torrent_record import TorrentRecord
+
+
+class TorrentFilesCache:
+    def get_file_names(self, torrents: list[TorrentRecord]) -> dict[str, list[str]]:
+        """
+        Gets the file names (relative to the save path, like torrents_files returns them) of the given torrents.
+        File lists are cached in the db and only fetched for new torrents or torrents whose content_path or save_path changed.
+        Torrents that are gone are removed from the cache. A file renamed inside a multi file torrent changes neither path,
+        use refresh_file_names for torrents whose cached list could be outdated.
+
+        Args:
+            torrents (list[TorrentRecord]): The torrents to get the file names of
+
+        Returns:
+            dict: The file names per torrent hash
+        """
+        with DbManager() as db:
+            rows = db.execute_fetchall(query="SELECT hash, content_path, save_path, file_names FROM torrent_files_cache")
+        cached_rows = {row["hash"]: row for row in rows}
+
+        qbt_client = QBIT_CONNECTION.get_client()
+        file_names_by_hash: dict[str, list[str]] = {}
+        fetched_rows: list[tuple[str, str, str, str]] = []
+        for torrent in torrents:
+            cached_row = cached_rows.get(torrent.hash)
+            if cached_row and cached_row["content_path"] == torrent.content_path and cached_row["save_path"] == torrent.save_path:
+                file_names_by_hash[torrent.hash] = json.loads(cached_row["file_names"])
+                continue
+            file_names: list[str] = self.__fetch_file_names(qbt_client=qbt_client, torrent=torrent)
+            file_names_by_hash[torrent.hash] = file_names
+            fetched_rows.append((torrent.hash, torrent.content_path, torrent.save_path, json.dumps(file_names)))
+
+        removed_hashes: list[tuple[str]] = [(torrent_hash,) for torrent_hash in cached_rows if torrent_hash not in file_names_by_hash]
+        with DbManager() as db:
+            db.execute_many(query="INSERT OR REPLACE INTO torrent_files_cache (hash, content_path, save_path, file_names) VALUES (?, ?, ?, ?)", params_seq=fetched_rows)
+            db.execute_many(query="DELETE FROM torrent_files_cache WHERE hash = ?", params_seq=removed_hashes)
+
+        logger.debug(f"Got file lists of {len(torrents)} torrents ({len(fetched_rows)} fetched, {len(torrents) - len(fetched_rows)} cached)")
+        return file_names_by_hash
+
+
+    def refresh_file_names(self, torrents: list[TorrentRecord]) -> dict[str, list[str]]:
+        """
+        Fetches the file lists of the given torrents again and updates their cache entries, other entries are kept.
+
+        Args:
+            torrents (list[TorrentRecord]): The torrents to fetch the file names of
+
+        Returns:
+            dict: The file names per torrent hash
+        """
+        qbt_client = QBIT_CONNECTION.get_client()
+        file_names_by_hash: dict[str, list[str]] = {torrent.hash: self.__fetch_file_names(qbt_client=qbt_client, torrent=torrent) for torrent in torrents}
+        with DbManager() as db:
+            db.execute_many(
+                query="INSERT OR REPLACE INTO torrent_files_cache (hash, content_path, save_path, file_names) VALUES (?, ?, ?, ?)",
+                params_seq=[(torrent.hash, torrent.content_path, torrent.save_path, json.dumps(file_names_by_hash[torrent.hash])) for torrent in torrents],
+            )
+        logger.debug(f"Fetched file lists of {len(torrents)} torrents again")
+        return file_names_by_hash
+
+
+    def __fetch_file_names(self, qbt_client: qbittorrentapi.Client, torrent: TorrentRecord) -> list[str]:
+        logger.trace(f"Fetching file list of {torrent.name}")
+        return [str(file.name) for file in qbt_client.torrents_files(torrent_hash=torrent.hash)]
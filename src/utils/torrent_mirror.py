@@ -0,0 +1,47 @@
+import threading
+import typing
+from loguru import logger
+
+from src.utils.qbit_connection import QBIT_CONNECTION
+from src.utils.torrent_record import TorrentRecord
+
+
+class TorrentMirror:
+    def __init__(self) -> None:
+        self.rid: int = 0
+        self.torrents: dict[str, dict[str, typing.Any]] = {}
+        self.lock = threading.Lock()
+
+
+    def sync(self) -> list[dict[str, typing.Any]]:
+        """
+        Updates the local mirror of the torrent list with the changes since the last sync,
+        using the rid delta protocol of sync/maindata. The mirror is only kept in memory,
+        rids belong to a WebUI session, so the first sync after a (re)login is always a full update.
+        Only the fields of TorrentRecord are kept.
+
+        Returns:
+            list: The raw torrent data of all torrents (TorrentRecord.FIELDS of torrents_info)
+        """
+        with self.lock:
+            maindata = QBIT_CONNECTION.get_client().sync_maindata(rid=self.rid)
+            is_full_update: bool = bool(maindata.get("full_update", False))
+            changed_torrents: dict[str, typing.Any] = maindata.get("torrents", {}) or {}
+            removed_hashes: list[str] = maindata.get("torrents_removed", []) or []
+
+            fields = set(TorrentRecord.FIELDS)
+            if is_full_update:
+                self.torrents = {}
+            for torrent_hash, changes in changed_torrents.items():
+                torrent = self.torrents.setdefault(torrent_hash, {"hash": torrent_hash})
+                torrent.update({key: value for key, value in changes.items() if key in fields})
+            for torrent_hash in removed_hashes:
+                self.torrents.pop(torrent_hash, None)
+            self.rid = int(maindata["rid"])
+
+            logger.debug(f"Synced torrent mirror ({"full update" if is_full_update else "delta"}, {len(changed_torrents)} changed, {len(removed_hashes)} removed, {len(self.torrents)} total)")
+
+            return list(self.torrents.values())
+
+
+TORRENT_MIRROR = TorrentMirror()
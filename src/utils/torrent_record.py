@@ -0,0 +1,79 @@
+import typing
+from loguru import logger
+
+
+# States of torrents_info that count as stopped (TorrentState.is_stopped of qbittorrentapi)
+STOPPED_STATES: frozenset[str] = frozenset({"pausedUP", "pausedDL", "stoppedUP", "stoppedDL"})
+
+
+class TorrentRecord:
+    """
+    Compact, read-only view of a torrent with only the fields the jobs need.
+    Derived values (seeding days, stopped, completed) are computed once when the record is created.
+    """
+    FIELDS: tuple[str, ...] = (
+        "hash", "name", "tags", "category", "tracker", "state", "content_path", "save_path",
+        "completion_on", "added_on", "seeding_time", "ratio", "total_size",
+    )
+    __slots__ = FIELDS + ("seeding_time_days", "is_stopped", "is_completed")
+
+
+    def __init__(self, data: dict[str, typing.Any]) -> None:
+        """
+        Args:
+            data (dict): The raw torrent data (torrents_info or sync/maindata fields)
+        """
+        self.hash: str = data["hash"]
+        self.name: str = data.get("name", "")
+        self.tags: str = data.get("tags", "")
+        self.category: str = data.get("category", "")
+        self.tracker: str = data.get("tracker", "")
+        self.state: str = data.get("state", "")
+        self.content_path: str = data.get("content_path", "")
+        self.save_path: str = data.get("save_path", "")
+        self.completion_on: int = data.get("completion_on", -1)
+        self.added_on: int = data.get("added_on", 0)
+        self.seeding_time: int = data.get("seeding_time", 0)
+        self.ratio: float = data.get("ratio", 0)
+        self.total_size: int = data.get("total_size", 0)
+        self.seeding_time_days: float = self.seeding_time / 60 / 60 / 24
+        self.is_stopped: bool = self.state in STOPPED_STATES
+        self.is_completed: bool = self.completion_on != -1
+
+
+class TorrentPreFilter:
+    """
+    The cheap criteria that only need the data of torrents_info, checked for all torrents in one pass
+    before any filesystem or api work is done.
+    """
+    def __init__(self, protected_tag: str, require_completed: bool = False, exclude_stopped: bool = False) -> None:
+        self.protected_tag = protected_tag
+        self.require_completed = require_completed
+        self.exclude_stopped = exclude_stopped
+
+
+    def split(self, torrents: list[TorrentRecord]) -> tuple[list[TorrentRecord], list[TorrentRecord]]:
+        """
+        Returns:
+            tuple: The torrents matching all criteria and the torrents not matching them
+        """
+        protected_tag = self.protected_tag
+        require_completed = self.require_completed
+        exclude_stopped = self.exclude_stopped
+        matching: list[TorrentRecord] = []
+        not_matching: list[TorrentRecord] = []
+        reason_counts: dict[str, int] = {}
+        for torrent in torrents:
+            if protected_tag in torrent.tags.lower():
+                reason = "protection tag"
+            elif require_completed and not torrent.is_completed:
+                reason = "not completed"
+            elif exclude_stopped and torrent.is_stopped:
+                reason = "stopped"
+            else:
+                matching.append(torrent)
+                continue
+            not_matching.append(torrent)
+            reason_counts[reason] = reason_counts.get(reason, 0) + 1
+        logger.debug(f"Pre-filter kept {len(matching)}/{len(torrents)} torrents ({", ".join(f"{count} {reason}" for reason, count in reason_counts.items()) or "none filtered"})")
+        return matching, not_matching
@@ -0,0 +1,48 @@
+import threading
+import time
+from typing import Optional
+from loguru import logger
+
+from src.data.config import CONFIG
+from src.utils.torrent_mirror import TORRENT_MIRROR
+from src.utils.torrent_record import TorrentRecord
+
+
+class TorrentSnapshot:
+    def __init__(self) -> None:
+        self.torrents: Optional[list[TorrentRecord]] = None
+        self.fetched_at: float = 0
+        self.lock = threading.Lock()
+
+
+    def get_torrents(self) -> list[TorrentRecord]:
+        """
+        Gets the torrent list of qbittorrent, shared by all jobs.
+        The list is only synced again when it's older than the configured ttl or has been invalidated.
+        Syncing only transfers the changes since the last sync (see TorrentMirror).
+
+        Returns:
+            list: The torrents of qbittorrent as compact records
+        """
+        ttl_seconds: float = CONFIG["qbittorrent"].get("snapshot_ttl_seconds", 300)
+        with self.lock:
+            if self.torrents is None or time.monotonic() - self.fetched_at > ttl_seconds:
+                logger.trace("Syncing torrent snapshot")
+                self.torrents = [TorrentRecord(data=data) for data in TORRENT_MIRROR.sync()]
+                self.fetched_at = time.monotonic()
+                logger.debug(f"Synced torrent snapshot with {len(self.torrents)} torrents")
+            else:
+                logger.trace(f"Using torrent snapshot from {round(time.monotonic() - self.fetched_at, 2)}s ago")
+            return self.torrents
+
+
+    def invalidate(self) -> None:
+        """
+        Drops the current snapshot, needs to be called after every action that changes torrents
+        """
+        with self.lock:
+            logger.trace("Invalidating torrent snapshot")
+            self.torrents = None
+
+
+TORRENT_SNAPSHOT = TorrentSnapshot()